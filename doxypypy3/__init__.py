@@ -0,0 +1,28 @@
+# coding=utf-8
+__version__ = '0.0.1'
+
+__all__ = ['FilterOptions', 'filterSource']
+
+## Names exported from submodules, which only get imported once used, so
+## that importing the package for its version (as the client does) stays
+## cheap.
+_lazyExports = {
+    'FilterOptions': '.src.api',
+    'filterSource': '.src.api',
+}
+
+
+def __getattr__(name):
+    """Imports the lazily exported names on first use."""
+    if name in _lazyExports:
+        from importlib import import_module
+        value = getattr(import_module(_lazyExports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(
+        __name__, name))
+
+
+def __dir__():
+    """Lists the lazily exported names along with the rest."""
+    return sorted(set(globals()) | set(_lazyExports))
@@ -1,8 +1,6 @@
 # coding=utf-8
-from src.doxypypy import main
+from .src.doxypypy import main
 
 # See if we're running as a script.
 if __name__ == "__main__":
     main()
-
-
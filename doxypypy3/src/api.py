@@ -0,0 +1,72 @@
+# coding=utf-8
+"""
+Filters source in-process, for embedding doxypypy3 in other Python tools.
+
+Doc pipelines, pre-commit hooks, and the like can call filterSource()
+directly instead of starting the filter (and a whole interpreter) once per
+file: it takes the source as text or bytes, the filename it came from, and
+a FilterOptions, and returns the filtered text.  Nothing is read from argv
+or the environment and nothing gets printed (bar the warning for source
+that outruns its time budget), and as the filter's regular
+expressions are compiled once on import, repeated calls only pay for the
+filtering itself.
+
+Both are also available straight from the doxypypy3 package.
+"""
+from typing import NamedTuple, Optional, Tuple, Union
+
+from .cmd_options import getFullPathNamespace
+from .doxypypy import walkSource
+
+
+class FilterOptions(NamedTuple):
+    """
+    The options to filter source with.
+
+    They match the filter's command line options of the same name; left
+    out, the namespace of a file is worked out from its filename just as
+    for the command line filter.
+    """
+
+    ## Parse the docstring for @brief description and other information.
+    autobrief: bool = False
+    ## Parse the docstring for code samples.
+    autocode: bool = False
+    ## A top-level namespace that will be used to trim paths.
+    topLevelNamespace: Optional[str] = None
+    ## The tab length in spaces; only needed if tabs are used.
+    tablength: int = 4
+    ## Enable debug output on stderr.
+    debug: bool = False
+    ## The namespace of the file itself, overriding the one from its filename.
+    fullPathNamespace: Optional[str] = None
+    ## Pass the source through unfiltered, with a warning on stderr, should
+    # filtering it take longer than this many seconds.
+    maxSecondsPerFile: Optional[float] = None
+    ## Pass generated modules through as they are ('pass'), beneath a @file
+    # stub ('stub'), or filter them anyway ('filter').
+    generated: str = 'pass'
+    ## More file name patterns of generated modules.
+    generatedPatterns: Tuple[str, ...] = ()
+    ## More header text of generated modules.
+    generatedSignatures: Tuple[str, ...] = ()
+
+
+def filterSource(source: Union[str, bytes], filename: str,
+                 options: Optional[FilterOptions] = None) -> str:
+    """
+    Filters the given source and returns the filtered text.
+
+    The source may be given as text or as bytes, which get decoded going by
+    their BOM or coding cookie just like a file would (as UTF-8 otherwise);
+    filename is where it came from, which is what its namespace gets
+    derived from.  The result is what the command line filter prints for
+    the same file, less the final newline.  Raises a SyntaxError if the
+    source isn't Python.
+    """
+    if options is None:
+        options = FilterOptions()
+    if options.fullPathNamespace is None:
+        options = options._replace(fullPathNamespace=getFullPathNamespace(
+            filename, options.topLevelNamespace))
+    return walkSource(source, filename, options).getLines()
@@ -2,11 +2,41 @@
 
 from ast import iter_fields, AST, Name, get_docstring
 
-from icecream import ic
-
 from .compile import RE, linesep
 
 
+def _noDebug(*args):
+    """Stands in for icecream's ic while debug output is off."""
+
+
+## Where debug output goes: icecream's ic with --debug, nowhere otherwise.
+# icecream (and pygments, colorama, executing and asttokens along with it)
+# is only imported once debugging is asked for.
+ic = _noDebug
+
+
+def _hasDocstring(node):
+    """
+    Tells whether a node has a docstring with more than whitespace in it.
+
+    The docstring isn't cleaned up, as that would import inspect just to
+    find out whether it's empty.
+    """
+    docstring = get_docstring(node, clean=False)
+    return bool(docstring and docstring.strip())
+
+
+def setDebug(debug):
+    """Turns debug output on or off for all walkers."""
+    global ic
+    if debug:
+        from icecream import ic
+        ic.configureOutput(includeContext=True)
+        ic.enable()
+    else:
+        ic = _noDebug
+
+
 class AstVisit:
     def __init__(self, lines: list, options, inFilename: str):
         """Initialize a few class variables in preparation for our walk."""
@@ -14,9 +44,13 @@ class AstVisit:
         self.options = options
         self.inFilename = inFilename
         self.docLines = []
+        ## The line the docstring being processed starts on, counting from 1.
+        self.docstringLineNum = None
+        ## Whether the walk got done within its time budget (see
+        # parseWithinBudget()), rather than the lines being left as they were.
+        self.complete = True
 
-        ic.configureOutput(includeContext=True)
-        ic.enable() if self.options.debug else ic.disable()
+        setDebug(self.options.debug)
 
     def _getFullPathName(self, containingNodes):
         """
@@ -70,7 +104,7 @@ class AstVisit:
         """
 
         ic("# Module {0}{1}".format(self.options.fullPathNamespace, linesep))
-        if get_docstring(node):
+        if _hasDocstring(node):
             self._processDocstring(node)
         # Visit any contained nodes (in this case pretty much everything).
         self.generic_visit(node,
@@ -121,7 +155,7 @@ class AstVisit:
             contextTag = tail
 
         contextTag = self._processMembers(node, contextTag)
-        if get_docstring(node):
+        if _hasDocstring(node):
             self._processDocstring(node, contextTag,
                                    containingNodes=containingNodes)
         # Visit any contained nodes.
@@ -151,7 +185,7 @@ class AstVisit:
             tail = '@namespace {0}'.format(modifiedContextTag)
         else:
             tail = self._processMembers(node, '')
-        if get_docstring(node):
+        if _hasDocstring(node):
             self._processDocstring(node, tail,
                                    containingNodes=containingNodes)
         # Visit any contained nodes.
@@ -0,0 +1,433 @@
+# coding=utf-8
+"""
+Filters a whole source tree into a mirror directory in a single process.
+
+Rather than having Doxygen start the filter once per file via INPUT_FILTER,
+the batch subcommand walks a source tree, filters every matching file, and
+writes the results to the same relative location beneath an output
+directory.  Doxygen's INPUT can then point straight at the mirror.
+
+With more than one job the files are spread across a pool of worker
+processes, handing out the most expensive files first so that one huge
+module doesn't start last and hold up the whole run.  A file that can't be
+filtered is reported and copied to the mirror unchanged.
+
+Rerunning into the same mirror only filters the files that have changed
+since, going by a manifest the previous run left in the mirror.  Given a
+git revision, the files to filter are instead the ones git reports as
+changed since then (see gitchanges.py), which spares walking the tree.
+
+The tree can also be split into shards filtered on separate machines and
+merged afterwards (see shard.py).
+"""
+from copy import copy
+from fnmatch import fnmatch
+from hashlib import sha256
+from json import dumps, load
+from multiprocessing import Pool
+from os import cpu_count, makedirs, rmdir, sep, stat, unlink, walk
+from os.path import abspath, basename, dirname, exists, join, normpath, relpath
+from re import compile as regexpCompile, escape, MULTILINE
+from shutil import copyfile
+from sys import exit as sysExit, stderr
+
+from .. import __version__
+from .cmd_options import batchOptParse, getFullPathNamespace
+from .compile import linesep
+from .doxypypy import walkFile
+
+## Where a mirror records what it was filtered from.
+ManifestFile = '.doxypypy3-manifest.json'
+
+
+def findSourceFiles(srcDir, patterns, excludeDirs=()):
+    """
+    Yields the paths of all files beneath srcDir matching any of patterns.
+
+    The paths are rooted at srcDir just as given.  Directories listed in
+    excludeDirs (such as an output directory inside the source tree) are
+    not descended into.  Files are produced in a stable, sorted order.
+    """
+    excludeDirs = set(abspath(excludeDir) for excludeDir in excludeDirs)
+    for dirPath, dirNames, fileNames in walk(srcDir):
+        dirNames[:] = sorted(dirName for dirName in dirNames
+                             if abspath(join(dirPath, dirName)) not in excludeDirs)
+        for fileName in sorted(fileNames):
+            if any(fnmatch(fileName, pattern) for pattern in patterns):
+                yield join(dirPath, fileName)
+
+
+def getFileOptions(options, inFilename):
+    """
+    Returns a copy of options set up for filtering the given file.
+
+    The namespace is worked out exactly as for the single-file filter, from
+    the absolute path Doxygen would have handed it, so it doesn't depend on
+    how the source tree was named on our command line.
+    """
+    fileOptions = copy(options)
+    fileOptions.fullPathNamespace = getFullPathNamespace(
+        abspath(inFilename), options.topLevelNamespace)
+    return fileOptions
+
+
+def writeOutput(outFilename, output):
+    """Writes filtered output, already encoded, to the mirror."""
+    makedirs(dirname(outFilename), exist_ok=True)
+    with open(outFilename, 'wb') as outFile:
+        outFile.write(output)
+
+
+## How many bytes of plain source a single docstring is reckoned to cost.
+DocstringCost = 2048
+## How much of a file to look at when counting its docstrings.
+CostSampleSize = 65536
+
+
+def estimateCost(inFilename):
+    """
+    Estimates how expensive filtering a file will be.
+
+    Most of the work goes into docstrings, so on top of the file size every
+    docstring (counted by its triple quotes) adds a fixed amount.  Only the
+    start of a large file is looked at and the count scaled up, as reading
+    the whole file just to order the work would double the I/O.  A file
+    that can't be read is reckoned to cost nothing; filtering it will report
+    the problem.
+    """
+    try:
+        fileSize = stat(inFilename).st_size
+        with open(inFilename, 'rb') as inFile:
+            sample = inFile.read(CostSampleSize)
+    except OSError:
+        return 0
+    docstringCount = (sample.count(b'"""') + sample.count(b"'''")) // 2
+    if sample and fileSize > len(sample):
+        docstringCount = docstringCount * fileSize // len(sample)
+    return fileSize + docstringCount * DocstringCost
+
+
+def filterTask(task):
+    """
+    Filters a single file of a batch into the mirror.
+
+    Failures don't abort the batch; the file is reported and copied through
+    unchanged instead.  A file that runs out of its time budget gets passed
+    through by the filter itself, and is reported just the same, so it
+    doesn't get recorded as up to date.  Returns the input filename along
+    with the error message or None on success, and the hash of the output
+    written.
+    """
+    (inFilename, outFilename, options) = task
+    try:
+        if options.cacheDir:
+            from .cache import getCache, produceCached
+            output, complete = produceCached(inFilename, options,
+                                             getCache(options))
+        else:
+            astWalker = walkFile(inFilename, options)
+            output = (astWalker.getLines() + linesep).encode('utf-8')
+            complete = astWalker.complete
+        writeOutput(outFilename, output)
+    except Exception as error:
+        message = '{0}: {1}'.format(type(error).__name__, error)
+        try:
+            makedirs(dirname(outFilename), exist_ok=True)
+            copyfile(inFilename, outFilename)
+        except OSError as copyError:
+            message += '; copying it failed too: {0}'.format(copyError)
+        return inFilename, message, None
+    if not complete:
+        return inFilename, 'ran out of time after {0:g} seconds'.format(
+            options.maxSecondsPerFile), None
+    return inFilename, None, sha256(output).hexdigest()
+
+
+def scheduleTasks(tasks):
+    """Orders tasks so that the most expensive files get handed out first."""
+    return sorted(tasks, key=lambda task: estimateCost(task[0]), reverse=True)
+
+
+def executeTasks(tasks, jobs):
+    """
+    Filters a list of (inFilename, outFilename, options) tasks.
+
+    With more than one job the tasks are spread across a process pool.
+    Returns the results of filterTask in no particular order.
+    """
+    jobs = jobs or cpu_count() or 1
+    if jobs > 1 and len(tasks) > 1:
+        with Pool(min(jobs, len(tasks))) as pool:
+            return list(pool.imap_unordered(filterTask, scheduleTasks(tasks)))
+    return [filterTask(task) for task in tasks]
+
+
+def reportResults(results):
+    """
+    Reports the files that had to be passed through unchanged.
+
+    Returns the number of files that were filtered and the number of files
+    that had to be passed through unchanged.
+    """
+    failureCount = 0
+    for inFilename, error, _ in results:
+        if error:
+            stderr.write("Passing {0} through unfiltered: {1}{2}".format(
+                inFilename, error, linesep))
+            failureCount += 1
+    return len(results) - failureCount, failureCount
+
+
+def runTasks(tasks, jobs):
+    """
+    Filters a list of (inFilename, outFilename, options) tasks.
+
+    Returns the number of files that were filtered and the number of files
+    that had to be passed through unchanged.
+    """
+    return reportResults(executeTasks(tasks, jobs))
+
+
+def readManifest(outDir):
+    """
+    Reads what the last run recorded about the files it filtered.
+
+    A missing or unreadable manifest, or one written by another version,
+    just means that everything gets filtered again.
+    """
+    try:
+        with open(join(outDir, ManifestFile), encoding='utf8') as manifestFile:
+            manifest = load(manifestFile)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('version') != __version__:
+        return {}
+    return manifest.get('files', {})
+
+
+def writeManifest(outDir, files):
+    """Records the files filtered into the mirror for the next run."""
+    from .cache import writeAtomically
+    makedirs(outDir, exist_ok=True)
+    writeAtomically(join(outDir, ManifestFile), dumps(
+        {'version': __version__, 'files': files},
+        indent=1, sort_keys=True).encode('utf-8'))
+
+
+def removeOutput(outDir, relName):
+    """Removes a file from the mirror along with any directories it empties."""
+    try:
+        unlink(join(outDir, relName))
+    except FileNotFoundError:
+        pass
+    relDir = dirname(relName)
+    while relDir:
+        try:
+            rmdir(join(outDir, relDir))
+        except OSError:
+            break
+        relDir = dirname(relDir)
+
+
+def getRecord(inFilename, fileOptions):
+    """Returns what the manifest records about a file about to be filtered."""
+    from .cache import getOptionsFingerprint
+    inStat = stat(inFilename)
+    return {
+        'size': inStat.st_size,
+        'mtimeNs': inStat.st_mtime_ns,
+        'fingerprint': getOptionsFingerprint(fileOptions),
+    }
+
+
+def filterTree(srcDir, outDir, options, shard=None):
+    """
+    Filters every matching file beneath srcDir into the mirror outDir.
+
+    A manifest in outDir remembers the size, modification time, and option
+    fingerprint of every file filtered, so files unchanged since the last
+    run are skipped after no more than a stat().  Mirrored files whose
+    sources have gone away are removed.  Given a (zero-based index, count)
+    shard, only the files of that shard get filtered (see shard.py).
+    Returns the number of files that were filtered and the number of files
+    that had to be passed through unchanged.
+    """
+    previous = readManifest(outDir)
+    files = {}
+    pending = {}
+    tasks = []
+    inFilenames = findSourceFiles(srcDir, options.patterns, [outDir])
+    if shard:
+        from .shard import selectShard
+        inFilenames = selectShard(srcDir, inFilenames, shard)
+    for inFilename in inFilenames:
+        relName = relpath(inFilename, srcDir)
+        outFilename = join(outDir, relName)
+        fileOptions = getFileOptions(options, inFilename)
+        record = getRecord(inFilename, fileOptions)
+        previousRecord = previous.get(relName)
+        if previousRecord is not None and exists(outFilename) and \
+                all(previousRecord.get(field) == value
+                    for field, value in record.items()):
+            files[relName] = previousRecord
+            continue
+        pending[inFilename] = relName, record
+        tasks.append((inFilename, outFilename, fileOptions))
+
+    results = executeTasks(tasks, options.jobs)
+    for inFilename, error, outputHash in results:
+        if not error:
+            relName, record = pending[inFilename]
+            record['outputHash'] = outputHash
+            files[relName] = record
+    found = set(files) | set(relName for relName, _ in pending.values())
+    for relName in set(previous) - found:
+        removeOutput(outDir, relName)
+    writeManifest(outDir, files)
+    return reportResults(results)
+
+
+def renameNamespace(output, oldNamespace, newNamespace):
+    """
+    Rewrites the @namespace tags of filtered output for a renamed file.
+
+    The namespace of a file shows up nowhere else in the output, so this
+    gives just what filtering the renamed file would.
+    """
+    if oldNamespace == newNamespace:
+        return output
+    namespaceRE = regexpCompile(br'(@namespace )' +
+                                escape(oldNamespace.encode('utf-8')) +
+                                br'(?=[.\s]|$)', MULTILINE)
+    return namespaceRE.sub(lambda match: match.group(1) +
+                           newNamespace.encode('utf-8'), output)
+
+
+def moveOutput(outDir, relName, oldRelName, fileOptions, oldOptions):
+    """
+    Moves the mirrored output of a renamed file to its new name.
+
+    Returns the hash of the output moved, or None if there was none.
+    """
+    try:
+        with open(join(outDir, oldRelName), 'rb') as oldFile:
+            output = oldFile.read()
+    except FileNotFoundError:
+        return None
+    output = renameNamespace(output, oldOptions.fullPathNamespace,
+                             fileOptions.fullPathNamespace)
+    writeOutput(join(outDir, relName), output)
+    removeOutput(outDir, oldRelName)
+    return sha256(output).hexdigest()
+
+
+def generatedChanges(inFilename, oldFilename, options):
+    """
+    Checks whether renaming a file changes whether it counts as generated.
+
+    The file's contents are what they were, but generated modules are also
+    told apart by their names.
+    """
+    from .doxypypy import openSourceBytes
+    from .generated import isGenerated
+    with openSourceBytes(inFilename) as source:
+        return isGenerated(source, inFilename, options) != \
+            isGenerated(source, oldFilename, options)
+
+
+def filterChanges(srcDir, outDir, options):
+    """
+    Brings the mirror outDir up to date with what git says has changed.
+
+    Only the files that git reports as changed since options.gitSince (up
+    to options.gitUntil or the working tree) get filtered.  Returns the
+    number of files that were filtered and the number of files that had to
+    be passed through unchanged.
+    """
+    from .gitchanges import getChanges
+    return applyChanges(srcDir, outDir, options,
+                        getChanges(srcDir, options.gitSince, options.gitUntil))
+
+
+def applyChanges(srcDir, outDir, options, changes):
+    """
+    Brings the mirror outDir up to date with the given changes to srcDir.
+
+    Changes are (kind, path, oldPath) tuples as returned by
+    gitchanges.getChanges.  Changed files get filtered, the mirrored output
+    of deleted files is removed, and that of renamed files is moved and has
+    its namespace rewritten without filtering anything, unless the new name
+    makes the file generated or no longer so.  Returns the number of files
+    that were filtered and the number of files that had to be passed
+    through unchanged.
+    """
+    from .cache import getOptionsFingerprint
+    from .gitchanges import Deleted, Renamed
+    files = readManifest(outDir)
+    outDirPath = abspath(outDir)
+
+    def isSource(relName):
+        """Checks whether the batch would pick up a file."""
+        inPath = abspath(join(srcDir, relName))
+        return not (inPath + sep).startswith(outDirPath + sep) and \
+            any(fnmatch(basename(relName), pattern)
+                for pattern in options.patterns)
+
+    pending = {}
+    tasks = []
+    for kind, relName, oldRelName in changes:
+        relName = normpath(relName)
+        inFilename = join(srcDir, relName)
+        if kind == Renamed:
+            oldRelName = normpath(oldRelName)
+            if isSource(oldRelName):
+                oldRecord = files.pop(oldRelName, {})
+                oldOptions = getFileOptions(options, join(srcDir, oldRelName))
+                # Output made with other options has to be filtered anew,
+                # as has that of a file the rename makes generated or not.
+                if isSource(relName) and oldRecord.get('fingerprint') == \
+                        getOptionsFingerprint(oldOptions) and \
+                        not generatedChanges(inFilename,
+                                             join(srcDir, oldRelName), options):
+                    fileOptions = getFileOptions(options, inFilename)
+                    record = getRecord(inFilename, fileOptions)
+                    record['outputHash'] = moveOutput(
+                        outDir, relName, oldRelName, fileOptions, oldOptions)
+                    if record['outputHash'] is not None:
+                        files[relName] = record
+                        continue
+                removeOutput(outDir, oldRelName)
+        elif kind == Deleted:
+            if isSource(relName):
+                files.pop(relName, None)
+                removeOutput(outDir, relName)
+            continue
+        if isSource(relName) and exists(inFilename):
+            fileOptions = getFileOptions(options, inFilename)
+            pending[inFilename] = relName, getRecord(inFilename, fileOptions)
+            tasks.append((inFilename, join(outDir, relName), fileOptions))
+
+    results = executeTasks(tasks, options.jobs)
+    for inFilename, error, outputHash in results:
+        relName, record = pending[inFilename]
+        if error:
+            files.pop(relName, None)
+        else:
+            record['outputHash'] = outputHash
+            files[relName] = record
+    writeManifest(outDir, files)
+    return reportResults(results)
+
+
+def main(args):
+    """Runs the batch subcommand on the given command line arguments."""
+    (options, srcDir, outDir) = batchOptParse(args)
+    if options.gitSince:
+        from .gitchanges import GitError
+        try:
+            filterChanges(srcDir, outDir, options)
+        except GitError as error:
+            stderr.write("git: {0}{1}".format(error, linesep))
+            sysExit(1)
+    else:
+        filterTree(srcDir, outDir, options, options.shard)
@@ -0,0 +1,109 @@
+# coding=utf-8
+"""
+Exports and imports the output cache as a single bundle file.
+
+A fresh CI runner starts out with an empty cache and would have to filter
+the whole tree.  Instead, a bundle exported from a warm cache (say, by the
+build of the main branch) can be imported first, so that only the files a
+branch actually changed get filtered.
+
+A bundle is a gzipped tar archive.  Its first member is a manifest
+recording the doxypypy3 version the entries were made with and the option
+fingerprints they cover; every other member is a single cache entry named
+after its key, stored exactly as the cache stores it.  Entries made by a
+different version of doxypypy3 could never be hit, so they're neither
+exported nor imported.
+"""
+from io import BytesIO
+from json import dumps, loads
+from re import compile as regexpCompile
+from tarfile import TarInfo, open as tarOpen, TarError
+
+from .. import __version__
+from .cache import parseEntry
+
+ManifestName = 'manifest.json'
+BundleFormat = 'doxypypy3-cache-bundle'
+EntriesDir = 'entries/'
+
+_keyRE = regexpCompile(r'^[0-9a-f]{64}$')
+
+
+class BundleError(Exception):
+    """Raised for files that aren't cache bundles we can read."""
+
+
+def _addMember(bundle, name, data):
+    """Adds a member with the given contents to a tar archive."""
+    memberInfo = TarInfo(name)
+    memberInfo.size = len(data)
+    bundle.addfile(memberInfo, BytesIO(data))
+
+
+def exportBundle(cache, bundlePath):
+    """
+    Writes every current entry of the cache to a bundle.
+
+    Returns the number of entries exported.
+    """
+    items = []
+    fingerprints = {}
+    for key, entry in cache.iterItems():
+        parsed = parseEntry(entry)
+        if parsed is None or parsed[0] != __version__:
+            continue
+        fingerprints[parsed[1]] = fingerprints.get(parsed[1], 0) + 1
+        items.append((key, entry))
+    manifest = {
+        'format': BundleFormat,
+        'version': __version__,
+        'fingerprints': fingerprints,
+        'entries': len(items),
+    }
+    with tarOpen(bundlePath, 'w:gz') as bundle:
+        _addMember(bundle, ManifestName,
+                   dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+        for key, entry in sorted(items):
+            _addMember(bundle, EntriesDir + key, entry)
+    return len(items)
+
+
+def importBundle(cache, bundlePath):
+    """
+    Adds the entries of a bundle to the cache.
+
+    Entries the cache already holds and entries made by another version of
+    doxypypy3 are skipped.  Returns the number of entries imported and
+    skipped.  Raises a BundleError if the file isn't a bundle.
+    """
+    try:
+        with tarOpen(bundlePath, 'r:gz') as bundle:
+            manifestInfo = bundle.next()
+            if manifestInfo is None or manifestInfo.name != ManifestName:
+                raise BundleError("{0} has no manifest".format(bundlePath))
+            manifest = loads(bundle.extractfile(manifestInfo).read().decode(
+                'utf-8'))
+            if manifest.get('format') != BundleFormat:
+                raise BundleError("{0} isn't a doxypypy3 cache bundle".format(
+                    bundlePath))
+            if manifest.get('version') != __version__:
+                # Nothing in here could ever be hit.
+                return 0, manifest.get('entries', 0)
+            importedCount = skippedCount = 0
+            for memberInfo in bundle:
+                key = memberInfo.name[len(EntriesDir):]
+                if not memberInfo.isfile() or \
+                        not memberInfo.name.startswith(EntriesDir) or \
+                        not _keyRE.match(key):
+                    continue
+                parsed = parseEntry(bundle.extractfile(memberInfo).read())
+                if parsed is None or parsed[0] != __version__ or \
+                        cache.peek(key) is not None:
+                    skippedCount += 1
+                    continue
+                version, fingerprint, output = parsed
+                cache.put(key, output, fingerprint, version)
+                importedCount += 1
+    except (OSError, TarError, ValueError) as error:
+        raise BundleError("{0}: {1}".format(bundlePath, error))
+    return importedCount, skippedCount
@@ -0,0 +1,515 @@
+# coding=utf-8
+"""
+Content-addressed on-disk cache of filtered output.
+
+Between documentation builds the vast majority of files don't change, yet
+each one would get parsed and transformed all over again.  Filtered output
+is therefore stored under a key derived from the source bytes, the options
+affecting the output, and the version of doxypypy3, so a hit can skip the
+AST walk entirely and simply hand back the stored bytes.  This also covers
+Doxygen filtering the same file twice when FILTER_SOURCE_FILES is set.
+
+Every entry starts with a short header line recording the version and
+option fingerprint it was made with, followed by the output exactly as the
+filter prints it.
+
+The cache may be limited to a number of bytes, in which case the least
+recently used entries get evicted whenever a write pushes it over.
+
+Entries are normally kept in a file each; alternatively they can all go
+into a single pack file (see pack.py), which suits filesystems where
+opening many small files is slow.
+
+Several filter processes may share one cache at the same time.  Entries
+are renamed into place once completely written, so readers never see a
+partial entry, and a per-key lock file makes sure that a burst of misses on
+the same key results in the file getting filtered only once.
+"""
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_UN
+from hashlib import sha256
+from json import dumps, load
+from os import (O_APPEND, O_CREAT, O_RDWR, O_WRONLY, chmod, close, fstat,
+                makedirs, open as osOpen, replace, scandir, stat, unlink, utime,
+                write)
+from os.path import basename, dirname, exists, join
+from sys import exit as sysExit, stderr
+from tempfile import mkstemp
+from time import localtime, strftime, time
+
+from .. import __version__
+from .compile import linesep
+
+EntryMagic = b'doxypypy3'
+StateFile = 'state.json'
+LockFile = 'lock'
+LocksDir = 'locks'
+TempPrefix = '.tmp-'
+## Fraction of the size limit that eviction shrinks the cache down to.
+LowWaterMark = 0.9
+## What the files tallying lookups are named after their counters.
+CountSuffix = '.count'
+## How large a tally grows, in bytes (that is, lookups), before a write
+# folds it into the state.
+CountFoldSize = 1 << 16
+
+
+def getOptionsFingerprint(options):
+    """
+    Returns a fingerprint of all the options that affect filtered output.
+
+    The namespace is part of it, as it ends up in the output.
+    """
+    relevant = (
+        bool(options.autobrief),
+        bool(options.autocode),
+        options.topLevelNamespace or '',
+        options.tablength,
+        options.fullPathNamespace,
+        options.generated,
+        sorted(options.generatedPatterns or ()),
+        sorted(options.generatedSignatures or ()),
+    )
+    return sha256(repr(relevant).encode('utf-8')).hexdigest()
+
+
+def getCacheKey(source, fingerprint, version=__version__):
+    """Returns the cache key for the source bytes filtered with the options."""
+    keyHash = sha256()
+    keyHash.update(version.encode('utf-8') + b'\0')
+    keyHash.update(fingerprint.encode('ascii') + b'\0')
+    keyHash.update(source)
+    return keyHash.hexdigest()
+
+
+@contextmanager
+def openAtomically(path, buffering=-1):
+    """
+    Opens a file for writing such that readers see all of it or none of it.
+
+    Everything written goes to a temporary file in the same directory
+    first, which only gets renamed into place once the with block has
+    completed without raising.
+    """
+    tempFd, tempPath = mkstemp(prefix=TempPrefix, dir=dirname(path))
+    try:
+        with open(tempFd, 'wb', buffering) as tempFile:
+            yield tempFile
+        chmod(tempPath, 0o644)
+        replace(tempPath, path)
+    except BaseException:
+        try:
+            unlink(tempPath)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def writeAtomically(path, data):
+    """Writes a file such that readers see either all of it or none of it."""
+    with openAtomically(path) as outFile:
+        outFile.write(data)
+
+
+def makeEntry(output, fingerprint, version=__version__):
+    """Returns a cache entry: a header line followed by the output."""
+    header = b' '.join((EntryMagic, version.encode('utf-8'),
+                        fingerprint.encode('ascii')))
+    return header + b'\n' + output
+
+
+def parseEntry(entry):
+    """
+    Splits a cache entry into its version, fingerprint, and output.
+
+    Returns None if the entry is damaged.
+    """
+    header, separator, output = entry.partition(b'\n')
+    fields = header.split(b' ')
+    if not separator or len(fields) != 3 or fields[0] != EntryMagic:
+        return None
+    return fields[1].decode('utf-8', 'replace'), \
+        fields[2].decode('ascii', 'replace'), output
+
+
+class OutputCache:
+    """
+    A directory of cached filter outputs.
+
+    Entries are spread over subdirectories named after the first two
+    characters of their keys to keep directories small.  An entry's
+    modification time doubles as its last use, which is what least recently
+    used entries get evicted by once the cache grows beyond its size limit.
+    The running total of bytes stored, along with the number of hits and
+    misses, is kept in a small state file that's only ever updated under
+    the cache-wide lock.  Lookups are too frequent to take that lock,
+    though, so each one just appends a byte to a tally of its own counter,
+    and the tallies get folded into the state once they've grown large.
+    """
+
+    def __init__(self, cacheDir, maxSize=None):
+        """Sets up a cache rooted at the given directory."""
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+
+    def getEntryPath(self, key):
+        """Returns the file an entry is stored in."""
+        return join(self.cacheDir, key[:2], key[2:])
+
+    def get(self, key):
+        """Returns the cached output for a key or None on a miss."""
+        output = self.peek(key)
+        if output is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        try:
+            utime(self.getEntryPath(key))
+        except OSError:
+            pass
+        return output
+
+    def peek(self, key):
+        """Looks up an entry without counting it or marking it as used."""
+        try:
+            with open(self.getEntryPath(key), 'rb') as entryFile:
+                entry = entryFile.read()
+        except OSError:
+            return None
+        parsed = parseEntry(entry)
+        return parsed[2] if parsed is not None else None
+
+    def put(self, key, output, fingerprint, version=__version__):
+        """Stores the output for a key, evicting old entries if need be."""
+        entryPath = self.getEntryPath(key)
+        makedirs(join(self.cacheDir, key[:2]), exist_ok=True)
+        entry = makeEntry(output, fingerprint, version)
+
+        # Replacing the entry and accounting for it must not interleave with
+        # another writer's, or the two would each count the same entry.
+        with self._locked():
+            try:
+                oldSize = stat(entryPath).st_size
+            except OSError:
+                oldSize = None
+            writeAtomically(entryPath, entry)
+            state = self._readState()
+            state['bytes'] += len(entry) - (oldSize or 0)
+            state['entries'] += oldSize is None
+            self._foldCounts(state, CountFoldSize)
+            self._writeState(state)
+            if self.maxSize is not None and state['bytes'] > self.maxSize:
+                self._prune(maxSize=int(self.maxSize * LowWaterMark))
+
+    def iterEntries(self):
+        """Yields the path, size, and last use time of every entry."""
+        try:
+            subdirs = [subdir for subdir in scandir(self.cacheDir)
+                       if subdir.is_dir() and len(subdir.name) == 2]
+        except FileNotFoundError:
+            return
+        for subdir in subdirs:
+            for entry in scandir(subdir.path):
+                if entry.name.startswith(TempPrefix):
+                    continue
+                try:
+                    entryStat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, entryStat.st_size, entryStat.st_mtime
+
+    def iterItems(self):
+        """Yields the key and the stored entry of every entry."""
+        for entryPath, _, _ in self.iterEntries():
+            try:
+                with open(entryPath, 'rb') as entryFile:
+                    entry = entryFile.read()
+            except OSError:
+                continue
+            yield basename(dirname(entryPath)) + basename(entryPath), entry
+
+    def prune(self, maxAge=None, maxSize=None):
+        """
+        Removes entries unused for maxAge seconds, then the least recently
+        used ones until at most maxSize bytes remain.
+
+        Returns the number of entries and bytes removed.
+        """
+        with self._locked():
+            return self._prune(maxAge, maxSize)
+
+    def compact(self):
+        """
+        Drops dead entries.
+
+        A directory of entry files has none, so there's nothing to do.
+        """
+        return 0, 0
+
+    def _prune(self, maxAge=None, maxSize=None):
+        """Does the actual pruning; the cache must already be locked."""
+        entries = sorted(self.iterEntries(), key=lambda entry: entry[2])
+        totalSize = sum(entry[1] for entry in entries)
+        oldest = time() - maxAge if maxAge is not None else None
+        removedCount = removedSize = 0
+        for entryPath, entrySize, lastUse in entries:
+            if not (oldest is not None and lastUse < oldest) and \
+                    not (maxSize is not None and totalSize > maxSize):
+                break
+            try:
+                unlink(entryPath)
+            except FileNotFoundError:
+                pass
+            totalSize -= entrySize
+            removedCount += 1
+            removedSize += entrySize
+
+        state = self._readState()
+        state['bytes'] = totalSize
+        state['entries'] = len(entries) - removedCount
+        state['lastPrune'] = time()
+        self._foldCounts(state)
+        self._writeState(state)
+        return removedCount, removedSize
+
+    def getStats(self):
+        """Returns the entries, bytes, hits, misses, and last prune time."""
+        state = self._readState()
+        entryCount = totalSize = 0
+        for _, entrySize, _ in self.iterEntries():
+            entryCount += 1
+            totalSize += entrySize
+        return {
+            'entries': entryCount,
+            'bytes': totalSize,
+            'hits': state['hits'] + self._getTally('hits'),
+            'misses': state['misses'] + self._getTally('misses'),
+            'lastPrune': state['lastPrune'],
+        }
+
+    def _count(self, counter):
+        """
+        Adds one to one of the counters kept in the state.
+
+        Appends to the counter's tally, which needs no lock: appends of a
+        single byte don't get lost however many processes make them.
+        """
+        try:
+            tallyFd = osOpen(join(self.cacheDir, counter + CountSuffix),
+                             O_WRONLY | O_APPEND | O_CREAT, 0o644)
+            try:
+                write(tallyFd, b'.')
+            finally:
+                close(tallyFd)
+        except OSError:
+            # Statistics aren't worth failing a lookup over.
+            pass
+
+    def _getTally(self, counter):
+        """Returns how many lookups a counter's tally holds."""
+        try:
+            return stat(join(self.cacheDir, counter + CountSuffix)).st_size
+        except OSError:
+            return 0
+
+    def _foldCounts(self, state, minSize=0):
+        """
+        Moves the tallies of at least minSize lookups into the state.
+
+        The cache must already be locked.  A tally gets renamed before it's
+        measured, so lookups counted meanwhile go to a fresh one; only one
+        that had opened the old tally just before may go uncounted.
+        """
+        for counter in ('hits', 'misses'):
+            tallyPath = join(self.cacheDir, counter + CountSuffix)
+            if self._getTally(counter) < max(minSize, 1):
+                continue
+            foldingPath = tallyPath + '.folding'
+            try:
+                replace(tallyPath, foldingPath)
+                state[counter] += stat(foldingPath).st_size
+                unlink(foldingPath)
+            except OSError:
+                pass
+
+    @contextmanager
+    def producing(self, key):
+        """
+        Holds the lock on producing the entry for a key.
+
+        Whoever misses on a key should produce its entry while holding this
+        lock and check the cache once more after acquiring it, so when
+        several processes miss on the same key at once only the first does
+        the work and the others simply wait for its result.
+        """
+        lockDir = join(self.cacheDir, LocksDir)
+        makedirs(lockDir, exist_ok=True)
+        lockPath = join(lockDir, key)
+        while True:
+            lockFd = osOpen(lockPath, O_RDWR | O_CREAT, 0o644)
+            flock(lockFd, LOCK_EX)
+            # The previous holder may have removed the lock file while we
+            # waited on it, in which case we've got a lock nobody else sees.
+            try:
+                if fstat(lockFd).st_ino == stat(lockPath).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            close(lockFd)
+        try:
+            yield
+        finally:
+            try:
+                unlink(lockPath)
+            except FileNotFoundError:
+                pass
+            close(lockFd)
+
+    @contextmanager
+    def _locked(self):
+        """Holds the cache-wide lock for updating its state."""
+        makedirs(self.cacheDir, exist_ok=True)
+        with open(join(self.cacheDir, LockFile), 'a') as lockFile:
+            flock(lockFile, LOCK_EX)
+            try:
+                yield
+            finally:
+                flock(lockFile, LOCK_UN)
+
+    def _readState(self):
+        """Reads the cache's state, assuming an empty cache if it has none."""
+        state = {'bytes': 0, 'entries': 0, 'hits': 0, 'misses': 0,
+                 'lastPrune': None}
+        try:
+            with open(join(self.cacheDir, StateFile)) as stateFile:
+                state.update(load(stateFile))
+        except (OSError, ValueError):
+            pass
+        return state
+
+    def _writeState(self, state):
+        """Writes the cache's state."""
+        writeAtomically(join(self.cacheDir, StateFile),
+                        dumps(state).encode('utf-8'))
+
+
+def filterFileCached(inFilename, options, cache):
+    """
+    Returns the filtered file as printed by the filter, encoded as UTF-8.
+
+    Only a cache miss involves the filter itself, and even then only the
+    top-level definitions that aren't cached on their own get walked, if
+    the file needs walking at all.  Files passed through for running out
+    of time aren't cached, so they get another go next time.
+    """
+    return produceCached(inFilename, options, cache)[0]
+
+
+def produceCached(inFilename, options, cache):
+    """
+    Returns what filterFileCached() does, and whether it's complete.
+
+    The output is complete unless the file was passed through for running
+    out of time, which callers keeping records of their own should keep
+    out of them just like the cache does.
+    """
+    from .doxypypy import (Walk, checkSource, openSourceBytes,
+                           splitSourceLines, walkLines)
+    fingerprint = getOptionsFingerprint(options)
+    complete = True
+    with openSourceBytes(inFilename) as source:
+        key = getCacheKey(source, fingerprint)
+        output = cache.get(key)
+        if output is None:
+            # What gets filtered has to be what got hashed, even should the
+            # file change in the meantime.
+            treatment = checkSource(source, inFilename, options)
+            lines = splitSourceLines(source)
+    if output is None:
+        with cache.producing(key):
+            output = cache.peek(key)
+            if output is None:
+                if treatment == Walk:
+                    from .segments import filterLinesBySegments
+                    output, complete = filterLinesBySegments(
+                        lines, inFilename, options, cache)
+                else:
+                    astWalker = walkLines(lines, inFilename, options,
+                                          treatment)
+                    output = astWalker.getLines()
+                    complete = astWalker.complete
+                output = (output + linesep).encode('utf-8')
+                if complete:
+                    cache.put(key, output, fingerprint)
+    return output, complete
+
+
+def openCache(cacheDir, maxSize=None, cacheFormat=None):
+    """
+    Returns the cache stored in a directory.
+
+    An existing cache keeps its format; a new one is a directory of entry
+    files unless asked to be a pack.
+    """
+    from .pack import IndexFile, PackCache
+    if cacheFormat == 'pack' or exists(join(cacheDir, IndexFile)):
+        return PackCache(cacheDir, maxSize)
+    return OutputCache(cacheDir, maxSize)
+
+
+def getCache(options):
+    """Returns the cache the options ask for, or None if caching is off."""
+    if not options.cacheDir:
+        return None
+    return openCache(options.cacheDir, options.cacheMaxSize,
+                     options.cacheFormat)
+
+
+def formatStats(stats):
+    """Formats cache statistics for humans."""
+    lookups = (stats['hits'] or 0) + (stats['misses'] or 0)
+    lastPrune = 'never'
+    if stats['lastPrune'] is not None:
+        lastPrune = strftime('%Y-%m-%d %H:%M:%S',
+                             localtime(stats['lastPrune']))
+    return linesep.join([
+        'entries:    {0}'.format(stats['entries']),
+        'bytes:      {0}'.format(stats['bytes']),
+    ] + ([
+        'hits:       {0}'.format(stats['hits']),
+        'misses:     {0}'.format(stats['misses']),
+        'hit ratio:  {0:.1%}'.format(stats['hits'] / lookups if lookups else 0),
+    ] if stats['hits'] is not None else []) + [
+        'last prune: {0}'.format(lastPrune),
+    ])
+
+
+def main(args):
+    """Runs the cache subcommand on the given command line arguments."""
+    from .cmd_options import cacheOptParse
+    (options, action) = cacheOptParse(args)
+    cache = openCache(options.cacheDir, cacheFormat=options.cacheFormat)
+    if action in ('export', 'import'):
+        from .bundle import BundleError, exportBundle, importBundle
+        try:
+            if action == 'export':
+                print('Exported {0} entries.'.format(
+                    exportBundle(cache, options.bundlePath)))
+            else:
+                print('Imported {0} entries, skipped {1}.'.format(
+                    *importBundle(cache, options.bundlePath)))
+        except BundleError as error:
+            stderr.write(str(error) + linesep)
+            sysExit(1)
+    elif action == 'compact':
+        removedCount, removedSize = cache.compact()
+        print('Removed {0} dead entries ({1} bytes).'.format(removedCount,
+                                                             removedSize))
+    elif action == 'prune':
+        maxAge = options.maxAge * 24 * 60 * 60 \
+            if options.maxAge is not None else None
+        removedCount, removedSize = cache.prune(maxAge, options.maxSize)
+        print('Removed {0} entries ({1} bytes).'.format(removedCount,
+                                                        removedSize))
+    else:
+        print(formatStats(cache.getStats()))
@@ -0,0 +1,240 @@
+# coding=utf-8
+"""
+Thin Doxygen INPUT_FILTER client for the persistent doxypypy3 filter server.
+
+Doxygen starts its input filter once for every file, so paying for the
+interpreter start plus importing the whole filter each time quickly adds up.
+This client deliberately imports next to nothing: it hands its command line,
+working directory, and standard streams over a unix socket to a long-lived
+server (see server.py) that already has everything loaded and lets the
+server run the regular filter on its behalf.  If no server is listening one
+is started in the background; it exits by itself once it has been idle for
+a while.  Should the server be unreachable for any reason the filter simply
+runs in-process, so the output is always identical to that of main().
+
+Servers are only ever shared by clients running the same interpreter and
+version of doxypypy3, and the client only talks to servers run by its own
+user: the default socket lives in a private directory and the peer's
+credentials get checked on connecting.
+"""
+import socket
+import sys
+
+from array import array
+from hashlib import sha256
+from os import environ, getcwd, getuid, lstat, mkdir
+from os.path import join
+from stat import S_ISDIR, S_IMODE
+from struct import calcsize, unpack
+from sys import argv, executable, exit as sysExit
+from time import sleep
+
+from .. import __version__
+
+## Environment variable overriding the location of the server socket.
+SocketEnv = 'DOXYPYPY3_SOCKET'
+## Environment variable overriding the idle timeout (in seconds) of the server.
+IdleTimeoutEnv = 'DOXYPYPY3_IDLE_TIMEOUT'
+DefaultIdleTimeout = 300
+
+# How long to wait for a freshly started server to begin listening.
+StartupAttempts = 50
+StartupDelay = 0.1
+# How long a listening server may take to accept us.
+AcceptTimeout = 5
+
+## Server reply refusing a request it can't serve faithfully.
+RefusedStatus = b'?'
+
+linesep = "\n"
+
+
+def getServerIdentity():
+    """
+    Identifies the interpreter and doxypypy3 version serving requests.
+
+    A server started from another virtual environment or by another version
+    of doxypypy3 could produce different output, so it mustn't be used.
+    """
+    return sha256('{0}\0{1}'.format(executable, __version__).encode(
+        'utf-8')).hexdigest()[:16]
+
+
+def _getPrivateDir(runtimeDir):
+    """
+    Returns our private directory for sockets within runtimeDir.
+
+    The directory is created if need be.  Returns None if the directory is
+    a symlink, belongs to some other user, or is accessible by others.
+    """
+    privateDir = join(runtimeDir, 'doxypypy3-{0}'.format(getuid()))
+    try:
+        mkdir(privateDir, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return None
+    dirStat = lstat(privateDir)
+    if not S_ISDIR(dirStat.st_mode) or dirStat.st_uid != getuid() or \
+            S_IMODE(dirStat.st_mode) & 0o077:
+        return None
+    return privateDir
+
+
+def getSocketPath():
+    """
+    Returns the path of the unix socket the filter server listens on.
+
+    The location may be given explicitly via the environment; otherwise a
+    socket in a private per-user directory beneath the runtime (or
+    temporary) directory is used.  Returns None if no safe location exists.
+    """
+    socketPath = environ.get(SocketEnv)
+    if not socketPath:
+        runtimeDir = environ.get('XDG_RUNTIME_DIR')
+        if not runtimeDir:
+            from tempfile import gettempdir
+            runtimeDir = gettempdir()
+        privateDir = _getPrivateDir(runtimeDir)
+        if privateDir is None:
+            return None
+        socketPath = join(privateDir,
+                          'filter-{0}.sock'.format(getServerIdentity()))
+    return socketPath
+
+
+def isOwnPeer(sock):
+    """Checks that the process on the other end of sock runs as our user."""
+    peerCred = getattr(socket, 'SO_PEERCRED', None)
+    if peerCred is None:
+        # Without a way to tell we rely on the socket's location alone.
+        return True
+    credentials = sock.getsockopt(socket.SOL_SOCKET, peerCred, calcsize('3i'))
+    _, peerUid, _ = unpack('3i', credentials)
+    return peerUid == getuid()
+
+
+def getIdleTimeout():
+    """Returns the number of idle seconds after which the server exits."""
+    try:
+        return float(environ.get(IdleTimeoutEnv, DefaultIdleTimeout))
+    except ValueError:
+        return DefaultIdleTimeout
+
+
+def _connect(socketPath):
+    """
+    Connects to the server and waits for it to acknowledge the connection.
+
+    Returns the connected socket or None if no server accepted us.  Nothing
+    has been handed to the server yet at this point, so it's always safe to
+    try again or to fall back on running the filter locally.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(AcceptTimeout)
+    try:
+        sock.connect(socketPath)
+        if isOwnPeer(sock) and sock.recv(1) == b'+':
+            sock.settimeout(None)
+            return sock
+    except OSError:
+        pass
+    sock.close()
+    return None
+
+
+def _startServer(socketPath):
+    """
+    Starts a detached filter server and waits for it to come up.
+
+    The server must not inherit our standard streams, as Doxygen would
+    otherwise wait on it until it finally went idle.
+    """
+    from subprocess import Popen, DEVNULL
+    Popen(
+        [executable, '-m', 'doxypypy3.src.server',
+         '--socket', socketPath, '--idle-timeout', str(getIdleTimeout())],
+        stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+        close_fds=True, start_new_session=True
+    )
+    for _ in range(StartupAttempts):
+        sock = _connect(socketPath)
+        if sock:
+            return sock
+        sleep(StartupDelay)
+    return None
+
+
+def _readStatus(sock):
+    """
+    Reads the exit status line the server sends once it's done.
+
+    Returns None if the server died before finishing and RefusedStatus if
+    it refused the request without touching our streams.
+    """
+    status = b''
+    while not status.endswith(b'\n'):
+        chunk = sock.recv(64)
+        if not chunk:
+            return None
+        status += chunk
+    if status.strip() == RefusedStatus:
+        return RefusedStatus
+    return int(status)
+
+
+def getRequest():
+    """
+    Describes how we were started, for the server to mimic.
+
+    Besides the command line and working directory this includes our
+    environment (which supplies option defaults) and the encodings Python
+    chose for our standard streams, which the output depends on.
+    """
+    return {
+        'identity': getServerIdentity(),
+        'cwd': getcwd(),
+        'argv': argv,
+        'environ': dict(environ),
+        'streams': [[stream.encoding, stream.errors]
+                    for stream in (sys.stdout, sys.stderr)],
+    }
+
+
+def main():
+    """
+    Has the filter server process the command line we were given.
+
+    Our standard streams are passed along to the server, which writes the
+    filtered file straight to them, and we exit with its exit status.
+    """
+    socketPath = getSocketPath()
+    sock = None
+    if socketPath is not None:
+        sock = _connect(socketPath) or _startServer(socketPath)
+    status = RefusedStatus
+    if sock is not None:
+        from json import dumps
+        request = dumps(getRequest()) + linesep
+        with sock:
+            sock.sendmsg(
+                [request.encode('utf-8')],
+                [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array('i', [0, 1, 2]))]
+            )
+            status = _readStatus(sock)
+    if status is RefusedStatus:
+        # No server to be had, so do the work ourselves.
+        from .doxypypy import main as filterMain
+        return filterMain()
+    if status is None:
+        # The server accepted our streams but died before finishing, so
+        # whatever it wrote is incomplete.
+        from sys import stderr
+        stderr.write("doxypypy3 filter server failed to respond." + linesep)
+        status = 1
+    sysExit(status)
+
+
+# See if we're running as a script.
+if __name__ == "__main__":
+    main()
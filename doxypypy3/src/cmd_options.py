@@ -1,26 +1,90 @@
 # coding=utf-8
-from optparse import OptionParser, OptionGroup
-from os import sep
-from os.path import basename
+from optparse import OptionParser, OptionGroup, OptionValueError
+from os import environ, sep
+from os.path import abspath, basename, dirname, join
 from sys import argv, exit as sysExit
 from sys import stderr
 
 linesep = "\n"
 
+_sizeUnits = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
 
-def optParse():
+
+def parseSize(text):
     """
-    Parses command line options.
+    Parses a size in bytes such as 4096, 500K, 200M, or 2G.
 
-    Generally we're supporting all the command line options that doxypy.py
-    supports in an analogous way to make it easy to switch back and forth.
-    We additionally support a top-level namespace argument that is used
-    to trim away excess path information.
+    Raises a ValueError if the text isn't a valid size.
     """
+    text = text.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    unit = text[-1:] if text[-1:] in _sizeUnits else ''
+    number = float(text[:len(text) - len(unit)])
+    if number < 0:
+        raise ValueError("negative size")
+    return int(number * _sizeUnits[unit])
 
-    parser = OptionParser(prog=basename(argv[0]))
 
-    parser.set_usage("%prog [options] filename")
+def _storeSize(option, optString, value, parser):
+    """Option callback storing a size given with an optional unit."""
+    try:
+        setattr(parser.values, option.dest, parseSize(value))
+    except ValueError:
+        raise OptionValueError(
+            "option {0}: invalid size: {1!r}".format(optString, value))
+
+
+def parseShard(text):
+    """
+    Parses a shard given as I/N, the I-th of N shards counting from 1.
+
+    Returns the zero-based index of the shard and the number of shards.
+    Raises a ValueError if the text isn't a valid shard.
+    """
+    shardNum, shardCount = (int(part) for part in text.split('/'))
+    if not 1 <= shardNum <= shardCount:
+        raise ValueError("no such shard")
+    return shardNum - 1, shardCount
+
+
+def _storeShard(option, optString, value, parser):
+    """Option callback storing a shard given as I/N."""
+    try:
+        setattr(parser.values, option.dest, parseShard(value))
+    except ValueError:
+        raise OptionValueError(
+            "option {0}: invalid shard: {1!r}".format(optString, value))
+
+
+def _storeSeconds(option, optString, value, parser):
+    """Option callback storing a positive number of seconds."""
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0
+    if not seconds > 0:
+        raise OptionValueError(
+            "option {0}: invalid number of seconds: {1!r}".format(optString,
+                                                                 value))
+    setattr(parser.values, option.dest, seconds)
+
+
+def _getDefaultSize(envName):
+    """Returns the size given in an environment variable, if any."""
+    try:
+        return parseSize(environ[envName])
+    except (KeyError, ValueError):
+        return None
+
+
+def _addFilterOptions(parser):
+    """
+    Adds the options controlling how files get filtered to a parser.
+
+    These are shared by the single-file filter and all of the subcommands
+    that filter files on its behalf.
+    """
     parser.add_option(
         "-a", "--autobrief",
         action="store_true", dest="autobrief",
@@ -41,6 +105,64 @@ def optParse():
         action="store", type="int", dest="tablength", default=4,
         help="specify a tab length in spaces; only needed if tabs are used"
     )
+    parser.add_option(
+        "--max-seconds-per-file",
+        action="callback", type="string", dest="maxSecondsPerFile",
+        callback=_storeSeconds, metavar="SECONDS",
+        help="pass a file through unfiltered, with a warning, should "
+             "filtering it take longer than this"
+    )
+    group = OptionGroup(parser, "Generated Code Options",
+                        "Modules matching a pattern or carrying a generator's "
+                        "signature in their leading comments are generated; "
+                        "see doxypypy3/src/generated.py for the defaults.")
+    group.add_option(
+        "--generated",
+        action="store", type="choice", choices=["pass", "stub", "filter"],
+        dest="generated", default="pass",
+        help="pass generated modules through as they are, beneath a @file "
+             "stub, or filter them anyway (default: %default)"
+    )
+    group.add_option(
+        "--generated-pattern",
+        action="append", type="string", dest="generatedPatterns",
+        metavar="PATTERN",
+        help="also treat files matching this pattern as generated; may be "
+             "given more than once"
+    )
+    group.add_option(
+        "--generated-signature",
+        action="append", type="string", dest="generatedSignatures",
+        metavar="TEXT",
+        help="also treat files with this text (in any case) in their leading "
+             "comments as generated; may be given more than once"
+    )
+    parser.add_option_group(group)
+    group = OptionGroup(parser, "Cache Options")
+    group.add_option(
+        "--cache-dir",
+        action="store", type="string", dest="cacheDir",
+        default=environ.get('DOXYPYPY3_CACHE_DIR') or None,
+        help="cache filtered output in this directory "
+             "(default: $DOXYPYPY3_CACHE_DIR if set)"
+    )
+    group.add_option(
+        "--cache-max-size",
+        action="callback", type="string", dest="cacheMaxSize",
+        callback=_storeSize, default=_getDefaultSize('DOXYPYPY3_CACHE_MAX_SIZE'),
+        help="evict least recently used entries to keep the cache below this "
+             "size, e.g. 500M (default: $DOXYPYPY3_CACHE_MAX_SIZE if set)"
+    )
+    group.add_option(
+        "--cache-format",
+        action="store", type="choice", choices=["files", "pack"],
+        dest="cacheFormat",
+        default=environ.get('DOXYPYPY3_CACHE_FORMAT') or None,
+        help="store a new cache as a file per entry or as a single pack; an "
+             "existing cache keeps its format (default: "
+             "$DOXYPYPY3_CACHE_FORMAT if set, otherwise files)"
+    )
+    parser.add_option_group(group)
     group = OptionGroup(parser, "Debug Options")
     group.add_option(
         "-d", "--debug",
@@ -49,22 +171,414 @@ def optParse():
     )
     parser.add_option_group(group)
 
+
+def getFullPathNamespace(filename, topLevelNamespace=None):
+    """
+    Turns the path of a Python file into its full path module location.
+
+    Any provided top-level namespace is used to trim off excess path
+    information preceding it.
+    """
+    # Turn the full path filename into a full path module location.
+    fullPathNamespace = filename.replace(sep, '.')[:-3]
+    # Use any provided top-level namespace argument to trim off excess.
+    realNamespace = fullPathNamespace
+    if topLevelNamespace:
+        namespaceStart = fullPathNamespace.find(topLevelNamespace)
+        if namespaceStart >= 0:
+            realNamespace = fullPathNamespace[namespaceStart:]
+    return realNamespace
+
+
+def getFilterArgs(options):
+    """
+    Returns the command line arguments giving the filter these options.
+
+    Only options that differ from their defaults are included.
+    """
+    args = []
+    if options.autobrief:
+        args.append('--autobrief')
+    if options.autocode:
+        args.append('--autocode')
+    if options.topLevelNamespace:
+        args.append('--ns=' + options.topLevelNamespace)
+    if options.tablength != 4:
+        args.append('--tablength={0}'.format(options.tablength))
+    if options.maxSecondsPerFile:
+        args.append('--max-seconds-per-file={0!r}'.format(
+            options.maxSecondsPerFile))
+    if options.generated != 'pass':
+        args.append('--generated=' + options.generated)
+    args.extend('--generated-pattern=' + pattern
+                for pattern in options.generatedPatterns or ())
+    args.extend('--generated-signature=' + signature
+                for signature in options.generatedSignatures or ())
+    if options.cacheDir:
+        args.append('--cache-dir=' + options.cacheDir)
+    if options.cacheMaxSize is not None:
+        args.append('--cache-max-size={0}'.format(options.cacheMaxSize))
+    if options.cacheFormat:
+        args.append('--cache-format=' + options.cacheFormat)
+    if options.debug:
+        args.append('--debug')
+    return args
+
+
+def filterOptParse(args, values=None):
+    """
+    Parses the filter options out of a filter command line.
+
+    This is used for filter invocations found in configuration files or
+    filter requests rather than on our own command line, so any filenames
+    are ignored.  Options not given keep the values given, if any.
+    """
+    parser = OptionParser(prog="doxypypy3")
+    _addFilterOptions(parser)
+    (options, _) = parser.parse_args(args, values)
+    return options
+
+
+def optParse():
+    """
+    Parses command line options.
+
+    Generally we're supporting all the command line options that doxypy.py
+    supports in an analogous way to make it easy to switch back and forth.
+    We additionally support a top-level namespace argument that is used
+    to trim away excess path information.
+    """
+
+    parser = OptionParser(prog=basename(argv[0]))
+
+    parser.set_usage("%prog [options] filename")
+    _addFilterOptions(parser)
+    group = OptionGroup(parser, "Output Options")
+    group.add_option(
+        "-o", "--output",
+        action="store", type="string", dest="outputPath",
+        help="write the filtered file here rather than to stdout; it only "
+             "gets replaced once filtering has succeeded"
+    )
+    group.add_option(
+        "--depfile",
+        action="store", type="string", dest="depfilePath",
+        help="also write a Makefile-style depfile listing the input and "
+             "doxypypy3's own modules as what the output depends on"
+    )
+    group.add_option(
+        "--serve-stdio",
+        action="store_true", dest="serveStdio",
+        help="rather than filtering a single file, keep filtering the files "
+             "sent as length-prefixed frames on stdin until it's closed"
+    )
+    parser.add_option_group(group)
+
     ## Parse options based on our definition.
     (options, filename) = parser.parse_args()
 
+    if options.serveStdio:
+        if filename or options.outputPath:
+            parser.error("--serve-stdio takes neither a filename nor --output")
+        return options, None
     # Just abort immediately if we are don't have an input file.
     if not filename:
         stderr.write("No filename given." + linesep)
         sysExit(-1)
+    if options.depfilePath and not options.outputPath:
+        parser.error("--depfile needs --output")
 
-    # Turn the full path filename into a full path module location.
-    fullPathNamespace = filename[0].replace(sep, '.')[:-3]
-    # Use any provided top-level namespace argument to trim off excess.
-    realNamespace = fullPathNamespace
-    if options.topLevelNamespace:
-        namespaceStart = fullPathNamespace.find(options.topLevelNamespace)
-        if namespaceStart >= 0:
-            realNamespace = fullPathNamespace[namespaceStart:]
-    options.fullPathNamespace = realNamespace
+    options.fullPathNamespace = getFullPathNamespace(
+        filename[0], options.topLevelNamespace)
 
     return options, filename[0]
+
+
+def batchOptParse(args):
+    """
+    Parses command line options for the batch subcommand.
+
+    The batch subcommand takes all the usual filter options plus a source
+    tree to read from and a mirror directory to write the results to.
+    """
+
+    parser = OptionParser(prog=basename(argv[0]) + " batch")
+
+    parser.set_usage("%prog [options] srcdir outdir")
+    _addFilterOptions(parser)
+    parser.add_option(
+        "-p", "--pattern",
+        action="append", type="string", dest="patterns",
+        help="filename pattern of files to filter (default: *.py); "
+             "may be given more than once"
+    )
+    parser.add_option(
+        "-j", "--jobs",
+        action="store", type="int", dest="jobs", default=1,
+        help="number of files to filter in parallel; 0 uses every core"
+    )
+    group = OptionGroup(parser, "Git Options",
+                        "Only filter the files git reports as changed into "
+                        "an existing mirror.")
+    group.add_option(
+        "--git-since",
+        action="store", type="string", dest="gitSince", metavar="REV",
+        help="filter the files changed since this revision; without "
+             "--git-until this includes uncommitted and untracked files"
+    )
+    group.add_option(
+        "--git-until",
+        action="store", type="string", dest="gitUntil", metavar="REV",
+        help="compare against this revision instead of the working tree, "
+             "which should have it checked out"
+    )
+    parser.add_option_group(group)
+    parser.add_option(
+        "--shard",
+        action="callback", type="string", dest="shard", callback=_storeShard,
+        metavar="I/N",
+        help="only filter the I-th of N similarly sized shards of the tree "
+             "(counting from 1); combine the mirrors with the merge "
+             "subcommand"
+    )
+
+    ## Parse options based on our definition.
+    (options, dirs) = parser.parse_args(args)
+
+    if len(dirs) != 2:
+        parser.error("expected a source directory and an output directory")
+    if not options.patterns:
+        options.patterns = ['*.py']
+    if options.jobs < 0:
+        parser.error("the number of jobs must not be negative")
+    if options.gitUntil and not options.gitSince:
+        parser.error("--git-until needs --git-since")
+    if options.shard and options.gitSince:
+        parser.error("--shard can't be combined with --git-since")
+
+    return options, dirs[0], dirs[1]
+
+
+def watchOptParse(args):
+    """
+    Parses command line options for the watch subcommand.
+
+    The watch subcommand takes all the usual filter options plus a source
+    tree to watch and the mirror directory to keep up to date.
+    """
+
+    parser = OptionParser(prog=basename(argv[0]) + " watch")
+
+    parser.set_usage("%prog [options] srcdir outdir")
+    _addFilterOptions(parser)
+    parser.add_option(
+        "-p", "--pattern",
+        action="append", type="string", dest="patterns",
+        help="filename pattern of files to filter (default: *.py); "
+             "may be given more than once"
+    )
+    parser.add_option(
+        "-j", "--jobs",
+        action="store", type="int", dest="jobs", default=1,
+        help="number of files to filter in parallel when catching up on "
+             "start; 0 uses every core"
+    )
+    parser.add_option(
+        "--debounce",
+        action="store", type="float", dest="debounce", default=0.2,
+        help="seconds the tree has to be quiet before refiltering "
+             "(default: %default)"
+    )
+    parser.add_option(
+        "--poll",
+        action="store_true", dest="poll",
+        help="poll the tree even where inotify is available"
+    )
+    parser.add_option(
+        "--interval",
+        action="store", type="float", dest="interval", default=1.0,
+        help="seconds between looks at the tree when polling "
+             "(default: %default)"
+    )
+
+    ## Parse options based on our definition.
+    (options, dirs) = parser.parse_args(args)
+
+    if len(dirs) != 2:
+        parser.error("expected a source directory and an output directory")
+    if not options.patterns:
+        options.patterns = ['*.py']
+    if options.jobs < 0:
+        parser.error("the number of jobs must not be negative")
+    if options.debounce < 0 or options.interval <= 0:
+        parser.error("the debounce delay and polling interval must be positive")
+
+    return options, dirs[0], dirs[1]
+
+
+def mergeOptParse(args):
+    """
+    Parses command line options for the merge subcommand.
+
+    The merge subcommand takes the mirror directory to write to and the
+    mirrors of the shards to combine into it.
+    """
+
+    parser = OptionParser(prog=basename(argv[0]) + " merge")
+
+    parser.set_usage("%prog [options] outdir sharddir...")
+
+    ## Parse options based on our definition.
+    (options, dirs) = parser.parse_args(args)
+
+    if len(dirs) < 2:
+        parser.error("expected an output directory and shard directories")
+    if abspath(dirs[0]) in [abspath(shardDir) for shardDir in dirs[1:]]:
+        parser.error("the output directory can't be one of the shards")
+
+    return options, dirs[0], dirs[1:]
+
+
+def rulesOptParse(args):
+    """
+    Parses command line options for the rules subcommand.
+
+    The rules subcommand takes all the usual filter options, which get
+    baked into the rules, plus a source tree and the mirror directory the
+    rules should filter it into.
+    """
+
+    parser = OptionParser(prog=basename(argv[0]) + " rules")
+
+    parser.set_usage("%prog [options] srcdir outdir")
+    _addFilterOptions(parser)
+    parser.add_option(
+        "-p", "--pattern",
+        action="append", type="string", dest="patterns",
+        help="filename pattern of files to filter (default: *.py); "
+             "may be given more than once"
+    )
+    parser.add_option(
+        "-f", "--format",
+        action="store", type="choice", choices=["ninja", "make"],
+        dest="rulesFormat",
+        help="write a Ninja file or a Makefile fragment (default: make if "
+             "the rules file ends in .mk or is a Makefile, otherwise ninja)"
+    )
+    parser.add_option(
+        "-o", "--output",
+        action="store", type="string", dest="rulesPath",
+        help="file to write the rules to (default: stdout)"
+    )
+
+    ## Parse options based on our definition.
+    (options, dirs) = parser.parse_args(args)
+
+    if len(dirs) != 2:
+        parser.error("expected a source directory and an output directory")
+    if not options.patterns:
+        options.patterns = ['*.py']
+    if not options.rulesFormat:
+        rulesName = basename(options.rulesPath or '')
+        options.rulesFormat = 'make' if rulesName.endswith('.mk') or \
+            'makefile' in rulesName.lower() else 'ninja'
+
+    return options, dirs[0], dirs[1]
+
+
+def doxyfileOptParse(args):
+    """
+    Parses command line options for the doxyfile subcommand.
+
+    The doxyfile subcommand takes a Doxyfile to read and the name of the
+    derived Doxyfile to write.
+    """
+
+    parser = OptionParser(prog=basename(argv[0]) + " doxyfile")
+
+    parser.set_usage("%prog [options] doxyfile derived-doxyfile")
+    parser.add_option(
+        "-s", "--staging",
+        action="store", type="string", dest="stagingDir",
+        help="directory to stage the filtered inputs in (default: "
+             "doxypypy3-staging next to the derived Doxyfile)"
+    )
+    parser.add_option(
+        "-j", "--jobs",
+        action="store", type="int", dest="jobs", default=0,
+        help="number of files to filter in parallel; 0 (the default) uses "
+             "every core"
+    )
+
+    ## Parse options based on our definition.
+    (options, doxyfiles) = parser.parse_args(args)
+
+    if len(doxyfiles) != 2:
+        parser.error("expected a Doxyfile and a derived Doxyfile to write")
+    if options.jobs < 0:
+        parser.error("the number of jobs must not be negative")
+    if not options.stagingDir:
+        options.stagingDir = join(dirname(abspath(doxyfiles[1])),
+                                  'doxypypy3-staging')
+
+    return options, doxyfiles[0], doxyfiles[1]
+
+
+def cacheOptParse(args):
+    """
+    Parses command line options for the cache subcommand.
+
+    The cache subcommand either reports statistics about a cache, prunes
+    it down by age and/or size, compacts a pack cache, or exports or
+    imports a bundle of its entries.
+    """
+
+    parser = OptionParser(prog=basename(argv[0]) + " cache")
+
+    parser.set_usage("%prog [options] stats|prune|compact\n"
+                     "       %prog [options] export|import bundle")
+    parser.add_option(
+        "--cache-dir",
+        action="store", type="string", dest="cacheDir",
+        default=environ.get('DOXYPYPY3_CACHE_DIR') or None,
+        help="the cache directory (default: $DOXYPYPY3_CACHE_DIR)"
+    )
+    parser.add_option(
+        "--cache-format",
+        action="store", type="choice", choices=["files", "pack"],
+        dest="cacheFormat",
+        default=environ.get('DOXYPYPY3_CACHE_FORMAT') or None,
+        help="format of a cache that doesn't exist yet, for import "
+             "(default: $DOXYPYPY3_CACHE_FORMAT if set, otherwise files)"
+    )
+    parser.add_option(
+        "--max-age",
+        action="store", type="float", dest="maxAge",
+        help="prune entries unused for this many days"
+    )
+    parser.add_option(
+        "--max-size",
+        action="callback", type="string", dest="maxSize",
+        callback=_storeSize, default=_getDefaultSize('DOXYPYPY3_CACHE_MAX_SIZE'),
+        help="prune least recently used entries down to this size, e.g. 500M "
+             "(default: $DOXYPYPY3_CACHE_MAX_SIZE if set)"
+    )
+
+    ## Parse options based on our definition.
+    (options, actions) = parser.parse_args(args)
+
+    if actions[:1] in (['export'], ['import']):
+        if len(actions) != 2:
+            parser.error("{0} needs a bundle file".format(actions[0]))
+        options.bundlePath = actions.pop()
+    if len(actions) != 1 or actions[0] not in ('stats', 'prune', 'compact',
+                                               'export', 'import'):
+        parser.error("expected one of stats, prune, compact, export, "
+                     "or import")
+    if not options.cacheDir:
+        parser.error("no cache directory given")
+    if actions[0] == 'prune' and options.maxAge is None and \
+            options.maxSize is None:
+        parser.error("prune needs a maximum age or size")
+
+    return options, actions[0]
@@ -4,29 +4,98 @@ from re import compile as regexpCompile, IGNORECASE, MULTILINE
 linesep = "\n"
 
 
+class _Lazy:
+    """
+    A class attribute that only gets built once it's first looked up.
+
+    The first lookup replaces it on its class with what it was built into,
+    so later lookups cost no more than any other.  Compiling every pattern
+    up front would cost each run of the filter a few milliseconds, whether
+    or not it needed them.
+    """
+
+    def __init__(self, build):
+        """Sets up the attribute to be built by calling build."""
+        self.build = build
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        """Notes the name of the attribute."""
+        self.name = name
+
+    def __get__(self, instance, owner):
+        """Builds the attribute and puts it in place of the descriptor."""
+        value = self.build()
+        setattr(owner, self.name, value)
+        return value
+
+
+def _lazyCompile(*args):
+    """Compiles a regular expression once it's first used."""
+    return _Lazy(lambda: regexpCompile(*args))
+
+
+def compileAll():
+    """
+    Builds every lazy attribute of RE right away.
+
+    Long-lived processes call this before they start serving, so the
+    patterns get compiled once rather than in every request that uses them.
+    """
+    for name, value in list(vars(RE).items()):
+        if isinstance(value, _Lazy):
+            getattr(RE, name)
+
+
 ## @formatter:off ↓
 class RE:
 
-    _indentRE        = regexpCompile(r'^(\s*)\S')
-    _newlineRE       = regexpCompile(r'^#', MULTILINE)
-    _blanklineRE     = regexpCompile(r'^\s*$')
-    _docstrMarkerRE  = regexpCompile(r"\s*([uUbB]*[rR]?(['\"]{3}))")
-    _docstrOneLineRE = regexpCompile(r"\s*[uUbB]*[rR]?(['\"]{3})(.+)\1")
-
-    _implementsRE = regexpCompile(r"^(\s*)(?:zope\.)?(?:interface\.)?"
-                                  r"(?:module|class|directly)?"
-                                  r"(?:Provides|Implements)\(\s*(.+)\s*\)",
-                                  IGNORECASE) ## zope
-    _classRE        = regexpCompile(r"^\s*class\s+(\S+)\s*\((\S+)\):")
-    _interfaceRE    = regexpCompile(r"^\s*class\s+(\S+)\s*\(\s*(?:zope\.)?"
-                                 r"(?:interface\.)?"
-                                 r"Interface\s*\)\s*:", IGNORECASE) ## zope
-    _attributeRE    = regexpCompile(r"^(\s*)(\S+)\s*=\s*(?:zope\.)?"
-                                 r"(?:interface\.)?"
-                                 r"Attribute\s*\(['\"]{1,3}(.*)['\"]{1,3}\)",
+    _indentRE        = _lazyCompile(r'^(\s*)\S')
+    _newlineRE       = _lazyCompile(r'^#', MULTILINE)
+    _blanklineRE     = _lazyCompile(r'^\s*$')
+    _docstrMarkerRE  = _lazyCompile(r"\s*([uUbB]*[rR]?(['\"]{3}))")
+    _docstrOneLineRE = _lazyCompile(r"\s*[uUbB]*[rR]?(['\"]{3})(.+)\1")
+
+    _implementsRE = _lazyCompile(r"^(\s*)(?:zope\.)?(?:interface\.)?"
+                                 r"(?:module|class|directly)?"
+                                 r"(?:Provides|Implements)\(\s*(.+)\s*\)",
                                  IGNORECASE) ## zope
+    _classRE        = _lazyCompile(r"^\s*class\s+(\S+)\s*\((\S+)\):")
+    _interfaceRE    = _lazyCompile(r"^\s*class\s+(\S+)\s*\(\s*(?:zope\.)?"
+                                r"(?:interface\.)?"
+                                r"Interface\s*\)\s*:", IGNORECASE) ## zope
+    _attributeRE    = _lazyCompile(r"^(\s*)(\S+)\s*=\s*(?:zope\.)?"
+                                r"(?:interface\.)?"
+                                r"Attribute\s*\(['\"]{1,3}(.*)['\"]{1,3}\)",
+                                IGNORECASE) ## zope
+
+    # Scanned for in raw source to tell whether the walker might change
+    # anything: docstrings (strings starting the module, or the first line
+    # after a colon, or right after a def or class header) and assignments
+    # to private names, be they on lines of their own or following a ; or
+    # the colon of a compound statement.  Each is searched for on its own,
+    # as an alternation of them all would be several times slower.
+    _walkNeededREs  = _Lazy(lambda: (
+        regexpCompile(br"\A(?:\xef\xbb\xbf)?"
+                      br"(?:[ \t\f]*(?:#[^\r\n]*)?(?:\r\n|\r|\n))*"
+                      br"[ \t\f]*[rubfRUBF]{0,2}['\"]"),
+        regexpCompile(br":[ \t\f]*(?:#[^\r\n]*|\\)?(?:\r\n|\r|\n)"
+                      br"(?:[ \t\f]*(?:#[^\r\n]*)?(?:\r\n|\r|\n))*"
+                      br"[ \t\f]*[rubfRUBF]{0,2}['\"]"),
+        regexpCompile(br"\)[ \t\f]*(?:->[^:\r\n]*)?:[ \t\f]*[rubfRUBF]{0,2}['\"]"),
+        regexpCompile(br"class[ \t\f]+[\w\x80-\xff]+[ \t\f]*:"
+                      br"[ \t\f]*[rubfRUBF]{0,2}['\"]"),
+        regexpCompile(br"^[ \t\f]*_[\w\x80-\xff]*(?<!__)[ \t\f]*=(?!=)",
+                      MULTILINE),
+        regexpCompile(br"[;:][ \t\f]*_[\w\x80-\xff]*(?<!__)[ \t\f]*=(?!=)"),
+    ))
+    # The zope interface markers (in lower case) and what has to follow
+    # them; they're found by plain searches, as case-insensitive regular
+    # expressions are slow to scan with.
+    _markerKeywords = (b'attribute', b'implements', b'provides', b'interface')
+    _markerTailRE   = _lazyCompile(br"[ \t\f]*[()]")
 
-    _singleLineREs  = {
+    _singleLineREs  = _Lazy(lambda: {
         ' @author: '  : regexpCompile(r"^(\s*Authors?:\s*)(.*)$", IGNORECASE),
         ' @copyright ': regexpCompile(r"^(\s*Copyright:\s*)(.*)$", IGNORECASE),
         ' @date '     : regexpCompile(r"^(\s*Date:\s*)(.*)$", IGNORECASE),
@@ -34,22 +103,22 @@ class RE:
         ' @version: ' : regexpCompile(r"^(\s*Version:\s*)(.*)$", IGNORECASE),
         ' @note '     : regexpCompile(r"^(\s*Note:\s*)(.*)$", IGNORECASE),
         ' @warning '  : regexpCompile(r"^(\s*Warning:\s*)(.*)$", IGNORECASE)
-    }
-    _argsStartRE    = regexpCompile(r"^(\s*(?:(?:Keyword\s+)?"
-                                 r"(?:A|Kwa)rg(?:ument)?|Attribute)s?"
-                                 r"\s*:\s*)$", IGNORECASE)
-    _argsRE = regexpCompile(r"^\s*(?P<name>\w+)\s*(?P<type>\(?\S*\)?)?\s*"
-                            r"(?:-|:)+\s+(?P<desc>.+)$")
-    _returnsStartRE = regexpCompile(r"^\s*(?:Return|Yield)s:\s*$", IGNORECASE)
-    _raisesStartRE  = regexpCompile(r"^\s*(Raises|Exceptions|See Also):\s*$",
-                                   IGNORECASE)
-    _listRE           = regexpCompile(r"^\s*(([\w\.]+),\s*)+(&|and)?\s*([\w\.]+)$")
-    _singleListItemRE = regexpCompile(r'^\s*([\w\.]+)\s*$')
-    _listItemRE       = regexpCompile(r'([\w\.]+),?\s*')
-    _examplesStartRE  = regexpCompile(r"^\s*(?:Example|Doctest)s?:\s*$",
-                                     IGNORECASE)
-    _sectionStartRE   = regexpCompile(r"^\s*(([A-Z]\w* ?){1,2}):\s*$")
+    })
+    _argsStartRE    = _lazyCompile(r"^(\s*(?:(?:Keyword\s+)?"
+                                r"(?:A|Kwa)rg(?:ument)?|Attribute)s?"
+                                r"\s*:\s*)$", IGNORECASE)
+    _argsRE = _lazyCompile(r"^\s*(?P<name>\w+)\s*(?P<type>\(?\S*\)?)?\s*"
+                           r"(?:-|:)+\s+(?P<desc>.+)$")
+    _returnsStartRE = _lazyCompile(r"^\s*(?:Return|Yield)s:\s*$", IGNORECASE)
+    _raisesStartRE  = _lazyCompile(r"^\s*(Raises|Exceptions|See Also):\s*$",
+                                  IGNORECASE)
+    _listRE           = _lazyCompile(r"^\s*(([\w\.]+),\s*)+(&|and)?\s*([\w\.]+)$")
+    _singleListItemRE = _lazyCompile(r'^\s*([\w\.]+)\s*$')
+    _listItemRE       = _lazyCompile(r'([\w\.]+),?\s*')
+    _examplesStartRE  = _lazyCompile(r"^\s*(?:Example|Doctest)s?:\s*$",
+                                    IGNORECASE)
+    _sectionStartRE   = _lazyCompile(r"^\s*(([A-Z]\w* ?){1,2}):\s*$")
     # The error line should match traceback lines, error exception lines, and
     # (due to a weird behavior of codeop) single word lines.
-    _errorLineRE      = regexpCompile(r"^\s*((?:\S+Error|Traceback.*):?\s*(.*)|@?[\w.]+)\s*$",
-                                 IGNORECASE)
+    _errorLineRE      = _lazyCompile(r"^\s*((?:\S+Error|Traceback.*):?\s*(.*)|@?[\w.]+)\s*$",
+                                IGNORECASE)
@@ -0,0 +1,346 @@
+# coding=utf-8
+"""
+Pre-filters the inputs of a Doxyfile so that Doxygen needn't run the filter.
+
+Doxygen starts its INPUT_FILTER once for every single file, which means a
+fork, an exec, and a full import of the filter per file, all competing
+with Doxygen's own NUM_PROC_THREADS for the CPU.  The doxyfile subcommand
+reads a Doxyfile, works out the same set of input files Doxygen would
+(INPUT, FILE_PATTERNS, RECURSIVE, EXCLUDE, and EXCLUDE_PATTERNS), and
+filters every file that the Doxyfile hands to doxypypy3 (through
+INPUT_FILTER or FILTER_PATTERNS) in parallel into a staging tree.  All
+other input files are copied there unchanged.  Finally a derived Doxyfile
+gets written that reads its input from the staging tree with the doxypypy3
+filter removed.
+
+The staging tree gets cleaned of whatever is no longer an input, so the
+subcommand marks the directory as its own when creating it, and refuses
+to touch an existing directory that doesn't carry the marker.
+
+Doxygen resolves relative paths against the directory it's started in, so
+this should be run from that same directory.
+"""
+from fnmatch import fnmatch
+from os import environ, listdir, makedirs, rmdir, sep, unlink, walk
+from os.path import abspath, basename, dirname, isfile, join
+from re import compile as regexpCompile
+from shlex import split as shellSplit
+from shutil import copy2
+from sys import exit as sysExit, stderr
+
+from .batch import runTasks
+from .cmd_options import (doxyfileOptParse, filterOptParse,
+                          getFullPathNamespace)
+from .compile import linesep
+
+## Doxygen's own FILE_PATTERNS default.
+DefaultFilePatterns = [
+    '*.c', '*.cc', '*.cxx', '*.cpp', '*.c++', '*.java', '*.ii', '*.ixx',
+    '*.ipp', '*.i++', '*.inl', '*.idl', '*.ddl', '*.odl', '*.h', '*.hh',
+    '*.hxx', '*.hpp', '*.h++', '*.cs', '*.d', '*.php', '*.php4', '*.php5',
+    '*.phtml', '*.inc', '*.m', '*.markdown', '*.md', '*.mm', '*.dox', '*.py',
+    '*.pyw', '*.f90', '*.f95', '*.f03', '*.f08', '*.f', '*.for', '*.tcl',
+    '*.vhd', '*.vhdl', '*.ucf', '*.qsf', '*.ice'
+]
+## Filter command used for staged files that must not be filtered again.
+PassthroughFilter = 'cat'
+## File marking a directory as a staging tree of ours.
+StagingMarker = '.doxypypy3-staging'
+
+_assignmentRE = regexpCompile(r'^\s*(@?[A-Za-z_][A-Za-z0-9_]*)\s*(\+?=)(.*)$')
+_tokenRE = regexpCompile(r'"((?:[^"\\]|\\.)*)"|([^\s,"]+)')
+_envRE = regexpCompile(r'\$\(([^)]+)\)')
+
+
+class StagingError(Exception):
+    """Raised for staging directories that aren't ours to clean out."""
+
+
+def readDoxyfile(doxyfilePath, config=None):
+    """
+    Reads a Doxyfile into a dictionary of raw (unsplit) values.
+
+    Handles comments, line continuations, "+=" appends, environment
+    variable references, and @INCLUDE.  Later assignments override earlier
+    ones just as they do for Doxygen.
+    """
+    if config is None:
+        config = {}
+    with open(doxyfilePath, encoding='utf8', errors='replace') as doxyfile:
+        text = doxyfile.read()
+    text = text.replace('\\' + linesep, ' ')
+    for line in text.split(linesep):
+        if line.lstrip().startswith('#'):
+            continue
+        match = _assignmentRE.match(line)
+        if not match:
+            continue
+        key, operator, value = match.groups()
+        value = _envRE.sub(lambda envMatch: environ.get(envMatch.group(1), ''),
+                           value).strip()
+        if key == '@INCLUDE':
+            for includePath in splitValue(value):
+                if not isfile(includePath):
+                    for includeDir in splitValue(config.get('@INCLUDE_PATH', '')):
+                        if isfile(join(includeDir, includePath)):
+                            includePath = join(includeDir, includePath)
+                            break
+                readDoxyfile(includePath, config)
+        elif operator == '+=' and config.get(key):
+            config[key] = '{0} {1}'.format(config[key], value)
+        else:
+            config[key] = value
+    return config
+
+
+def splitValue(value):
+    """Splits a raw Doxyfile list value into its (unquoted) elements."""
+    return [quoted.replace('\\"', '"') if quoted or not bare else bare
+            for quoted, bare in _tokenRE.findall(value)]
+
+
+def getString(config, key):
+    """Returns a Doxyfile string value with any surrounding quotes removed."""
+    value = config.get(key, '').strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1].replace('\\"', '"')
+    return value
+
+
+def quoteValue(value):
+    """Quotes a single Doxyfile value if it needs it."""
+    if not value or any(char in value for char in ' \t,"#'):
+        return '"{0}"'.format(value.replace('"', '\\"'))
+    return value
+
+
+def getFilterArgs(filterCommand):
+    """
+    Returns the filter options of a doxypypy3 filter command.
+
+    Returns None if the command doesn't run doxypypy3 at all.
+    """
+    try:
+        words = shellSplit(filterCommand)
+    except ValueError:
+        return None
+    for wordNum, word in enumerate(words):
+        if 'doxypypy3' in basename(word):
+            return words[wordNum + 1:]
+    return None
+
+
+def getFilterPatterns(config):
+    """Returns the FILTER_PATTERNS of a Doxyfile as (pattern, filter) pairs."""
+    filterPatterns = []
+    for entry in splitValue(config.get('FILTER_PATTERNS', '')):
+        pattern, separator, filterCommand = entry.partition('=')
+        if separator:
+            filterPatterns.append((pattern, filterCommand))
+    return filterPatterns
+
+
+def getFilterCommand(config, filename):
+    """Returns the filter command Doxygen would run on the given file."""
+    for pattern, filterCommand in getFilterPatterns(config):
+        if fnmatch(basename(filename), pattern) or fnmatch(filename, pattern):
+            return filterCommand
+    return getString(config, 'INPUT_FILTER')
+
+
+def findInputFiles(config, excludeDirs=()):
+    """
+    Returns the absolute paths of all files Doxygen would read as input.
+
+    Follows Doxygen's rules: directories listed in INPUT are searched for
+    files matching FILE_PATTERNS (recursively only if RECURSIVE is set),
+    and anything listed in EXCLUDE or matching EXCLUDE_PATTERNS is skipped.
+    Directories in excludeDirs (such as our own staging tree) are skipped
+    as well.
+    """
+    filePatterns = splitValue(config.get('FILE_PATTERNS', '')) or \
+        DefaultFilePatterns
+    excludes = set(abspath(path)
+                   for path in splitValue(config.get('EXCLUDE', '')))
+    excludes.update(abspath(excludeDir) for excludeDir in excludeDirs)
+    excludePatterns = splitValue(config.get('EXCLUDE_PATTERNS', ''))
+    recursive = config.get('RECURSIVE', 'NO').strip().upper() == 'YES'
+
+    def isExcluded(path):
+        """Checks a path against EXCLUDE and EXCLUDE_PATTERNS."""
+        return path in excludes or \
+            any(fnmatch(path, pattern) for pattern in excludePatterns)
+
+    inputFiles = []
+    for inputPath in splitValue(config.get('INPUT', '')) or ['.']:
+        inputPath = abspath(inputPath)
+        if isExcluded(inputPath):
+            continue
+        if isfile(inputPath):
+            inputFiles.append(inputPath)
+            continue
+        for dirPath, dirNames, fileNames in walk(inputPath):
+            dirNames[:] = sorted(
+                dirName for dirName in dirNames
+                if recursive and not isExcluded(join(dirPath, dirName))
+            )
+            for fileName in sorted(fileNames):
+                filePath = join(dirPath, fileName)
+                if any(fnmatch(fileName, pattern) for pattern in filePatterns) \
+                        and not isExcluded(filePath):
+                    inputFiles.append(filePath)
+    return inputFiles
+
+
+def getStagedPath(stagingDir, path):
+    """Returns where the given path gets mirrored within the staging tree."""
+    return join(stagingDir, abspath(path).lstrip(sep))
+
+
+def prepareStagingDir(stagingDir):
+    """
+    Makes sure stagingDir is a staging tree of ours, creating it if need be.
+
+    A new or empty directory gets marked as ours; any other directory has
+    to carry the marker already.
+    """
+    makedirs(stagingDir, exist_ok=True)
+    markerPath = join(stagingDir, StagingMarker)
+    if isfile(markerPath):
+        return
+    if listdir(stagingDir):
+        raise StagingError("{0} isn't a doxypypy3 staging tree; refusing to "
+                           "clean it out".format(stagingDir))
+    with open(markerPath, 'w', encoding='utf8') as markerFile:
+        markerFile.write("# Staging tree of doxypypy3; its contents get "
+                         "replaced on every run." + linesep)
+
+
+def stageInputs(config, stagingDir, jobs):
+    """
+    Fills the staging tree with the Doxyfile's (pre-filtered) input files.
+
+    Files Doxygen would have run through doxypypy3 are filtered in parallel
+    using the options given in the Doxyfile; everything else is copied.
+    Anything left over in the staging tree from earlier runs that is no
+    longer an input gets removed, so Doxygen doesn't document files that
+    have since been deleted or excluded.
+    Returns the number of files filtered and passed through unchanged.
+    """
+    prepareStagingDir(stagingDir)
+    tasks = []
+    stagedFiles = set()
+    for inputFile in findInputFiles(config, [stagingDir]):
+        stagedFile = getStagedPath(stagingDir, inputFile)
+        stagedFiles.add(stagedFile)
+        filterArgs = getFilterArgs(getFilterCommand(config, inputFile))
+        if filterArgs is None:
+            makedirs(dirname(stagedFile), exist_ok=True)
+            copy2(inputFile, stagedFile)
+            continue
+        options = filterOptParse(filterArgs)
+        # Doxygen always hands its filters absolute paths.
+        options.fullPathNamespace = getFullPathNamespace(
+            inputFile, options.topLevelNamespace)
+        tasks.append((inputFile, stagedFile, options))
+    removeStaleFiles(stagingDir, stagedFiles)
+    return runTasks(tasks, jobs)
+
+
+def removeStaleFiles(stagingDir, stagedFiles):
+    """
+    Removes everything beneath stagingDir that isn't one of stagedFiles.
+
+    Directories left empty are removed as well.  The staging tree is ours
+    alone, so nothing else is expected to live in it; unless it carries our
+    marker, StagingError is raised rather than anything removed.
+    """
+    markerPath = join(stagingDir, StagingMarker)
+    if not isfile(markerPath):
+        raise StagingError("{0} isn't a doxypypy3 staging tree; refusing to "
+                           "clean it out".format(stagingDir))
+    stagedFiles = set(stagedFiles) | {markerPath}
+    for dirPath, dirNames, fileNames in walk(stagingDir, topdown=False):
+        for fileName in fileNames:
+            filePath = join(dirPath, fileName)
+            if filePath not in stagedFiles:
+                unlink(filePath)
+        for dirName in dirNames:
+            try:
+                rmdir(join(dirPath, dirName))
+            except OSError:
+                # Still holds staged files.
+                pass
+
+
+def getDerivedSettings(config, stagingDir):
+    """
+    Returns the settings overriding the original Doxyfile's.
+
+    INPUT and STRIP_FROM_PATH are moved into the staging tree and all
+    doxypypy3 filtering is dropped.  Should some other INPUT_FILTER remain,
+    files that doxypypy3 already filtered are kept away from it.
+    """
+    inputFilter = getString(config, 'INPUT_FILTER')
+    if getFilterArgs(inputFilter) is not None:
+        inputFilter = ''
+    filterPatterns = []
+    for pattern, filterCommand in getFilterPatterns(config):
+        if getFilterArgs(filterCommand) is None:
+            filterPatterns.append((pattern, filterCommand))
+        elif inputFilter:
+            filterPatterns.append((pattern, PassthroughFilter))
+
+    inputs = splitValue(config.get('INPUT', '')) or ['.']
+    stripFromPath = splitValue(config.get('STRIP_FROM_PATH', '')) or ['.']
+    return [
+        ('INPUT', [getStagedPath(stagingDir, path) for path in inputs]),
+        ('EXCLUDE', []),
+        ('STRIP_FROM_PATH', [getStagedPath(stagingDir, path)
+                             for path in stripFromPath]),
+        ('INPUT_FILTER', [inputFilter] if inputFilter else []),
+        ('FILTER_PATTERNS', ['{0}={1}'.format(pattern, filterCommand)
+                             for pattern, filterCommand in filterPatterns]),
+    ]
+
+
+def writeDerivedDoxyfile(doxyfilePath, derivedPath, settings):
+    """
+    Writes the original Doxyfile followed by our overriding settings.
+
+    Doxygen lets later assignments win, so everything else, including any
+    @INCLUDEs, carries over untouched.
+    """
+    with open(doxyfilePath, encoding='utf8', errors='replace') as doxyfile:
+        text = doxyfile.read()
+    makedirs(dirname(abspath(derivedPath)), exist_ok=True)
+    with open(derivedPath, 'w', encoding='utf8') as derivedFile:
+        derivedFile.write(text.rstrip(linesep) + linesep * 2)
+        derivedFile.write("# Inputs pre-filtered by doxypypy3." + linesep)
+        for key, values in settings:
+            derivedFile.write('{0:<20} = {1}{2}'.format(
+                key, ' '.join(quoteValue(value) for value in values), linesep))
+
+
+def prefilterDoxyfile(doxyfilePath, derivedPath, stagingDir, jobs=0):
+    """
+    Stages the Doxyfile's inputs and writes the derived Doxyfile.
+
+    Returns the number of files filtered and passed through unchanged.
+    """
+    config = readDoxyfile(doxyfilePath)
+    results = stageInputs(config, stagingDir, jobs)
+    writeDerivedDoxyfile(doxyfilePath, derivedPath,
+                         getDerivedSettings(config, stagingDir))
+    return results
+
+
+def main(args):
+    """Runs the doxyfile subcommand on the given command line arguments."""
+    (options, doxyfilePath, derivedPath) = doxyfileOptParse(args)
+    try:
+        prefilterDoxyfile(doxyfilePath, derivedPath, options.stagingDir,
+                          options.jobs)
+    except StagingError as error:
+        stderr.write("doxypypy3: {0}{1}".format(error, linesep))
+        sysExit(1)
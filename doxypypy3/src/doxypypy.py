@@ -13,20 +13,30 @@ Google style guide into appropriate Doxygen tags, and is even aware of
 doctests.
 """
 import ast
+from contextlib import contextmanager
+from os import fstat
 
-from types import GeneratorType
 from sys import stderr
 
 from string import whitespace
-from codeop import compile_command
 
-import goto
-from goto import with_goto
-
-from .compile import RE, linesep
+from .compile import RE, compileAll, linesep
 from .ast_visit import AstVisit
+from .generated import getStubLines, isGenerated
 
 NotFound = -1
+## Roughly how many characters of output get encoded and written at once.
+OutputChunkSize = 1 << 16
+## Files this large get memory-mapped when their raw bytes are needed.
+MmapThreshold = 1 << 20
+## How much raw source gets lowered at a time looking for interface markers.
+MarkerChunkSize = 1 << 20
+## The shortest a timer gets set for, in seconds, when restoring one that
+# should have fired already.
+MinTimerDelay = 1e-6
+## How a file gets filtered: walked, passed through, or passed through
+# beneath a @file stub.
+Walk, PassThrough, Stub = 'walk', 'pass', 'stub'
 
 
 def coroutine(func):
@@ -76,6 +86,7 @@ class AstWalker(AstVisit, ast.NodeVisitor, ):
     @coroutine
     def _checkIfCode(self, inCodeBlock):
         """Checks whether or not a given line appears to be Python code."""
+        from codeop import compile_command
         while True:
             ## @formatter:off ↓
             line    :str
@@ -137,17 +148,20 @@ class AstWalker(AstVisit, ast.NodeVisitor, ):
                     linesep
                 )
 
-    @coroutine
-    @with_goto
-    def __alterDocstring(self, tail='', writer=None):
+    def __alterDocstring(self, docLines, tail=''):
         """
-        Runs eternally, processing docstring lines.
+        Applies appropriate Doxygen tags to the lines of a docstring.
 
-        Parses docstring lines as they get fed in via send, applies appropriate
-        Doxygen tags, and passes them along in batches for writing.
+        Makes a single pass over the lines and returns the blocks of lines
+        replacing them, as (firstLineNum, lastLineNum, lines) tuples in
+        order.  A line with a one-line tag such as Author: ends the block
+        before it and the block it's in.
         """
-        assert isinstance(tail, str) and isinstance(writer, GeneratorType)
-
+        autobrief = self.options.autobrief
+        autocode = self.options.autocode
+        tablength = self.options.tablength
+        lastDocLineNum = len(docLines) - 1
+        blocks = []
         lines = []
         timeToSend = False
         inCodeBlock = False
@@ -155,50 +169,46 @@ class AstWalker(AstVisit, ast.NodeVisitor, ):
         prefix = ''
         firstLineNum = -1
         sectionHeadingIndent = 0
-        codeChecker = self._checkIfCode(False)
-        proseChecker = self._checkIfCode(True)
-        while True:
-            lineNum, line = (yield)
+        codeChecker = proseChecker = None
+        for lineNum, line in enumerate(docLines):
             if firstLineNum < 0:
                 firstLineNum = lineNum
-            # Don't bother doing extra work if it's a sentinel.
-            if line is not None:
-                # Also limit work if we're not parsing the docstring.
-                if self.options.autobrief:
+            # Limit work if we're not parsing the docstring.
+            if autobrief:
+                # Every one of the one-line tags ends in a colon.
+                if ':' in line:
                     for doxyTag, tagRE in RE._singleLineREs.items():
                         match = tagRE.search(line)
                         if match:
                             # We've got a simple one-line Doxygen command
-                            lines[-1], inCodeBlock = AstWalker._endCodeIfNeeded(
+                            lines[-1], inCodeBlock = self._endCodeIfNeeded(
                                 lines[-1], inCodeBlock)
-                            writer.send((firstLineNum, lineNum - 1, lines))
+                            blocks.append((firstLineNum, lineNum - 1, lines))
                             lines = []
                             firstLineNum = lineNum
                             line = line.replace(match.group(1), doxyTag)
                             timeToSend = True
 
-                    ## ---
-                    if inSection:
-                        # The last line belonged to a section.
-                        # Does this one too? (Ignoring empty lines.)
-                        match = RE._blanklineRE.match(line)
-                        if not match:
-                            indent = len(line.expandtabs(self.options.tablength)) - \
-                                     len(line.expandtabs(self.options.tablength).lstrip())
-                            if indent <= sectionHeadingIndent:
-                                inSection = False
-                            else:
-                                if lines[-1] == '#':
-                                    # If the last line was empty, but we're still in a section
-                                    # then we need to start a new paragraph.
-                                    lines[-1] = '# @par'
-                    ## ---
-                    match = RE._returnsStartRE.match(line)
-                    if match:
-                        # We've got a "returns" section
-                        line = line.replace(match.group(0), ' @return\t').rstrip()
-                        prefix = '@return\t'
-                        goto.end  # # ! goto
+                if inSection:
+                    # The last line belonged to a section.
+                    # Does this one too? (Ignoring empty lines.)
+                    match = RE._blanklineRE.match(line)
+                    if not match:
+                        expandedLine = line.expandtabs(tablength)
+                        indent = len(expandedLine) - len(expandedLine.lstrip())
+                        if indent <= sectionHeadingIndent:
+                            inSection = False
+                        elif lines[-1] == '#':
+                            # If the last line was empty, but we're still in
+                            # a section then we need to start a new paragraph.
+                            lines[-1] = '# @par'
+
+                match = RE._returnsStartRE.match(line)
+                if match:
+                    # We've got a "returns" section
+                    line = line.replace(match.group(0), ' @return\t').rstrip()
+                    prefix = '@return\t'
+                else:
                     match = RE._argsStartRE.match(line)
                     if match:
                         # We've got an "arguments" section
@@ -221,123 +231,107 @@ class AstWalker(AstVisit, ast.NodeVisitor, ):
                         else:
                             line = ' {0}\t{1[name]}\t{1[desc]}'.format(
                                 prefix, match.groupdict())
-                        goto.end  # # ! goto
-                    match = RE._raisesStartRE.match(line)
-                    if match:
-                        line = line.replace(match.group(0), '').rstrip()
-                        if 'see' in match.group(1).lower():
-                            # We've got a "see also" section
-                            prefix = '@sa\t'
-                        else:
-                            # We've got an "exceptions" section
-                            prefix = '@exception\t'
-                        lines[-1], inCodeBlock = self._endCodeIfNeeded(
-                            lines[-1], inCodeBlock)
-                        lines.append('#' + line)
-                        continue
-                    match = RE._listRE.match(line)
-                    if match and not inCodeBlock:
-                        # We've got a list of something or another
-                        itemList = []
-                        _match_items = RE._listItemRE.findall(AstWalker._stripOutAnds(match.group(0)))
-                        for itemMatch in _match_items:
-                            itemList.append('# {0}\t{1}{2}'.format(
-                                prefix, itemMatch, linesep))
-                        line = ''.join(itemList)[1:]
-                        goto.end  # # ! goto
-                    ## ---
-                    match = RE._examplesStartRE.match(line)
-                    judge1 = lambda: lines[-1].strip() == '#'
-                    if match and self.options.autocode and judge1():
-                        # We've got an "example" section
-                        inCodeBlock = True
-                        line = line.replace(match.group(0),
-                                            ' @b Examples{0}# @code'.format(linesep))
                     else:
-                        match = RE._sectionStartRE.match(line)
+                        match = RE._raisesStartRE.match(line)
                         if match:
-                            # We've got an arbitrary section
-                            prefix = ''
-                            inSection = True
-                            # What's the indentation of the section heading?
-                            sectionHeadingIndent = len(line.expandtabs(self.options.tablength)) \
-                                                   - len(
-                                line.expandtabs(self.options.tablength).lstrip())
-                            line = line.replace(
-                                match.group(0),
-                                ' @par {0}'.format(match.group(1))
-                            )
-                            if lines[-1] == '# @par':
-                                lines[-1] = '#'
+                            line = line.replace(match.group(0), '').rstrip()
+                            if 'see' in match.group(1).lower():
+                                # We've got a "see also" section
+                                prefix = '@sa\t'
+                            else:
+                                # We've got an "exceptions" section
+                                prefix = '@exception\t'
                             lines[-1], inCodeBlock = self._endCodeIfNeeded(
                                 lines[-1], inCodeBlock)
                             lines.append('#' + line)
                             continue
-                        elif prefix:
-                            match = RE._singleListItemRE.match(line)
-                            if match and not inCodeBlock:
-                                # Probably a single list item
-                                line = ' {0}\t{1}'.format(
-                                    prefix, match.group(0))
-                            elif self.options.autocode and inCodeBlock:
-                                proseChecker.send(
-                                    (
-                                        line, lines,
-                                        lineNum - firstLineNum
-                                    )
-                                )
-                            elif self.options.autocode:
-                                codeChecker.send(
-                                    (
-                                        line, lines,
-                                        lineNum - firstLineNum
-                                    )
-                                )
-                ## ------ ##
-                label.end  # # ? goto .end
-                ## ------ ##
-
-                # If we were passed a tail, append it to the docstring.
-                # Note that this means that we need a docstring for this
-                # item to get documented.
-
-                if tail and lineNum == len(self.docLines) - 1:
-                    line = '{0}{1}# {2}'.format(line.rstrip(), linesep, tail)
-
-                # Add comment marker for every line.
-                line = '#{0}'.format(line.rstrip())
-                # Ensure the first line has the Doxygen double comment.
-                if lineNum == 0:
-                    line = '#' + line
-
-                lines.append(line.replace(' ' + linesep, linesep))
-            else:
-                # If we get our sentinel value, send out what we've got.
-                timeToSend = True
+                        match = RE._listRE.match(line)
+                        if match and not inCodeBlock:
+                            # We've got a list of something or another
+                            line = ''.join(
+                                '# {0}\t{1}{2}'.format(prefix, item, linesep)
+                                for item in RE._listItemRE.findall(
+                                    self._stripOutAnds(match.group(0))))[1:]
+                        else:
+                            match = RE._examplesStartRE.match(line)
+                            if match and autocode and \
+                                    lines[-1].strip() == '#':
+                                # We've got an "example" section
+                                inCodeBlock = True
+                                line = line.replace(
+                                    match.group(0),
+                                    ' @b Examples{0}# @code'.format(linesep))
+                            else:
+                                match = RE._sectionStartRE.match(line)
+                                if match:
+                                    # We've got an arbitrary section
+                                    prefix = ''
+                                    inSection = True
+                                    # What's the indentation of the section
+                                    # heading?
+                                    expandedLine = line.expandtabs(tablength)
+                                    sectionHeadingIndent = \
+                                        len(expandedLine) - \
+                                        len(expandedLine.lstrip())
+                                    line = line.replace(
+                                        match.group(0),
+                                        ' @par {0}'.format(match.group(1)))
+                                    if lines[-1] == '# @par':
+                                        lines[-1] = '#'
+                                    lines[-1], inCodeBlock = \
+                                        self._endCodeIfNeeded(lines[-1],
+                                                              inCodeBlock)
+                                    lines.append('#' + line)
+                                    continue
+                                elif prefix:
+                                    match = RE._singleListItemRE.match(line)
+                                    if match and not inCodeBlock:
+                                        # Probably a single list item
+                                        line = ' {0}\t{1}'.format(
+                                            prefix, match.group(0))
+                                    elif autocode and inCodeBlock:
+                                        if proseChecker is None:
+                                            proseChecker = \
+                                                self._checkIfCode(True)
+                                        proseChecker.send(
+                                            (line, lines,
+                                             lineNum - firstLineNum))
+                                    elif autocode:
+                                        if codeChecker is None:
+                                            codeChecker = \
+                                                self._checkIfCode(False)
+                                        codeChecker.send(
+                                            (line, lines,
+                                             lineNum - firstLineNum))
+
+            # If we were passed a tail, append it to the docstring.
+            # Note that this means that we need a docstring for this
+            # item to get documented.
+            if tail and lineNum == lastDocLineNum:
+                line = '{0}{1}# {2}'.format(line.rstrip(), linesep, tail)
+
+            # Add comment marker for every line.
+            line = '#' + line.rstrip()
+            # Ensure the first line has the Doxygen double comment.
+            if lineNum == 0:
+                line = '#' + line
+
+            lines.append(line.replace(' ' + linesep, linesep))
 
             if timeToSend:
-                lines[-1], inCodeBlock = AstWalker._endCodeIfNeeded(lines[-1],
-                                                                    inCodeBlock)
-                writer.send((firstLineNum, lineNum, lines))
+                lines[-1], inCodeBlock = self._endCodeIfNeeded(lines[-1],
+                                                               inCodeBlock)
+                blocks.append((firstLineNum, lineNum, lines))
                 lines = []
                 firstLineNum = -1
                 timeToSend = False
 
-    @coroutine
-    def __writeDocstring(self):
-        """
-        Runs eternally, dumping out docstring line batches as they get fed in.
-
-        Replaces original batches of docstring lines with modified versions
-        fed in via send.
-        """
-        while True:
-            firstLineNum, lastLineNum, lines = (yield)
-            newDocstringLen = lastLineNum - firstLineNum + 1
-            while len(lines) < newDocstringLen:
-                lines.append('')
-            # Substitute the new block of lines for the original block of lines.
-            self.docLines[firstLineNum: lastLineNum + 1] = lines
+        # The docstring has ended, so send out what we've got.
+        if firstLineNum < 0:
+            firstLineNum = lastDocLineNum
+        lines[-1], inCodeBlock = self._endCodeIfNeeded(lines[-1], inCodeBlock)
+        blocks.append((firstLineNum, lastDocLineNum, lines))
+        return blocks
 
     ############################################################## # ↓
     ##  processDocstring
@@ -365,6 +359,7 @@ class AstWalker(AstVisit, ast.NodeVisitor, ):
                 break
             curLineNum += 1
         docstringStart = curLineNum
+        self.docstringLineNum = docstringStart + 1
         # Figure out where our docstring ends.
         # 计算出结尾
         if not RE._docstrOneLineRE.match(line):
@@ -389,11 +384,13 @@ class AstWalker(AstVisit, ast.NodeVisitor, ):
             # Get rid of the docstring delineators.
             self.docLines[0]  = RE._docstrMarkerRE.sub('', self.docLines[0])
             self.docLines[-1] = RE._docstrMarkerRE.sub('', self.docLines[-1])
-            # Handle special strings within the docstring.
-            docstringConverter = self.__alterDocstring(tail, self.__writeDocstring())
-            for lineInfo in enumerate(self.docLines):
-                docstringConverter.send(lineInfo)
-            docstringConverter.send((len(self.docLines) - 1, None))
+            # Handle special strings within the docstring, substituting the
+            # new blocks of lines for the original ones.
+            for firstLineNum, lastLineNum, lines in self.__alterDocstring(
+                    self.docLines, tail):
+                lines.extend([''] * (lastLineNum - firstLineNum + 1 -
+                                     len(lines)))
+                self.docLines[firstLineNum: lastLineNum + 1] = lines
 
         # Add a Doxygen @brief tag to any single-line description.
         if self.options.autobrief:
@@ -548,23 +545,426 @@ class AstWalker(AstVisit, ast.NodeVisitor, ):
         """Return the modified file once processing has been completed."""
         return linesep.join(line.rstrip() for line in self.lines)
 
+    def writeLines(self, outFile, encoding='utf-8', errors='strict'):
+        """
+        Write the modified file, as printed, to a binary file.
+
+        Rather than joining all of the output into one string first, it
+        gets encoded and written in chunks of about OutputChunkSize
+        characters, so no more than a single copy of the file is held.
+        """
+        chunk = []
+        chunkSize = 0
+        written = False
+        for line in self.lines:
+            chunk.append(line.rstrip())
+            chunkSize += len(line)
+            if chunkSize >= OutputChunkSize:
+                outFile.write((linesep.join(chunk) + linesep).encode(
+                    encoding, errors))
+                chunk = []
+                chunkSize = 0
+                written = True
+        if chunk or not written:
+            outFile.write((linesep.join(chunk) + linesep).encode(
+                encoding, errors))
+
+
+def readSourceLines(inFilename):
+    """
+    Reads the lines of the given file for filtering.
+
+    The file is decoded as Python itself would: going by its BOM or coding
+    cookie, and as UTF-8 otherwise.  It gets decoded as it's read, so the
+    raw bytes are never held in full.
+    """
+    from tokenize import open as openSource
+    with openSource(inFilename) as inFile:
+        return inFile.readlines()
+
+
+@contextmanager
+def openSourceBytes(inFilename):
+    """
+    Provides the raw bytes of the given file, as for hashing them.
+
+    Files of at least MmapThreshold bytes get mapped into memory rather
+    than read, so they aren't copied.
+    """
+    with open(inFilename, 'rb') as inFile:
+        if fstat(inFile.fileno()).st_size < MmapThreshold:
+            yield inFile.read()
+            return
+        from mmap import mmap, ACCESS_READ
+        with mmap(inFile.fileno(), 0, access=ACCESS_READ) as source:
+            yield source
+
+
+def splitSourceLines(source):
+    """
+    Splits source given as text or bytes into lines for filtering.
+
+    Bytes are decoded just as reading them from a file would, and line
+    endings get translated either way.
+    """
+    from io import BytesIO, StringIO, TextIOWrapper
+    if isinstance(source, str):
+        return StringIO(source, newline=None).readlines()
+    from tokenize import detect_encoding
+    encoding, _ = detect_encoding(BytesIO(source).readline)
+    return TextIOWrapper(BytesIO(source), encoding=encoding,
+                         newline=None).readlines()
+
+
+def _hasInterfaceMarkers(source):
+    """
+    Checks raw source for anything that might be a zope interface marker.
+
+    The source gets searched in lowered chunks, overlapping by enough to
+    catch keywords straddling two of them.
+    """
+    keywordLength = max(len(keyword) for keyword in RE._markerKeywords)
+    for chunkStart in range(0, len(source), MarkerChunkSize):
+        chunk = source[chunkStart:chunkStart + MarkerChunkSize +
+                       keywordLength].lower()
+        for keyword in RE._markerKeywords:
+            keywordStart = chunk.find(keyword)
+            while keywordStart >= 0:
+                if RE._markerTailRE.match(
+                        source, chunkStart + keywordStart + len(keyword)):
+                    return True
+                keywordStart = chunk.find(keyword, keywordStart + 1)
+    return False
+
+
+def needsWalk(source):
+    """
+    Checks whether walking the source might change anything about it.
+
+    The raw source (bytes, or text) gets scanned for anything the walker
+    acts upon: a string starting the module or following a def or class
+    header (a docstring), zope interface markers, and assignments to
+    private names.  The scan errs on the side of walking, but when it
+    finds nothing, filtering would only strip trailing whitespace.
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8', 'surrogatepass')
+    return any(regexp.search(source) for regexp in RE._walkNeededREs) or \
+        _hasInterfaceMarkers(source)
+
+
+class FilterTimeout(BaseException):
+    """
+    Raised within a walk once the time budget of its file has run out.
+
+    Like KeyboardInterrupt, it isn't an Exception, so the handlers within
+    the walk that take any error as a verdict on a line let it through.
+    """
+
+
+def _expireBudget(signum, frame):
+    """Interrupts whatever the block of timeBudget() is doing."""
+    raise FilterTimeout()
+
+
+def _getAlarm():
+    """
+    Returns the signal module if SIGALRM can keep time budgets here.
+
+    That's only in the main thread, and where setitimer is available;
+    anywhere else None is returned.
+    """
+    import signal
+    from threading import current_thread, main_thread
+    if not hasattr(signal, 'setitimer') or \
+            current_thread() is not main_thread():
+        return None
+    return signal
+
+
+@contextmanager
+def timeBudget(seconds):
+    """
+    Raises FilterTimeout within the block once the given seconds are up.
+
+    The budget is kept with SIGALRM, so it only applies in the main thread
+    of a process and where setitimer is available; anywhere else, or given
+    no seconds, the block simply runs to its end.  Any timer already set
+    gets what time it had left back afterwards (firing right away if that
+    ran out within the block), though it can't fire within it.
+    """
+    signal = _getAlarm() if seconds else None
+    if signal is None:
+        yield
+        return
+    from time import monotonic
+    previousHandler = signal.signal(signal.SIGALRM, _expireBudget)
+    previousDelay, previousInterval = signal.setitimer(signal.ITIMER_REAL,
+                                                       seconds)
+    startTime = monotonic()
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL
+                      if previousHandler is None else previousHandler)
+        if previousDelay:
+            signal.setitimer(signal.ITIMER_REAL, max(
+                previousDelay - (monotonic() - startTime), MinTimerDelay),
+                previousInterval)
+
+
+@contextmanager
+def budgetPaused():
+    """
+    Stops the clock of the time budget the block runs within, if any.
+
+    Walks use this around cache lookups and writes, so that those neither
+    count against the budget nor get interrupted halfway by running out
+    of it.
+    """
+    signal = _getAlarm()
+    if signal is None or signal.getsignal(signal.SIGALRM) is not _expireBudget:
+        yield
+        return
+    remaining, interval = signal.setitimer(signal.ITIMER_REAL, 0)
+    try:
+        yield
+    finally:
+        if remaining:
+            signal.setitimer(signal.ITIMER_REAL, remaining, interval)
+
+
+def parseWithinBudget(astWalker):
+    """
+    Parses the lines of a walker within the time budget of its options.
+
+    Should options.maxSecondsPerFile pass first, the walker is left holding
+    the original lines and marked as not complete, a warning naming the
+    file and the docstring that was being processed goes to stderr, and
+    False is returned.
+    """
+    maxSeconds = astWalker.options.maxSecondsPerFile
+    original = list(astWalker.lines) if maxSeconds else None
+    try:
+        with timeBudget(maxSeconds):
+            astWalker.parseLines()
+    except FilterTimeout:
+        astWalker.lines[:] = original
+        astWalker.complete = False
+        where = 'parsing it'
+        if astWalker.docstringLineNum is not None:
+            where = 'the docstring on line {0}'.format(
+                astWalker.docstringLineNum)
+        stderr.write("doxypypy3: {0}: gave up on {1} after {2:g} seconds; "
+                     "passing the file through unfiltered{3}".format(
+                         astWalker.inFilename, where, maxSeconds, linesep))
+        return False
+    return True
+
+
+## Modules that filtering only imports once it needs them.
+DeferredImports = ('codecs', 'codeop', 'io', 'mmap', 'signal', 'threading',
+                   'tokenize', '.cache', '.cmd_options', '.pack', '.segments')
+
+
+def warmUp():
+    """
+    Does up front whatever filtering would otherwise put off until needed.
+
+    Compiles every regular expression and imports every module the filter
+    imports lazily.  A single run only pays for what it uses, but servers
+    call this before taking requests, so that neither they nor the
+    children they fork pay for any of it again.
+    """
+    from importlib import import_module
+    compileAll()
+    for name in DeferredImports:
+        import_module(name, __package__)
+
+
+def checkSource(source, inFilename, options):
+    """
+    Works out how the raw source (bytes, or text) of a file gets filtered.
+
+    Generated modules (see generated.py) are passed through, possibly
+    beneath a stub, as the options say.  Anything else is walked unless
+    needsWalk() rules it out.
+    """
+    if isGenerated(source, inFilename, options):
+        return options.generated
+    return Walk if needsWalk(source) else PassThrough
+
+
+def walkLines(lines, inFilename, options, treatment=Walk):
+    """
+    Filters the given lines of source and returns the walker holding them.
+
+    The lines are those of inFilename, which is only used for messages; the
+    options must include the fullPathNamespace of the file.  Unless walked,
+    the lines are left as they are, less their trailing whitespace, and
+    so they are if walking them takes longer than the time budget, in
+    which case the walker isn't marked complete.
+    """
+    if treatment == Stub:
+        lines = getStubLines() + lines
+    astWalker = AstWalker(lines, options, inFilename)
+    if treatment == Walk:
+        # Create the abstract syntax tree for the input file.
+        parseWithinBudget(astWalker)
+    return astWalker
+
+
+def walkSource(source, inFilename, options):
+    """
+    Filters the given source, text or bytes, and returns the walker.
+
+    Source that checkSource() finds needs no walk never gets parsed.
+    """
+    return walkLines(splitSourceLines(source), inFilename, options,
+                     checkSource(source, inFilename, options))
+
+
+def walkFile(inFilename, options, treatment=None):
+    """
+    Filters the given file and returns the walker holding its lines.
+
+    Files that checkSource() finds need no walk never get parsed; if the
+    treatment is known already, the file isn't checked again.  The options
+    must include the fullPathNamespace of the file.
+    """
+    if treatment is None:
+        with openSourceBytes(inFilename) as source:
+            treatment = checkSource(source, inFilename, options)
+    # Read contents of input file.
+    return walkLines(readSourceLines(inFilename), inFilename, options,
+                     treatment)
+
+
+def filterFile(inFilename, options):
+    """
+    Filters the given file and returns the modified source.
+
+    The options must include the fullPathNamespace of the file.
+    """
+    return walkFile(inFilename, options).getLines()
+
+
+def writeEncodedOutput(output):
+    """
+    Writes UTF-8 encoded filter output to stdout.
+
+    The bytes go out untouched unless stdout uses some other encoding, in
+    which case they get printed just like freshly filtered output would.
+    """
+    from sys import stdout
+    from codecs import lookup
+    if lookup(stdout.encoding).name == 'utf-8':
+        stdout.flush()
+        stdout.buffer.write(output)
+        stdout.buffer.flush()
+    else:
+        stdout.write(output.decode('utf-8'))
+
+
+def writeStreamedOutput(astWalker):
+    """
+    Writes the output of a walker to stdout as it gets encoded.
+
+    The bytes go straight to the binary layer of stdout, encoded just like
+    printing them would, so Doxygen starts receiving them early on.
+    """
+    from sys import stdout
+    stdout.flush()
+    astWalker.writeLines(stdout.buffer, stdout.encoding,
+                         stdout.errors or 'strict')
+    stdout.buffer.flush()
+
+
+def _escapeDependency(path):
+    """Escapes a path for use in a Makefile-style depfile."""
+    return path.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+
+def writeOutputFile(outputPath, output, inFilename, depfilePath=None):
+    """
+    Writes filter output to a file, and optionally a depfile.
+
+    The output is either UTF-8 encoded already or a walker whose lines get
+    streamed to the file.  The depfile names the input and every module of
+    doxypypy3 in use as the output's dependencies, so build tools refilter
+    after an upgrade too.
+    """
+    from os import makedirs
+    from os.path import abspath, dirname
+    from sys import modules
+    from .cache import openAtomically, writeAtomically
+    makedirs(dirname(abspath(outputPath)), exist_ok=True)
+    if isinstance(output, bytes):
+        writeAtomically(outputPath, output)
+    else:
+        with openAtomically(outputPath, OutputChunkSize) as outFile:
+            output.writeLines(outFile)
+    if depfilePath:
+        package = __package__.partition('.')[0]
+        dependencies = [inFilename] + sorted(
+            module.__file__ for name, module in list(modules.items())
+            if name.partition('.')[0] == package and
+            getattr(module, '__file__', None))
+        depfile = '{0}:{1}{2}'.format(
+            _escapeDependency(outputPath),
+            ''.join(' \\{0}  {1}'.format(linesep,
+                                          _escapeDependency(dependency))
+                    for dependency in dependencies), linesep)
+        makedirs(dirname(abspath(depfilePath)), exist_ok=True)
+        writeAtomically(depfilePath, depfile.encode('utf-8'))
+
+
+## Subcommands that get handed the rest of the command line.
+Subcommands = {
+    'batch': 'batch',
+    'doxyfile': 'doxyfile',
+    'cache': 'cache',
+    'rules': 'rules',
+    'watch': 'watch',
+    'merge': 'shard',
+}
+
 
 def main():
     """
     Starts the parser on the file given by the filename as the first
     argument on the command line.
+
+    If the first argument names a subcommand instead, that subcommand gets
+    run with the remaining arguments.
     """
+    from sys import argv
+    if len(argv) > 1 and argv[1] in Subcommands:
+        from importlib import import_module
+        module = import_module('.' + Subcommands[argv[1]], __package__)
+        return module.main(argv[2:])
+
     # Figure out what is being requested.
     from .cmd_options import optParse
     (options, inFilename) = optParse()
     ## ------------------------------
 
-    # Read contents of input file.
-    inFile = open(inFilename, encoding="utf8", mode="rU")
-    lines = inFile.readlines()
-    inFile.close()
-    # Create the abstract syntax tree for the input file.
-    astWalker = AstWalker(lines, options, inFilename)
-    astWalker.parseLines()
-    # Output the modified source.
-    print(astWalker.getLines())
+    if options.serveStdio:
+        from .stdio_server import serveStdio
+        return serveStdio(options)
+
+    if options.cacheDir:
+        from .cache import getCache, filterFileCached
+        output = filterFileCached(inFilename, options, getCache(options))
+    else:
+        output = walkFile(inFilename, options)
+
+    if options.outputPath:
+        writeOutputFile(options.outputPath, output, inFilename,
+                        options.depfilePath)
+    elif options.cacheDir:
+        writeEncodedOutput(output)
+    else:
+        # Output the modified source.
+        writeStreamedOutput(output)
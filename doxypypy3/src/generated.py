@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Recognizes generated modules so they can skip filtering.
+
+Protocol buffer modules, SWIG wrappers, migrations and their like tend to
+be the largest files of a tree, yet there's nothing in them worth marking
+up for Doxygen.  A file counts as generated if its name matches one of a
+set of glob patterns, or if the comments heading it carry one of a set of
+signatures (compared regardless of case) that generators leave there.
+Only comments count, so a hand-written module merely mentioning such a
+signature, in a string say, isn't mistaken for a generated one.  Generated files are passed through as they are or, if
+asked for, beneath a @file stub saying what they are, without ever being
+parsed.
+
+Patterns and signatures given on the command line add to the defaults;
+--generated=filter filters generated files like any other.
+"""
+from fnmatch import fnmatch
+from os.path import basename
+
+from .compile import linesep
+
+## File name patterns of generated modules.
+DefaultPatterns = ('*_pb2.py', '*_pb2_grpc.py')
+## Header text of generated modules, specific enough not to turn up in
+# hand-written ones.
+DefaultSignatures = (
+    'generated by the protocol buffer compiler',
+    'generated by the grpc python protocol compiler',
+    'automatically generated by swig',
+    'autogenerated by thrift compiler',
+    'generated from reading ui file',
+    '# generated by django',
+)
+## How much of the start of a file is searched for signatures.
+HeaderSize = 4096
+
+
+def getHeaderComments(source):
+    """
+    Returns the comments heading raw source (bytes, or text), lowered.
+
+    These are the lines up to the first one that is neither blank nor a
+    comment, within the first HeaderSize bytes, as bytes.
+    """
+    header = source[:HeaderSize]
+    if isinstance(header, str):
+        header = header.encode('utf-8', 'surrogatepass')
+    header = bytes(header).lower()
+    if header.startswith(b'\xef\xbb\xbf'):
+        header = header[3:]
+    comments = []
+    for line in header.splitlines():
+        line = line.strip()
+        if line and not line.startswith(b'#'):
+            break
+        comments.append(line)
+    return b'\n'.join(comments)
+
+
+def isGenerated(source, inFilename, options):
+    """
+    Checks whether raw source (bytes, or text) is of a generated module.
+
+    Always False if the options ask for generated modules to be filtered.
+    """
+    if options.generated == 'filter':
+        return False
+    fileName = basename(inFilename)
+    if any(fnmatch(fileName, pattern) for pattern in
+           DefaultPatterns + tuple(options.generatedPatterns or ())):
+        return True
+    comments = getHeaderComments(source)
+    return any(signature.lower().encode('utf-8') in comments for signature in
+               DefaultSignatures + tuple(options.generatedSignatures or ()))
+
+
+def getStubLines():
+    """Returns the lines of the @file stub put above generated modules."""
+    return ['## @file' + linesep,
+            '# @brief Generated code, not filtered by doxypypy3.' + linesep]
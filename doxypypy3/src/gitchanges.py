@@ -0,0 +1,76 @@
+# coding=utf-8
+"""
+Asks git which files changed, so a mirror can be brought up to date cheaply.
+
+Rather than walking and stat()ing a whole tree, the batch subcommand can
+get the list of changed files straight from the local git repository:
+either the changes between two revisions or those between a revision and
+the working tree (including untracked files).  Renames are reported as
+such, so their mirrored output can simply be moved.
+"""
+from subprocess import run, PIPE
+
+
+class GitError(Exception):
+    """Raised when git can't tell us what changed."""
+
+
+## A file that was added, modified, or otherwise needs filtering anew.
+Changed = 'changed'
+## A file that was removed.
+Deleted = 'deleted'
+## A file that was renamed without any change to its contents.
+Renamed = 'renamed'
+
+
+def _runGit(srcDir, args):
+    """Runs a git command within srcDir and returns its output."""
+    try:
+        completed = run(['git', '-C', srcDir] + args, stdout=PIPE, stderr=PIPE)
+    except OSError as error:
+        raise GitError("can't run git: {0}".format(error))
+    if completed.returncode:
+        raise GitError(completed.stderr.decode('utf-8', 'replace').strip() or
+                       "git {0} failed".format(args[0]))
+    return completed.stdout.decode('utf-8', 'surrogateescape')
+
+
+def getChanges(srcDir, since, until=None):
+    """
+    Returns the files beneath srcDir that changed between two revisions.
+
+    Without until, the changes between since and the working tree are
+    returned, untracked files included.  Changes come as (kind, path,
+    oldPath) tuples with paths relative to srcDir; oldPath is only set for
+    renames.
+    """
+    args = ['diff', '--name-status', '-z', '--find-renames', '--relative',
+            since]
+    if until is not None:
+        args.append(until)
+    fields = _runGit(srcDir, args + ['--']).split('\0')
+    changes = []
+    fieldNum = 0
+    while fieldNum < len(fields) - 1:
+        status = fields[fieldNum]
+        if status[:1] in 'RC':
+            oldPath, path = fields[fieldNum + 1:fieldNum + 3]
+            fieldNum += 3
+            if status[:1] == 'C':
+                changes.append((Changed, path, None))
+            elif status == 'R100':
+                changes.append((Renamed, path, oldPath))
+            else:
+                # Renamed and edited; the old name is gone either way.
+                changes.append((Deleted, oldPath, None))
+                changes.append((Changed, path, None))
+        else:
+            path = fields[fieldNum + 1]
+            fieldNum += 2
+            changes.append((Deleted if status == 'D' else Changed, path, None))
+    if until is None:
+        untracked = _runGit(srcDir, ['ls-files', '-z', '--others',
+                                     '--exclude-standard', '--', '.'])
+        changes.extend((Changed, path, None)
+                       for path in untracked.split('\0') if path)
+    return changes
@@ -0,0 +1,331 @@
+# coding=utf-8
+"""
+Single-file pack backend for the output cache.
+
+A directory holding thousands of tiny entry files is slow on overlay and
+network filesystems, where every open and stat is expensive.  This backend
+instead appends compressed entries to a single pack file and keeps a
+fixed-width index of entry keys next to it.  Both get mapped into memory,
+so a lookup is a binary search over the index followed by a single read
+out of the pack, typically costing no more than a page fault or two.
+
+The index starts with a header naming the pack it belongs to and the
+number of entries in its sorted section.  Entries written since the index
+was last sorted are simply appended to it and searched linearly, newest
+first, until there are enough of them to be worth merging into the sorted
+section.  Entries that have been replaced stay in the pack as dead weight
+until the pack is compacted, which rewrites it with only the live entries
+under the next generation's name and then switches the index over to it.
+
+Entries aren't touched when read, so the least recently *written* entries
+are the ones dropped when the pack has to shrink.  Lookups aren't counted
+either, as that would cost more than the lookup itself.
+"""
+from mmap import mmap, ACCESS_READ
+from os import SEEK_END, stat, unlink
+from os.path import join
+from struct import Struct
+from time import time
+from zlib import compress, decompress, error as ZlibError
+
+from .. import __version__
+from .cache import (LowWaterMark, OutputCache, makeEntry, parseEntry,
+                    writeAtomically)
+
+IndexFile = 'pack.idx'
+PackPrefix = 'pack-'
+IndexMagic = b'DXPYIDX1'
+PackMagic = b'DXPYPCK1'
+## Index header: magic, pack generation, and number of sorted entries.
+IndexHeader = Struct('>8sQQ')
+## Index entry: key digest, record offset and size, and when it was written.
+IndexEntry = Struct('>32sQII')
+## Pack record header preceding the compressed entry: key digest and size.
+RecordHeader = Struct('>32sI')
+## How many unsorted index entries may pile up before they get sorted in.
+MaxUnsorted = 256
+
+
+class PackSnapshot:
+    """
+    The index and pack of a cache mapped into memory as they were when
+    opened.
+
+    Entries appended to the index later aren't seen until it's reopened.
+    """
+
+    def __init__(self, indexPath, packDir):
+        """Maps the index and the pack it refers to."""
+        self.indexMap = self.packMap = None
+        with open(indexPath, 'rb') as indexFile:
+            self.identity = _getIdentity(stat(indexPath))
+            self.indexMap = mmap(indexFile.fileno(), 0, access=ACCESS_READ)
+        if len(self.indexMap) < IndexHeader.size:
+            raise ValueError("truncated doxypypy3 pack index")
+        magic, self.generation, self.sortedCount = \
+            IndexHeader.unpack_from(self.indexMap)
+        if magic != IndexMagic:
+            raise ValueError("not a doxypypy3 pack index")
+        self.entryCount = (len(self.indexMap) - IndexHeader.size) // \
+            IndexEntry.size
+        with open(join(packDir, getPackName(self.generation)), 'rb') as packFile:
+            self.packMap = mmap(packFile.fileno(), 0, access=ACCESS_READ)
+
+    def close(self):
+        """Unmaps the index and the pack."""
+        for mapped in (self.indexMap, self.packMap):
+            if mapped is not None:
+                mapped.close()
+
+    def getEntry(self, entryNum):
+        """Returns the digest, offset, size, and write time of an entry."""
+        return IndexEntry.unpack_from(
+            self.indexMap, IndexHeader.size + entryNum * IndexEntry.size)
+
+    def _getDigest(self, entryNum):
+        """Returns the key digest of an entry without unpacking the rest."""
+        start = IndexHeader.size + entryNum * IndexEntry.size
+        return self.indexMap[start:start + 32]
+
+    def find(self, digest):
+        """Returns the index entry for a key digest, or None if it has none."""
+        for entryNum in range(self.entryCount - 1, self.sortedCount - 1, -1):
+            if self._getDigest(entryNum) == digest:
+                return self.getEntry(entryNum)
+        low, high = 0, self.sortedCount
+        while low < high:
+            middle = (low + high) // 2
+            if self._getDigest(middle) < digest:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.sortedCount and self._getDigest(low) == digest:
+            return self.getEntry(low)
+        return None
+
+    def readRecord(self, digest, offset, size):
+        """
+        Returns the compressed entry stored at an offset of the pack.
+
+        Returns None if the record lies beyond what's mapped or doesn't
+        belong to the key.
+        """
+        end = offset + RecordHeader.size + size
+        if end > len(self.packMap):
+            return None
+        if RecordHeader.unpack_from(self.packMap, offset) != (digest, size):
+            return None
+        return self.packMap[offset + RecordHeader.size:end]
+
+    def iterLive(self):
+        """Yields the index entries of all live entries, oldest first."""
+        latest = {}
+        for entryNum in range(self.entryCount):
+            entry = self.getEntry(entryNum)
+            latest[entry[0]] = entry
+        return iter(sorted(latest.values(), key=lambda entry: entry[1]))
+
+
+def getPackName(generation):
+    """Returns the file name of a generation of the pack."""
+    return '{0}{1}'.format(PackPrefix, generation)
+
+
+def _getIdentity(fileStat):
+    """Tells apart different versions of a file that's only appended to."""
+    return fileStat.st_ino, fileStat.st_size
+
+
+class PackCache(OutputCache):
+    """
+    An output cache stored in a single pack file with a sorted index.
+    """
+
+    def __init__(self, cacheDir, maxSize=None):
+        """Sets up a pack cache rooted at the given directory."""
+        OutputCache.__init__(self, cacheDir, maxSize)
+        self.indexPath = join(cacheDir, IndexFile)
+        self._snapshot = None
+
+    def _getSnapshot(self):
+        """
+        Returns the current snapshot of the cache, or None if it's empty.
+
+        The snapshot is reopened whenever the index has changed.
+        """
+        try:
+            identity = _getIdentity(stat(self.indexPath))
+        except FileNotFoundError:
+            identity = None
+        if self._snapshot is not None and self._snapshot.identity == identity:
+            return self._snapshot
+        self.close()
+        if identity is not None:
+            try:
+                self._snapshot = PackSnapshot(self.indexPath, self.cacheDir)
+            except (OSError, ValueError):
+                # Compacted in the meantime or damaged; a miss either way.
+                pass
+        return self._snapshot
+
+    def close(self):
+        """Unmaps the cache."""
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+    def get(self, key):
+        """Returns the cached output for a key or None on a miss."""
+        return self.peek(key)
+
+    def peek(self, key):
+        """Looks up an entry."""
+        snapshot = self._getSnapshot()
+        if snapshot is None:
+            return None
+        digest = bytes.fromhex(key)
+        found = snapshot.find(digest)
+        if found is None:
+            return None
+        record = snapshot.readRecord(digest, found[1], found[2])
+        if record is None:
+            # Written after we mapped the pack.
+            self.close()
+            snapshot = self._getSnapshot()
+            if snapshot is None:
+                return None
+            record = snapshot.readRecord(digest, found[1], found[2])
+        try:
+            parsed = parseEntry(decompress(record)) if record else None
+        except ZlibError:
+            return None
+        return parsed[2] if parsed is not None else None
+
+    def put(self, key, output, fingerprint, version=__version__):
+        """Appends the output for a key, compacting the pack if need be."""
+        record = compress(makeEntry(output, fingerprint, version))
+        self.putRecord(bytes.fromhex(key), record, int(time()))
+
+    def putRecord(self, digest, record, written):
+        """Appends an already compressed entry to the pack."""
+        with self._locked():
+            snapshot = self._getSnapshot()
+            if snapshot is None:
+                self._writePack(0, [])
+                snapshot = self._getSnapshot()
+            packPath = join(self.cacheDir, getPackName(snapshot.generation))
+            with open(packPath, 'ab') as packFile:
+                offset = packFile.seek(0, SEEK_END)
+                packFile.write(RecordHeader.pack(digest, len(record)) + record)
+                packSize = offset + RecordHeader.size + len(record)
+            # The record has to be in the pack before the index refers to it.
+            with open(self.indexPath, 'ab') as indexFile:
+                indexFile.write(IndexEntry.pack(digest, offset, len(record),
+                                                written))
+            snapshot = self._getSnapshot()
+            if self.maxSize is not None and packSize > self.maxSize:
+                self._prune(maxSize=int(self.maxSize * LowWaterMark))
+            elif snapshot.entryCount - snapshot.sortedCount > MaxUnsorted:
+                self._sortIndex(snapshot)
+
+    def _sortIndex(self, snapshot):
+        """Merges the unsorted entries into the sorted section of the index."""
+        latest = {}
+        for entryNum in range(snapshot.entryCount):
+            entry = snapshot.getEntry(entryNum)
+            latest[entry[0]] = entry
+        self._writeIndex(snapshot.generation,
+                         [latest[digest] for digest in sorted(latest)])
+
+    def _writeIndex(self, generation, entries):
+        """Replaces the index with the given sorted entries."""
+        writeAtomically(self.indexPath, b''.join(
+            [IndexHeader.pack(IndexMagic, generation, len(entries))] +
+            [IndexEntry.pack(*entry) for entry in entries]))
+
+    def _writePack(self, generation, records):
+        """
+        Writes a new generation of the pack along with its index.
+
+        Takes (digest, record, write time) tuples.
+        """
+        chunks = [PackMagic]
+        offset = len(PackMagic)
+        entries = []
+        for digest, record, written in records:
+            chunks.append(RecordHeader.pack(digest, len(record)) + record)
+            entries.append((digest, offset, len(record), written))
+            offset += len(chunks[-1])
+        writeAtomically(join(self.cacheDir, getPackName(generation)),
+                        b''.join(chunks))
+        self._writeIndex(generation, sorted(entries))
+
+    def iterRecords(self):
+        """Yields the digest, compressed entry, and write time of every entry."""
+        snapshot = self._getSnapshot()
+        if snapshot is None:
+            return
+        for digest, offset, size, written in snapshot.iterLive():
+            record = snapshot.readRecord(digest, offset, size)
+            if record is not None:
+                yield digest, record, written
+
+    def iterItems(self):
+        """Yields the key and the stored entry of every entry."""
+        for digest, record, _ in self.iterRecords():
+            try:
+                yield digest.hex(), decompress(record)
+            except ZlibError:
+                continue
+
+    def compact(self):
+        """
+        Rewrites the pack without any dead entries.
+
+        Returns the number of entries and bytes removed.
+        """
+        return self.prune()
+
+    def _prune(self, maxAge=None, maxSize=None):
+        """
+        Rewrites the pack keeping only live entries written within maxAge
+        seconds, dropping the least recently written ones until at most
+        maxSize bytes remain.  The cache must already be locked.
+        """
+        snapshot = self._getSnapshot()
+        if snapshot is None:
+            return 0, 0
+        oldSize = len(snapshot.packMap)
+        records = list(self.iterRecords())
+        oldest = time() - maxAge if maxAge is not None else None
+        totalSize = len(PackMagic) + sum(
+            RecordHeader.size + len(record) for _, record, _ in records)
+        records.sort(key=lambda record: record[2])
+        while records and ((oldest is not None and records[0][2] < oldest) or
+                           (maxSize is not None and totalSize > maxSize)):
+            totalSize -= RecordHeader.size + len(records.pop(0)[1])
+        removedCount = snapshot.entryCount - len(records)
+        generation = snapshot.generation
+        self._writePack(generation + 1, records)
+        self.close()
+        try:
+            unlink(join(self.cacheDir, getPackName(generation)))
+        except FileNotFoundError:
+            pass
+
+        state = self._readState()
+        state['lastPrune'] = time()
+        self._writeState(state)
+        return removedCount, oldSize - totalSize
+
+    def getStats(self):
+        """Returns the entries, bytes, and last prune time."""
+        snapshot = self._getSnapshot()
+        entryCount = len(list(snapshot.iterLive())) if snapshot else 0
+        return {
+            'entries': entryCount,
+            'bytes': len(snapshot.packMap) if snapshot else 0,
+            'hits': None,
+            'misses': None,
+            'lastPrune': self._readState()['lastPrune'],
+        }
@@ -0,0 +1,132 @@
+# coding=utf-8
+"""
+Writes build rules that filter a source tree into a mirror.
+
+Rather than filtering a tree itself, the rules subcommand writes a Ninja
+file or a Makefile fragment with one edge per source file, from the source
+to its filtered counterpart in the mirror, with the filter options baked
+into the command.  An existing build system can then take care of
+filtering incrementally and in parallel, and the Doxygen step need only
+depend on the filtered outputs (collected under the doxypypy3-filtered
+target).
+
+Every edge hands the filter the absolute path of its source, so each file
+ends up with the very same namespace as it gets from Doxygen or the batch
+subcommand.  The filter also writes a depfile naming its own modules, so
+upgrading doxypypy3 refilters everything.
+"""
+from os.path import abspath, join, relpath
+from shlex import quote
+from sys import executable
+
+from .batch import findSourceFiles
+from .cmd_options import getFilterArgs, getFullPathNamespace, rulesOptParse
+from .compile import linesep
+
+## Phony target depending on every filtered file.
+AllTarget = 'doxypypy3-filtered'
+
+
+def getEdges(srcDir, outDir, options):
+    """
+    Returns the (source, output, namespace) of every file to be filtered.
+
+    Sources are absolute, just as Doxygen would hand them to the filter.
+    """
+    return [
+        (abspath(inFilename), join(outDir, relpath(inFilename, srcDir)),
+         getFullPathNamespace(abspath(inFilename), options.topLevelNamespace))
+        for inFilename in findSourceFiles(srcDir, options.patterns, [outDir])
+    ]
+
+
+def getFilterCommand(options):
+    """Returns the shell command running the filter with the options."""
+    return ' '.join(quote(arg) for arg in
+                    [executable, '-m', 'doxypypy3.main'] +
+                    getFilterArgs(options))
+
+
+def _escapeNinja(path):
+    """Escapes a path for use in a Ninja build statement."""
+    return path.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+
+def formatNinja(edges, options):
+    """Returns a Ninja file filtering the given edges."""
+    lines = [
+        '# Filters Python sources for Doxygen; written by doxypypy3 rules.',
+        'doxypypy3 = {0}'.format(getFilterCommand(options).replace('$', '$$')),
+        '',
+        'rule doxypypy3',
+        '  command = $doxypypy3 --output $out --depfile $out.d $in',
+        '  description = DOXYPYPY3 $in',
+        '  depfile = $out.d',
+        '  deps = gcc',
+        '',
+    ]
+    for inFilename, outFilename, namespace in edges:
+        lines.append('# {0}'.format(namespace))
+        lines.append('build {0}: doxypypy3 {1}'.format(
+            _escapeNinja(outFilename), _escapeNinja(inFilename)))
+    lines.append('')
+    lines.append('build {0}: phony {1}'.format(AllTarget, ' '.join(
+        _escapeNinja(outFilename) for _, outFilename, _ in edges)))
+    return linesep.join(lines) + linesep
+
+
+def _escapeMake(path):
+    """Escapes a path for use in a Makefile rule."""
+    return path.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+
+def _quoteMake(path):
+    """Quotes a path for use in a Makefile recipe."""
+    return quote(path).replace('$', '$$')
+
+
+def formatMake(edges, options):
+    """
+    Returns a Makefile fragment filtering the given edges.
+
+    make hands the automatic variables to the shell as they are, so the
+    recipes name their paths themselves, quoted for the shell, and every
+    depfile gets included on its own, as make would split a list of them
+    at any spaces.
+    """
+    lines = [
+        '# Filters Python sources for Doxygen; written by doxypypy3 rules.',
+        'DOXYPYPY3 = {0}'.format(getFilterCommand(options).replace('$', '$$')),
+        'DOXYPYPY3_OUTPUTS = \\',
+    ]
+    lines.extend('  {0} \\'.format(_escapeMake(outFilename))
+                 for _, outFilename, _ in edges)
+    lines.extend([
+        '',
+        '.PHONY: {0}'.format(AllTarget),
+        '{0}: $(DOXYPYPY3_OUTPUTS)'.format(AllTarget),
+        '',
+    ])
+    for inFilename, outFilename, namespace in edges:
+        lines.extend([
+            '# {0}'.format(namespace),
+            '{0}: {1}'.format(_escapeMake(outFilename), _escapeMake(inFilename)),
+            '\t$(DOXYPYPY3) --output {0} --depfile {1} {2}'.format(
+                _quoteMake(outFilename), _quoteMake(outFilename + '.d'),
+                _quoteMake(inFilename)),
+            '-include {0}.d'.format(_escapeMake(outFilename)),
+        ])
+    return linesep.join(lines) + linesep
+
+
+def main(args):
+    """Runs the rules subcommand on the given command line arguments."""
+    (options, srcDir, outDir) = rulesOptParse(args)
+    edges = getEdges(srcDir, outDir, options)
+    formatter = formatNinja if options.rulesFormat == 'ninja' else formatMake
+    rules = formatter(edges, options)
+    if options.rulesPath:
+        with open(options.rulesPath, 'w', encoding='utf8') as rulesFile:
+            rulesFile.write(rules)
+    else:
+        print(rules, end='')
@@ -0,0 +1,171 @@
+# coding=utf-8
+"""
+Re-filters only the top-level definitions of a file that have changed.
+
+Editing a single method of a huge module changes the file as a whole, so
+the output cache misses and every docstring in the file would get processed
+all over again.  Yet the filter handles each top-level class and function
+on its own: it only ever rewrites the lines belonging to that definition,
+and the result depends on nothing but those lines and where the definition
+lives.  So the transformed lines of every top-level definition are cached
+as well, under a key derived from its source text and its containing-node
+path, and on a miss only the definitions whose keys are new get walked.
+The cached lines of all the others are spliced straight back in, which
+gives exactly what a full run would have produced.
+
+A segment runs from the first line of a definition (its first decorator,
+if it has any) up to the first line of the next top-level statement.  The
+one way a class can peek beyond its own lines is when looking for the
+indentation of its body, so the lines following a segment up to the first
+indented one are part of its key too.  A definition whose walk rewrites
+lines beyond its own (as one with a docstring in single quotes may, going
+by the triple quotes of whatever follows) can't be cached that way, so
+should any turn up, the file gets walked in full instead.
+"""
+from ast import AsyncFunctionDef, ClassDef, FunctionDef, Module
+from json import dumps, loads
+
+from .cache import getCacheKey, getOptionsFingerprint
+from .compile import RE
+from .doxypypy import (AstWalker, budgetPaused, parseWithinBudget,
+                       readSourceLines)
+
+## Top-level statements that get cached as segments of their own.
+SegmentTypes = (ClassDef, FunctionDef, AsyncFunctionDef)
+
+
+def getFirstLineNum(node):
+    """Returns the index of the first line of a statement, decorators included."""
+    return min([node.lineno] + [decorator.lineno for decorator in
+                                getattr(node, 'decorator_list', [])]) - 1
+
+
+class TrackedLines(list):
+    """
+    A list of lines keeping track of the span of lines assigned to.
+
+    The span runs from firstLineNum up to, but not including, endLineNum,
+    and is empty until something gets assigned.
+    """
+
+    def __init__(self, lines):
+        """Sets up the lines with nothing assigned to yet."""
+        list.__init__(self, lines)
+        self.resetSpan()
+
+    def resetSpan(self):
+        """Forgets about whatever was assigned to so far."""
+        self.firstLineNum = len(self)
+        self.endLineNum = 0
+
+    def __setitem__(self, index, value):
+        """Assigns to the lines, widening the span to take them in."""
+        if isinstance(index, slice):
+            firstLineNum, endLineNum, _ = index.indices(len(self))
+        else:
+            firstLineNum = index % len(self)
+            endLineNum = firstLineNum + 1
+        list.__setitem__(self, index, value)
+        self.firstLineNum = min(self.firstLineNum, firstLineNum)
+        self.endLineNum = max(self.endLineNum, endLineNum)
+
+
+class SegmentWalker(AstWalker):
+    """
+    A walker that looks up each top-level definition in the cache before
+    walking it.
+    """
+
+    def __init__(self, lines, options, inFilename, cache):
+        """Sets up a walk of the lines using the cache for segments."""
+        AstWalker.__init__(self, TrackedLines(lines), options, inFilename)
+        self.cache = cache
+        self.fingerprint = getOptionsFingerprint(options)
+        ## How many segments were found in the cache and how many walked.
+        self.segmentHits = self.segmentMisses = 0
+        ## Whether some segment rewrote lines beyond its own, ending the walk.
+        self.leaked = False
+
+    def generic_visit(self, node, **kwargs):
+        """Visits the statements of a module segment by segment."""
+        if not isinstance(node, Module):
+            return AstWalker.generic_visit(self, node, **kwargs)
+        startLineNums = [getFirstLineNum(statement) for statement in node.body]
+        endLineNums = startLineNums[1:] + [len(self.lines)]
+        for statement, startLineNum, endLineNum in zip(node.body, startLineNums,
+                                                       endLineNums):
+            if self.leaked:
+                break
+            if isinstance(statement, SegmentTypes):
+                self._visitSegment(statement, startLineNum, endLineNum,
+                                   kwargs['containingNodes'])
+            else:
+                self.visit(statement, containingNodes=kwargs['containingNodes'])
+
+    def _getSegmentKey(self, startLineNum, endLineNum, containingNodes):
+        """Returns the cache key of the segment spanning the given lines."""
+        contextLineNum = endLineNum
+        while contextLineNum < len(self.lines):
+            match = RE._indentRE.match(self.lines[contextLineNum])
+            contextLineNum += 1
+            if match and match.group(1):
+                break
+        keySource = '\0'.join([
+            'segment',
+            repr(self._getFullPathName(containingNodes)),
+            ''.join(self.lines[startLineNum:endLineNum]),
+            ''.join(self.lines[endLineNum:contextLineNum]),
+        ])
+        return getCacheKey(keySource.encode('utf-8'), self.fingerprint)
+
+    def _visitSegment(self, node, startLineNum, endLineNum, containingNodes):
+        """Splices in the cached segment, walking it only if it's not cached."""
+        key = self._getSegmentKey(startLineNum, endLineNum, containingNodes)
+        with budgetPaused():
+            cached = self.cache.peek(key)
+        if cached is not None:
+            segmentLines = loads(cached.decode('utf-8'))
+            if len(segmentLines) == endLineNum - startLineNum:
+                self.lines[startLineNum:endLineNum] = segmentLines
+                self.segmentHits += 1
+                return
+        self.lines.resetSpan()
+        self.visit(node, containingNodes=containingNodes)
+        self.segmentMisses += 1
+        if self.lines.firstLineNum < startLineNum or \
+                self.lines.endLineNum > endLineNum:
+            self.leaked = True
+            return
+        with budgetPaused():
+            self.cache.put(key, dumps(self.lines[startLineNum:endLineNum])
+                           .encode('utf-8'), self.fingerprint)
+
+
+def filterFileBySegments(inFilename, options, cache):
+    """
+    Filters the given file, reusing whatever segments are cached.
+
+    Returns just what filterLinesBySegments() does.
+    """
+    return filterLinesBySegments(readSourceLines(inFilename), inFilename,
+                                 options, cache)
+
+
+def filterLinesBySegments(lines, inFilename, options, cache):
+    """
+    Filters the given lines of a file, reusing whatever segments are cached.
+
+    Returns exactly what filterFile would, and whether the file got
+    filtered within its time budget rather than passed through.  Segments
+    walked before the budget ran out stay cached all the same, and looking
+    segments up or storing them doesn't count against the budget.  Should
+    some segment rewrite lines beyond its own, the file gets walked in full.
+    """
+    segmentWalker = SegmentWalker(lines, options, inFilename, cache)
+    complete = parseWithinBudget(segmentWalker)
+    if complete and segmentWalker.leaked:
+        # The walker only ever changed a copy of the lines.
+        astWalker = AstWalker(lines, options, inFilename)
+        complete = parseWithinBudget(astWalker)
+        return astWalker.getLines(), complete
+    return segmentWalker.getLines(), complete
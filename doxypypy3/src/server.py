@@ -0,0 +1,230 @@
+# coding=utf-8
+"""
+Persistent doxypypy3 filter server.
+
+Keeps the filter (AstWalker, its compiled regular expressions, and all of
+its imports) loaded in a long-lived process listening on a unix socket.
+Every connection from the thin client (see client.py) is handled in a
+forked child that takes over the client's working directory, command line,
+and standard streams and then runs the regular main(), so the output is
+byte-for-byte what running the filter directly would have produced.  The
+server shuts itself down after having been idle for a while.
+
+The filter compiles its regular expressions and imports some modules only
+once it needs them, so the server has it do all of that up front (see
+warmUp()) rather than leave it to every forked child.
+"""
+import socket
+
+from array import array
+from fcntl import flock, LOCK_EX, LOCK_UN
+from json import loads
+from optparse import OptionParser
+from os import chdir, close, dup2, environ, umask, unlink
+from os.path import basename
+from socketserver import ForkingMixIn, StreamRequestHandler, UnixStreamServer
+from sys import argv, exit as sysExit
+import sys
+
+from .client import (RefusedStatus, getIdleTimeout, getServerIdentity,
+                     getSocketPath, isOwnPeer)
+from .doxypypy import main as filterMain, warmUp
+
+# The client passes along its stdin, stdout, and stderr.
+StreamCount = 3
+MaxRequestSize = 65536
+
+
+class FilterRequestHandler(StreamRequestHandler):
+    """
+    Runs the filter for a single client.
+
+    This always executes in a freshly forked child, so we're free to take
+    over the process-wide state (standard streams, working directory, and
+    argv) of the client we're serving.
+    """
+
+    def handle(self):
+        """Adopts the client's environment, runs the filter, and reports back."""
+        if not isOwnPeer(self.request):
+            return
+        self.request.sendall(b'+')
+        fdSize = array('i').itemsize
+        request, ancillary, _, _ = self.request.recvmsg(
+            MaxRequestSize, socket.CMSG_LEN(StreamCount * fdSize))
+        fds = array('i')
+        for level, kind, data in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - (len(data) % fdSize)])
+        while not request.endswith(b'\n'):
+            chunk = self.request.recv(MaxRequestSize)
+            if not chunk:
+                return
+            request += chunk
+        if len(fds) != StreamCount:
+            return
+        request = loads(request.decode('utf-8'))
+        if request.get('identity') != getServerIdentity():
+            # Some other installation started us; let the client do the
+            # work itself rather than risk different output.
+            for fd in fds:
+                close(fd)
+            self.request.sendall(RefusedStatus + b'\n')
+            return
+        for targetFd, fd in enumerate(fds):
+            dup2(fd, targetFd)
+            close(fd)
+
+        adoptEnvironment(request['environ'], request['streams'])
+        self.request.sendall(b'%d\n' % runFilter(request['cwd'], request['argv']))
+
+
+def adoptEnvironment(clientEnviron, streamEncodings):
+    """
+    Takes over the client's environment and standard stream encodings.
+
+    Option defaults come from the environment and the output depends on
+    the encodings, so both have to match what the client would have had.
+    Our own stream objects still believe they're writing to whatever the
+    server was started with, so they get replaced rather than reconfigured.
+    """
+    environ.clear()
+    environ.update(clientEnviron)
+    (stdoutEncoding, stdoutErrors), (stderrEncoding, stderrErrors) = \
+        streamEncodings
+    sys.stdout = open(1, 'w', encoding=stdoutEncoding, errors=stdoutErrors,
+                      closefd=False)
+    sys.stderr = open(2, 'w', encoding=stderrEncoding, errors=stderrErrors,
+                      closefd=False)
+
+
+def runFilter(cwd, args):
+    """
+    Runs main() as if it had been started in cwd with the given argv.
+
+    Returns the exit status the filter would have had.
+    """
+    status = 0
+    try:
+        chdir(cwd)
+        sys.argv = args
+        filterMain()
+    except SystemExit as exitRequest:
+        if exitRequest.code is None:
+            status = 0
+        elif isinstance(exitRequest.code, int):
+            status = exitRequest.code
+        else:
+            sys.stderr.write(str(exitRequest.code) + "\n")
+            status = 1
+    except BaseException:
+        from traceback import print_exc
+        print_exc()
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return status & 0xff
+
+
+class FilterServer(ForkingMixIn, UnixStreamServer):
+    """A forking unix socket server that exits once it has gone idle."""
+
+    def __init__(self, socketPath, idleTimeout):
+        """Binds to the socket; only our own user may connect to it."""
+        self.idle = False
+        self.timeout = idleTimeout
+        oldUmask = umask(0o177)
+        try:
+            UnixStreamServer.__init__(self, socketPath, FilterRequestHandler)
+        finally:
+            umask(oldUmask)
+
+    def handle_timeout(self):
+        """Goes idle once no more requests are being processed."""
+        ForkingMixIn.handle_timeout(self)
+        if not self.active_children:
+            self.idle = True
+
+    def serveUntilIdle(self):
+        """Handles requests until nothing has happened for a while."""
+        while not self.idle:
+            self.handle_request()
+
+
+def _serverIsRunning(socketPath):
+    """Checks whether some other server is already answering on the socket."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketPath)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def serve(socketPath, idleTimeout):
+    """
+    Runs a filter server on the given socket until it goes idle.
+
+    A lock file serializes starting and stopping servers, so concurrently
+    launched clients end up sharing a single server and a stale socket left
+    behind by a crashed one gets cleaned up.  The filter gets warmed up
+    before the first connection is accepted.
+    """
+    with open(socketPath + '.lock', 'a') as lockFile:
+        flock(lockFile, LOCK_EX)
+        try:
+            if _serverIsRunning(socketPath):
+                return
+            try:
+                unlink(socketPath)
+            except FileNotFoundError:
+                pass
+            server = FilterServer(socketPath, idleTimeout)
+        finally:
+            flock(lockFile, LOCK_UN)
+
+    try:
+        warmUp()
+        server.serveUntilIdle()
+    finally:
+        with open(socketPath + '.lock', 'a') as lockFile:
+            flock(lockFile, LOCK_EX)
+            server.server_close()
+            try:
+                unlink(socketPath)
+            except FileNotFoundError:
+                pass
+            flock(lockFile, LOCK_UN)
+
+
+def main():
+    """Parses the server's command line options and starts serving."""
+    parser = OptionParser(prog=basename(argv[0]))
+    parser.set_usage("%prog [options]")
+    parser.add_option(
+        "-s", "--socket",
+        action="store", type="string", dest="socketPath",
+        default=getSocketPath(),
+        help="unix socket to listen on"
+    )
+    parser.add_option(
+        "-i", "--idle-timeout",
+        action="store", type="float", dest="idleTimeout",
+        default=getIdleTimeout(),
+        help="exit after this many seconds without requests"
+    )
+    (options, args) = parser.parse_args()
+    if args:
+        parser.error("unexpected arguments")
+    if not options.socketPath:
+        parser.error("no safe socket location; use --socket")
+    serve(options.socketPath, options.idleTimeout)
+    sysExit(0)
+
+
+# See if we're running as a script.
+if __name__ == "__main__":
+    main()
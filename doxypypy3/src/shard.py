@@ -0,0 +1,138 @@
+# coding=utf-8
+"""
+Splits the filter workload of a tree across machines and merges the results.
+
+With --shard I/N the batch subcommand only filters its share of the tree,
+so N machines can each filter a part of it into a mirror of their own.  The
+merge subcommand then combines those shard mirrors, manifests included,
+into a single mirror just like the one a single batch run would have made.
+
+Every file goes to a shard by rendezvous hashing: each shard gets a score
+hashed from its number and the file's path, and the file prefers the shards
+in order of their scores.  As that order depends on nothing but the file
+itself, every machine works out the same split without talking to the
+others.  Files vary wildly in how long they take to filter, so the loads
+are bounded as well: going from the most expensive file down (by the same
+estimate the batch uses to order its work), each file goes to the first
+shard it prefers that stays within a little more than an even share of the
+total cost.
+
+Those bounds depend on every file of the tree, so adding or removing files
+can move others: a file whose preferred shard filled up earlier or later
+than before ends up on another of its preferred shards.  Most files stay
+on their most preferred shard all the same, so only a few of them move,
+but a split is only guaranteed to stay put for as long as the tree does.
+"""
+from hashlib import sha256
+from os import makedirs, sep, walk
+from os.path import dirname, join, relpath
+from shutil import copyfile
+from sys import exit as sysExit, stderr
+
+from .batch import (ManifestFile, estimateCost, readManifest, removeOutput,
+                    writeManifest)
+from .cmd_options import mergeOptParse
+from .compile import linesep
+
+## How far above an even share of the total cost a shard may go.
+ShardSlack = 0.1
+
+
+class MergeError(Exception):
+    """Raised when shard mirrors can't be combined."""
+
+
+def getShardRanking(relName, shardCount):
+    """Returns the shards in the order a file prefers them."""
+    relName = relName.replace(sep, '/').encode('utf-8', 'surrogateescape')
+    return sorted(range(shardCount), reverse=True, key=lambda shardNum: sha256(
+        str(shardNum).encode('ascii') + b'\0' + relName).digest())
+
+
+def assignShards(costs, shardCount):
+    """
+    Splits files into shards of similar total cost.
+
+    Takes the estimated cost of every file by its path relative to the
+    tree, and returns the (zero-based) shard of every file.
+    """
+    capacity = (1 + ShardSlack) * sum(costs.values()) / shardCount
+    loads = [0] * shardCount
+    shards = {}
+    for relName in sorted(costs, key=lambda relName: (-costs[relName],
+                                                      relName)):
+        ranking = getShardRanking(relName, shardCount)
+        cost = costs[relName]
+        for shardNum in ranking:
+            if loads[shardNum] + cost <= capacity:
+                break
+        else:
+            # Too big to fit anywhere; it goes where it hurts least.
+            shardNum = min(ranking, key=lambda shardNum: loads[shardNum])
+        loads[shardNum] += cost
+        shards[relName] = shardNum
+    return shards
+
+
+def selectShard(srcDir, inFilenames, shard):
+    """
+    Returns those of the files beneath srcDir that belong to the shard.
+
+    The shard is given as a (zero-based index, count) pair.  All of the
+    files need to be passed in, as the split depends on their total cost.
+    """
+    shardNum, shardCount = shard
+    inFilenames = list(inFilenames)
+    relNames = [relpath(inFilename, srcDir) for inFilename in inFilenames]
+    shards = assignShards(dict(
+        (relName, estimateCost(inFilename))
+        for relName, inFilename in zip(relNames, inFilenames)), shardCount)
+    return [inFilename for relName, inFilename in zip(relNames, inFilenames)
+            if shards[relName] == shardNum]
+
+
+def mergeMirrors(outDir, shardDirs):
+    """
+    Combines the mirrors of all shards into the single mirror outDir.
+
+    Every file of every shard mirror is copied over and their manifests
+    combined, so batch reruns into outDir skip whatever is up to date.
+    Files the previous merge recorded that no shard has anymore are
+    removed.  Raises a MergeError if two shards hold the same file, which
+    means they didn't come from the same split.  Returns the number of
+    files merged.
+    """
+    previous = readManifest(outDir)
+    files = {}
+    origins = {}
+    for shardDir in shardDirs:
+        shardFiles = readManifest(shardDir)
+        for dirPath, dirNames, fileNames in walk(shardDir):
+            dirNames.sort()
+            for fileName in sorted(fileNames):
+                relName = relpath(join(dirPath, fileName), shardDir)
+                if relName == ManifestFile:
+                    continue
+                if relName in origins:
+                    raise MergeError("{0} is in both {1} and {2}".format(
+                        relName, origins[relName], shardDir))
+                origins[relName] = shardDir
+                outFilename = join(outDir, relName)
+                makedirs(dirname(outFilename), exist_ok=True)
+                copyfile(join(dirPath, fileName), outFilename)
+                if relName in shardFiles:
+                    files[relName] = shardFiles[relName]
+    for relName in set(previous) - set(origins):
+        removeOutput(outDir, relName)
+    writeManifest(outDir, files)
+    return len(origins)
+
+
+def main(args):
+    """Runs the merge subcommand on the given command line arguments."""
+    (options, outDir, shardDirs) = mergeOptParse(args)
+    try:
+        mergeMirrors(outDir, shardDirs)
+    except MergeError as error:
+        stderr.write("Can't merge: {0}{1}".format(error, linesep))
+        sysExit(1)
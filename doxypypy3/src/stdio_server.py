@@ -0,0 +1,149 @@
+# coding=utf-8
+"""
+Filters a stream of files sent over stdin, answering on stdout.
+
+For tools that can keep a pipe to a child process open but can't talk to
+the unix socket server (see server.py), --serve-stdio keeps a single filter
+process running for as long as its stdin stays open, so the interpreter
+start, the imports, and the compiled regular expressions are paid for once
+rather than once per file.
+
+Every request is made up of three frames: the path of the file, the filter
+options as a JSON array of command line arguments (overriding those the
+server was started with), and the source itself.  Every request gets a
+single response frame: either the filtered source or, should this one file
+fail to filter, an error message.  Either way the server goes on with the
+next request.  A frame is a 4 byte big-endian length followed by that many
+bytes; a response frame additionally starts with a single byte giving its
+kind.  Sources get decoded just like files, going by their BOM or coding
+cookie; outputs are UTF-8, and just what the filter writes to stdout for
+that file.  The output cache isn't used, as there are no files to key it
+on.
+"""
+from copy import copy, deepcopy
+from json import loads
+from struct import Struct
+import sys
+
+from .cmd_options import filterOptParse, getFullPathNamespace
+from .compile import linesep
+from .doxypypy import walkSource, warmUp
+
+## Length prefix of every request frame.
+RequestHeader = Struct('>I')
+## Kind and length prefix of every response frame.
+ResponseHeader = Struct('>cI')
+## Response kind carrying the filtered source.
+OutputKind = b'+'
+## Response kind carrying an error message.
+ErrorKind = b'!'
+
+
+class FrameError(Exception):
+    """Raised when the stream ends in the middle of a frame."""
+
+
+def _readExactly(stream, size):
+    """Reads exactly size bytes, or fewer only if the stream ends first."""
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def readFrame(stream):
+    """
+    Reads a single request frame from a binary stream.
+
+    Returns None if the stream ends cleanly before the frame.
+    """
+    header = _readExactly(stream, RequestHeader.size)
+    if not header:
+        return None
+    if len(header) < RequestHeader.size:
+        raise FrameError("stream ended within a frame header")
+    (size,) = RequestHeader.unpack(header)
+    payload = _readExactly(stream, size)
+    if len(payload) < size:
+        raise FrameError("stream ended within a frame")
+    return payload
+
+
+def writeFrame(stream, payload, kind=None):
+    """Writes a frame, a response frame if given its kind, to a stream."""
+    if kind is None:
+        stream.write(RequestHeader.pack(len(payload)))
+    else:
+        stream.write(ResponseHeader.pack(kind, len(payload)))
+    stream.write(payload)
+
+
+def filterRequest(path, args, source, serverOptions):
+    """
+    Filters the source of a single request.
+
+    Returns the output encoded as UTF-8, just as the filter would have
+    printed it.  Options given more than once add to lists, so those of
+    the server get copied too rather than added to.
+    """
+    options = filterOptParse(args, deepcopy(serverOptions)) if args else \
+        copy(serverOptions)
+    options.fullPathNamespace = getFullPathNamespace(
+        path, options.topLevelNamespace)
+    return (walkSource(source, path, options).getLines() +
+            linesep).encode('utf-8')
+
+
+def handleRequest(path, args, source, serverOptions):
+    """
+    Handles a single request, turning any failure into an error response.
+
+    Returns the kind and payload of the response.
+    """
+    try:
+        path = path.decode('utf-8', 'surrogateescape')
+        args = loads(args.decode('utf-8')) if args else []
+        if not isinstance(args, list) or \
+                not all(isinstance(arg, str) for arg in args):
+            raise ValueError("options must be an array of strings")
+        return OutputKind, filterRequest(path, args, source, serverOptions)
+    except SystemExit:
+        # The options didn't parse; the details went to stderr.
+        return ErrorKind, "invalid options: {0}".format(args).encode('utf-8')
+    except Exception as error:
+        return ErrorKind, "{0}: {1}".format(type(error).__name__,
+                                            error).encode('utf-8')
+
+
+def serveStdio(options):
+    """
+    Answers requests from stdin on stdout until stdin is closed.
+
+    Anything else that would end up on stdout goes to stderr instead, so
+    it can't get mixed up with the responses.  The filter gets warmed up
+    before the first request is read.
+    """
+    requests = sys.stdin.buffer
+    responses = sys.stdout.buffer
+    sys.stdout.flush()
+    sys.stdout = sys.stderr
+    warmUp()
+    try:
+        while True:
+            path = readFrame(requests)
+            if path is None:
+                break
+            args = readFrame(requests)
+            source = readFrame(requests)
+            if args is None or source is None:
+                raise FrameError("stream ended within a request")
+            kind, payload = handleRequest(path, args, source, options)
+            writeFrame(responses, payload, kind)
+            responses.flush()
+    except FrameError as error:
+        sys.stderr.write("doxypypy3: {0}{1}".format(error, linesep))
+        sys.exit(1)
@@ -0,0 +1,238 @@
+# coding=utf-8
+"""
+Keeps a filtered mirror of a source tree continuously up to date.
+
+The watch subcommand first brings the mirror up to date just like the batch
+subcommand, then stays running and refilters every file as it gets saved,
+removing the mirrored output of files that go away.  As it's a single
+long-lived process, the filter is loaded once and stays warm (see warmUp()),
+so a Doxygen rebuild can start right away against already filtered inputs.
+
+On Linux changes are picked up through inotify (called directly via
+ctypes); elsewhere, or if inotify isn't available, the tree is polled.
+Editors tend to save in bursts (write a backup, write the file, touch it
+again), so changes are only acted upon once the tree has been quiet for a
+moment.
+"""
+from os import lstat, walk
+from os.path import abspath, exists, isdir, join, relpath
+from select import select
+from struct import Struct
+from time import sleep
+
+from .batch import applyChanges, filterTree, findSourceFiles
+from .cmd_options import watchOptParse
+from .doxypypy import warmUp
+from .gitchanges import Changed, Deleted
+
+# inotify constants from <sys/inotify.h>.
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WatchMask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_DELETE_SELF | IN_ATTRIB
+## Header of every event read from an inotify file descriptor.
+InotifyEvent = Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    Watches a tree through inotify.
+
+    inotify only watches single directories, so every directory of the
+    tree gets a watch of its own, including ones created later on.
+    """
+
+    def __init__(self, srcDir, excludeDirs=()):
+        """Sets up watches on every directory beneath srcDir."""
+        import ctypes
+        import ctypes.util
+        self.srcDir = srcDir
+        self.excludeDirs = set(abspath(excludeDir) for excludeDir in excludeDirs)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watchDirs = {}
+        self._watchTree(srcDir)
+
+    def close(self):
+        """Stops watching."""
+        from os import close
+        close(self.fd)
+
+    def _watchTree(self, topDir):
+        """
+        Adds watches for topDir and every directory beneath it.
+
+        Returns the files found beneath it, which may have been written
+        before their directory was being watched.
+        """
+        import ctypes
+        foundFiles = []
+        for dirPath, dirNames, fileNames in walk(topDir):
+            dirNames[:] = [dirName for dirName in dirNames
+                           if abspath(join(dirPath, dirName))
+                           not in self.excludeDirs]
+            watchDesc = self.libc.inotify_add_watch(
+                self.fd, dirPath.encode('utf-8', 'surrogateescape'), WatchMask)
+            if watchDesc < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed",
+                              dirPath)
+            self.watchDirs[watchDesc] = dirPath
+            foundFiles.extend(join(dirPath, fileName) for fileName in fileNames)
+        return foundFiles
+
+    def poll(self, timeout=None):
+        """
+        Waits up to timeout seconds (forever if None) for changes.
+
+        Returns the paths, relative to the tree, of the files that changed,
+        or None if the changes can't be told apart anymore and the whole
+        tree needs another look.
+        """
+        from os import read
+        if not select([self.fd], [], [], timeout)[0]:
+            return []
+        data = read(self.fd, 65536)
+        changedPaths = set()
+        offset = 0
+        while offset < len(data):
+            watchDesc, mask, _, nameLength = InotifyEvent.unpack_from(data,
+                                                                      offset)
+            offset += InotifyEvent.size
+            name = data[offset:offset + nameLength].rstrip(b'\0').decode(
+                'utf-8', 'surrogateescape')
+            offset += nameLength
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self.watchDirs.pop(watchDesc, None)
+                continue
+            dirPath = self.watchDirs.get(watchDesc)
+            if dirPath is None or not name:
+                continue
+            path = join(dirPath, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and \
+                        abspath(path) not in self.excludeDirs:
+                    changedPaths.update(self._watchTree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    # Whatever was in there is gone now.
+                    return None
+            elif not mask & IN_CREATE:
+                # Files just created get a close-write of their own.
+                changedPaths.add(path)
+        return [relpath(path, self.srcDir) for path in changedPaths]
+
+
+class PollingWatcher:
+    """Watches a tree by looking at it over and over."""
+
+    def __init__(self, srcDir, excludeDirs=(), patterns=('*',), interval=1.0):
+        """Takes a first look at the tree."""
+        self.srcDir = srcDir
+        self.excludeDirs = excludeDirs
+        self.patterns = patterns
+        self.interval = interval
+        self.snapshot = self._takeSnapshot()
+
+    def close(self):
+        """Stops watching."""
+
+    def _takeSnapshot(self):
+        """Returns the size and modification time of every file."""
+        snapshot = {}
+        for inFilename in findSourceFiles(self.srcDir, self.patterns,
+                                          self.excludeDirs):
+            try:
+                fileStat = lstat(inFilename)
+            except FileNotFoundError:
+                continue
+            snapshot[relpath(inFilename, self.srcDir)] = \
+                fileStat.st_size, fileStat.st_mtime_ns
+        return snapshot
+
+    def poll(self, timeout=None):
+        """
+        Waits up to timeout seconds (forever if None) for changes.
+
+        Returns the paths, relative to the tree, of the files that changed.
+        """
+        waited = 0
+        while True:
+            snapshot = self._takeSnapshot()
+            changedPaths = [relName for relName in
+                            set(snapshot) | set(self.snapshot)
+                            if snapshot.get(relName) !=
+                            self.snapshot.get(relName)]
+            self.snapshot = snapshot
+            if changedPaths or (timeout is not None and waited >= timeout):
+                return changedPaths
+            delay = self.interval if timeout is None else \
+                min(self.interval, timeout - waited)
+            sleep(delay)
+            waited += delay
+
+
+def getWatcher(srcDir, outDir, options):
+    """Returns the best watcher available for the tree."""
+    if not options.poll:
+        try:
+            return InotifyWatcher(srcDir, [outDir])
+        except (OSError, AttributeError):
+            # No inotify here; AttributeError means libc doesn't have it.
+            pass
+    return PollingWatcher(srcDir, [outDir], options.patterns,
+                          options.interval)
+
+
+def watchTree(srcDir, outDir, options, watcher):
+    """
+    Refilters files into the mirror as the watcher reports them changed.
+
+    Changes are held back until the tree has been quiet for options.debounce
+    seconds.  Runs until interrupted.
+    """
+    pending = set()
+    rescan = False
+    while True:
+        changedPaths = watcher.poll(options.debounce if pending or rescan
+                                    else None)
+        if changedPaths is None:
+            rescan = True
+        elif changedPaths:
+            pending.update(changedPaths)
+        elif rescan:
+            filterTree(srcDir, outDir, options)
+            pending.clear()
+            rescan = False
+        elif pending:
+            applyChanges(srcDir, outDir, options, [
+                (Changed if exists(join(srcDir, relName)) and
+                 not isdir(join(srcDir, relName)) else Deleted, relName, None)
+                for relName in sorted(pending)])
+            pending.clear()
+
+
+def main(args):
+    """Runs the watch subcommand on the given command line arguments."""
+    (options, srcDir, outDir) = watchOptParse(args)
+    warmUp()
+    filterTree(srcDir, outDir, options)
+    watcher = getWatcher(srcDir, outDir, options)
+    try:
+        watchTree(srcDir, outDir, options, watcher)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the cold start of the single-file filter.
+
+Doxygen starts the filter afresh for every file it reads, so for an
+INPUT_FILTER the time from starting the process to it exiting is what
+counts, and for most files that's dominated by starting the interpreter
+and importing the filter rather than by filtering.  This runs the
+doxypypy3 console script (or the module, should the script not be
+installed) as a subprocess on small, medium and large inputs built from
+the samples here, just as Doxygen would, and reports the p50 and p95 wall
+times of each.
+
+Each time is split in three by also timing, alongside every run, an
+interpreter that does nothing and one that only imports the filter:
+interpreter start is the first, import is what the second takes beyond
+it, and filtering is whatever the full run takes beyond the second.  The
+results are written as JSON, so they can be kept and compared across
+releases.
+
+It isn't part of the test suite; run it from the top-level directory:
+
+    python -m doxypypy3.test.bench_coldstart -o coldstart.json
+"""
+from glob import glob
+from json import dump
+from optparse import OptionParser
+from os.path import basename, join, splitext
+from platform import platform, python_implementation, python_version
+from shutil import rmtree, which
+from subprocess import run, DEVNULL
+from sys import executable, stdout
+from tempfile import mkdtemp
+from time import perf_counter, strftime
+from tokenize import open as openSource
+
+from doxypypy3 import __version__
+
+## The samples the inputs are built from.
+SamplePattern = 'doxypypy3/test/sample_*.py'
+## Roughly how large the large input gets, in bytes.
+LargeSize = 1 << 18
+## What the filter imports before it gets to filtering.
+ImportStatement = 'import doxypypy3.main, doxypypy3.src.cmd_options'
+## The percentiles reported for every time.
+Percentiles = (('p50', 0.5), ('p95', 0.95))
+
+
+def readSamples():
+    """
+    Reads the samples as text, smallest first.
+
+    The expected outputs sitting alongside them are left out.
+    """
+    samples = []
+    for path in sorted(glob(SamplePattern)):
+        if '.' in splitext(basename(path))[0]:
+            continue
+        with openSource(path) as sampleFile:
+            samples.append(sampleFile.read())
+    return sorted(samples, key=len)
+
+
+def writeInputs(inputDir):
+    """
+    Writes the small, medium and large inputs into a directory.
+
+    The small input is the smallest sample, the medium one all of the
+    samples run together, and the large one the medium one repeated up to
+    LargeSize.  Returns the paths of the inputs by name.
+    """
+    samples = readSamples()
+    medium = '\n'.join(samples)
+    contents = {
+        'small': samples[0],
+        'medium': medium,
+        'large': '\n'.join([medium] * max(1, LargeSize // len(medium))),
+    }
+    paths = {}
+    for name, content in contents.items():
+        paths[name] = join(inputDir, 'bench_{0}.py'.format(name))
+        with open(paths[name], 'w', encoding='utf-8') as inputFile:
+            inputFile.write(content)
+    return paths
+
+
+def getFilterCommand(python):
+    """
+    Returns the command Doxygen would run the filter with.
+
+    That's the console script if it's installed, the module otherwise.
+    """
+    script = which('doxypypy3')
+    if script:
+        return [script]
+    return [python, '-m', 'doxypypy3.main']
+
+
+def timeCommand(command):
+    """Runs a command and returns its wall time in seconds."""
+    startTime = perf_counter()
+    run(command, stdout=DEVNULL, check=True)
+    return perf_counter() - startTime
+
+
+def percentile(times, fraction):
+    """Returns the given percentile of some times, by nearest rank."""
+    times = sorted(times)
+    rank = max(1, int(round(fraction * len(times))))
+    return times[rank - 1]
+
+
+def summarize(times):
+    """Returns the percentiles of some times, in milliseconds."""
+    return {label: round(percentile(times, fraction) * 1000, 3)
+            for label, fraction in Percentiles}
+
+
+def benchInput(path, filterCommand, filterArgs, python, runCount):
+    """
+    Times runCount cold starts of the filter on a single input.
+
+    Returns the percentiles of the start, import, filter and total times.
+    """
+    phases = {'start': [], 'import': [], 'filter': [], 'total': []}
+    for _ in range(runCount):
+        startTime = timeCommand([python, '-c', 'pass'])
+        importTime = timeCommand([python, '-c', ImportStatement])
+        totalTime = timeCommand(filterCommand + filterArgs + [path])
+        phases['start'].append(startTime)
+        phases['import'].append(max(0.0, importTime - startTime))
+        phases['filter'].append(max(0.0, totalTime - importTime))
+        phases['total'].append(totalTime)
+    return {phase: summarize(times) for phase, times in phases.items()}
+
+
+def benchColdStart(runCount, filterArgs, python=executable):
+    """
+    Benchmarks the cold start of the filter on every input.
+
+    Returns the results, ready to be written as JSON.
+    """
+    filterCommand = getFilterCommand(python)
+    inputDir = mkdtemp()
+    try:
+        paths = writeInputs(inputDir)
+        # Warm up, so bytecode caches and the like don't count.
+        for path in paths.values():
+            timeCommand(filterCommand + filterArgs + [path])
+        inputs = {}
+        for name, path in paths.items():
+            with open(path, 'rb') as inputFile:
+                content = inputFile.read()
+            inputs[name] = dict(bytes=len(content),
+                                lines=content.count(b'\n') + 1,
+                                **benchInput(path, filterCommand, filterArgs,
+                                             python, runCount))
+    finally:
+        rmtree(inputDir)
+    return {
+        'version': __version__,
+        'date': strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': '{0} {1}'.format(python_implementation(), python_version()),
+        'platform': platform(),
+        'command': filterCommand + filterArgs,
+        'runs': runCount,
+        'unit': 'ms',
+        'inputs': inputs,
+    }
+
+
+def formatResults(results):
+    """Formats the results as a table for humans."""
+    lines = ['{0:<8}{1:>10}{2:>16}{3:>16}{4:>16}{5:>16}'.format(
+        'input', 'bytes', 'start', 'import', 'filter', 'total')]
+    for name, result in results['inputs'].items():
+        lines.append('{0:<8}{1:>10}'.format(name, result['bytes']) + ''.join(
+            '{0:>16}'.format('{p50:.1f}/{p95:.1f}'.format(**result[phase]))
+            for phase in ('start', 'import', 'filter', 'total')))
+    lines.append('(p50/p95 wall times in ms over {0} runs)'.format(
+        results['runs']))
+    return '\n'.join(lines)
+
+
+def main():
+    """Runs the benchmark as asked for on the command line."""
+    parser = OptionParser(usage="%prog [options] [-- filter options]")
+    parser.add_option(
+        "-n", "--runs",
+        action="store", type="int", dest="runCount", default=20,
+        help="cold starts to time per input (default: %default)"
+    )
+    parser.add_option(
+        "-o", "--output",
+        action="store", type="string", dest="outputPath",
+        help="write the results as JSON to this file rather than stdout"
+    )
+    (options, filterArgs) = parser.parse_args()
+    if options.runCount < 1:
+        parser.error("need at least one run")
+    results = benchColdStart(options.runCount, filterArgs or ['-a', '-c'])
+    if options.outputPath:
+        with open(options.outputPath, 'w') as outputFile:
+            dump(results, outputFile, indent=2)
+        print(formatResults(results))
+    else:
+        dump(results, stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks what the filter spends on every line of a docstring.
+
+Builds a docstring-heavy module out of the samples here, walks it in
+process over and over for each set of options, and reports the time per
+docstring line of the whole walk, and of the docstring processing within
+it alone (the time spent in _processDocstring).  Visiting the tree costs
+the same whatever the docstrings hold, so the latter is what changes to
+the docstring handling show up in.  Only the best of the repeats counts,
+as the others mostly measure whatever else the machine was up to.  The
+results are written as JSON.
+
+It isn't part of the test suite; run it from the top-level directory:
+
+    python -m doxypypy3.test.bench_docstrings -o docstrings.json
+"""
+from ast import get_docstring, parse, walk
+from json import dump
+from optparse import OptionParser
+from platform import python_implementation, python_version
+from sys import stdout
+from time import perf_counter, strftime
+
+from doxypypy3 import __version__
+from doxypypy3.src.cmd_options import filterOptParse
+from doxypypy3.src.doxypypy import AstWalker
+from doxypypy3.test.bench_coldstart import readSamples
+
+## Roughly how many lines the module gets, repeating the samples.
+ModuleLines = 20000
+## The sets of options timed, by name.
+OptionSets = (
+    ('bare', []),
+    ('autobrief', ['-a']),
+    ('autobrief+autocode', ['-a', '-c']),
+)
+
+
+def buildModule():
+    """
+    Builds the module to walk, as lines.
+
+    Returns the lines along with how many of them belong to docstrings.
+    """
+    samples = '\n'.join(readSamples())
+    sampleLineCount = samples.count('\n') + 1
+    source = '\n'.join([samples] * max(1, ModuleLines // sampleLineCount))
+    docstringLineCount = 0
+    for node in walk(parse(source)):
+        try:
+            docstring = get_docstring(node, clean=False)
+        except TypeError:
+            continue
+        if docstring is not None:
+            docstringLineCount += docstring.count('\n') + 1
+    return source.splitlines(True), docstringLineCount
+
+
+class TimedWalker(AstWalker):
+    """A walker that keeps track of the time spent on docstrings."""
+
+    def __init__(self, lines, options, inFilename):
+        """Sets up a walk with nothing spent on docstrings yet."""
+        AstWalker.__init__(self, lines, options, inFilename)
+        self.docstringTime = 0.0
+
+    def _processDocstring(self, node, tail='', **kwargs):
+        """Processes a docstring, adding up the time it takes."""
+        startTime = perf_counter()
+        AstWalker._processDocstring(self, node, tail, **kwargs)
+        self.docstringTime += perf_counter() - startTime
+
+
+def timeWalk(lines, args, repeatCount):
+    """
+    Walks the lines repeatCount times with the given options.
+
+    Returns the best times, in seconds, of the whole walk and of the
+    docstring processing within it.
+    """
+    options = filterOptParse(args)
+    options.fullPathNamespace = 'bench'
+    bestWalkTime = bestDocstringTime = None
+    for _ in range(repeatCount):
+        timedWalker = TimedWalker(list(lines), options, 'bench.py')
+        startTime = perf_counter()
+        timedWalker.parseLines()
+        walkTime = perf_counter() - startTime
+        if bestWalkTime is None or walkTime < bestWalkTime:
+            bestWalkTime = walkTime
+        if bestDocstringTime is None or \
+                timedWalker.docstringTime < bestDocstringTime:
+            bestDocstringTime = timedWalker.docstringTime
+    return bestWalkTime, bestDocstringTime
+
+
+def benchDocstrings(repeatCount):
+    """
+    Times the walk of the module with every set of options.
+
+    Returns the results, ready to be written as JSON.
+    """
+    lines, docstringLineCount = buildModule()
+    times = {name: timeWalk(lines, args, repeatCount)
+             for name, args in OptionSets}
+    return {
+        'version': __version__,
+        'date': strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': '{0} {1}'.format(python_implementation(), python_version()),
+        'lines': len(lines),
+        'docstringLines': docstringLineCount,
+        'repeats': repeatCount,
+        'unit': 'us per docstring line',
+        'options': {
+            name: {
+                'walk': round(walkTime * 1e6 / docstringLineCount, 3),
+                'docstrings': round(docstringTime * 1e6 /
+                                    docstringLineCount, 3),
+            } for name, (walkTime, docstringTime) in times.items()
+        },
+    }
+
+
+def formatResults(results):
+    """Formats the results as a table for humans."""
+    lines = ['{0:<20}{1:>12}{2:>12}'.format('options', 'walk', 'docstrings')]
+    for name, result in results['options'].items():
+        lines.append('{0:<20}{1[walk]:>12.2f}{1[docstrings]:>12.2f}'.format(
+            name, result))
+    lines.append('(best of {0}, us per line over {1} docstring lines)'.format(
+        results['repeats'], results['docstringLines']))
+    return '\n'.join(lines)
+
+
+def main():
+    """Runs the benchmark as asked for on the command line."""
+    parser = OptionParser()
+    parser.add_option(
+        "-n", "--repeats",
+        action="store", type="int", dest="repeatCount", default=5,
+        help="walks to time per set of options (default: %default)"
+    )
+    parser.add_option(
+        "-o", "--output",
+        action="store", type="string", dest="outputPath",
+        help="write the results as JSON to this file rather than stdout"
+    )
+    (options, _) = parser.parse_args()
+    if options.repeatCount < 1:
+        parser.error("need at least one repeat")
+    results = benchDocstrings(options.repeatCount)
+    if options.outputPath:
+        with open(options.outputPath, 'w') as outputFile:
+            dump(results, outputFile, indent=2)
+        print(formatResults(results))
+    else:
+        dump(results, stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
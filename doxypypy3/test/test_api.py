@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests the in-process embedding API.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os.path import abspath
+from subprocess import run, PIPE
+from sys import executable
+
+import doxypypy3
+from ..src.api import FilterOptions, filterSource
+
+
+class TestApi(unittest.TestCase):
+    """
+    Define our embedding API tests.
+    """
+
+    __samples = [
+        'doxypypy3/test/sample_google.py',
+        'doxypypy3/test/sample_interfaces.py',
+        'doxypypy3/test/sample_sections.py'
+    ]
+
+    def test_matchesFilter(self):
+        """
+        Test that text and bytes both give what the command line filter does.
+        """
+        options = FilterOptions(autobrief=True, autocode=True,
+                                topLevelNamespace='test')
+        for sample in TestApi.__samples:
+            path = abspath(sample)
+            direct = run([executable, '-m', 'doxypypy3.main', '-a', '-c',
+                          '--ns=test', path], stdout=PIPE, check=True)
+            with open(path, 'rb') as sampleFile:
+                source = sampleFile.read()
+            expected = direct.stdout.decode('utf-8')
+            self.assertEqual(filterSource(source, path, options) + '\n',
+                             expected)
+            self.assertEqual(filterSource(source.decode('utf-8'), path,
+                                          options) + '\n', expected)
+
+    def test_namespace(self):
+        """
+        Test that the namespace comes from the filename unless given.
+        """
+        source = '"""A module."""\n\r\ndef f():\r\n    """Does nothing."""\r\n'
+        self.assertIn('@namespace pkg.mod.f', filterSource(
+            source, 'pkg/mod.py', FilterOptions(topLevelNamespace='pkg')))
+        self.assertIn('@namespace other.f', filterSource(
+            source, 'pkg/mod.py',
+            FilterOptions(topLevelNamespace='pkg', fullPathNamespace='other')))
+        self.assertNotIn('\r', filterSource(source.encode('utf-8'), 'mod.py'))
+        self.assertRaises(SyntaxError, filterSource,
+                          'def broken(:\n    "Doc."', 'b.py')
+
+    def test_packageExports(self):
+        """
+        Test that the package exports the API without importing it up front.
+        """
+        self.assertIs(doxypypy3.filterSource, filterSource)
+        self.assertIs(doxypypy3.FilterOptions, FilterOptions)
+        self.assertIn('filterSource', dir(doxypypy3))
+        self.assertRaises(AttributeError, getattr, doxypypy3, 'noSuchName')
+        imported = run([executable, '-c',
+                        'import sys, doxypypy3; '
+                        'print("doxypypy3.src.api" in sys.modules)'],
+                       stdout=PIPE, check=True)
+        self.assertEqual(imported.stdout.strip(), b'False')
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
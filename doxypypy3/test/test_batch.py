@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests batch filtering of whole source trees.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os import getcwd, makedirs, unlink, walk
+from os.path import join, exists, relpath
+from shutil import copy, rmtree
+from subprocess import run, PIPE
+from sys import executable
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from ..src.batch import (ManifestFile, estimateCost, filterChanges,
+                         filterTree, findSourceFiles)
+from ..src.cmd_options import batchOptParse
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Define our batch filtering tests.
+    """
+
+    __samples = [
+        'doxypypy3/test/sample_google.py',
+        'doxypypy3/test/sample_interfaces.py',
+        'doxypypy3/test/sample_maze.py'
+    ]
+
+    def setUp(self):
+        """
+        Builds a small source tree with a nested package.
+        """
+        self.tempDir = mkdtemp()
+        self.srcDir = join(self.tempDir, 'src')
+        self.outDir = join(self.tempDir, 'out')
+        makedirs(join(self.srcDir, 'pkg', 'sub'))
+        copy(TestBatch.__samples[0], join(self.srcDir, 'top.py'))
+        copy(TestBatch.__samples[1], join(self.srcDir, 'pkg', 'iface.py'))
+        copy(TestBatch.__samples[2], join(self.srcDir, 'pkg', 'sub', 'maze.py'))
+        with open(join(self.srcDir, 'pkg', 'notes.txt'), 'w') as notesFile:
+            notesFile.write('Not Python.')
+
+    def tearDown(self):
+        """
+        Removes the source tree and its mirror.
+        """
+        rmtree(self.tempDir)
+
+    def test_findSourceFiles(self):
+        """
+        Test that only matching files are found, in a stable order.
+        """
+        self.assertEqual(
+            list(findSourceFiles(self.srcDir, ['*.py'])),
+            [join(self.srcDir, 'top.py'),
+             join(self.srcDir, 'pkg', 'iface.py'),
+             join(self.srcDir, 'pkg', 'sub', 'maze.py')]
+        )
+        self.assertEqual(
+            list(findSourceFiles(self.srcDir, ['*.py'],
+                                 [join(self.srcDir, 'pkg')])),
+            [join(self.srcDir, 'top.py')]
+        )
+
+    def test_mirrorMatchesFilter(self):
+        """
+        Test that every mirrored file matches the single-file filter output.
+        """
+        (options, srcDir, outDir) = batchOptParse(
+            ['-a', '-c', '--ns=pkg', self.srcDir, self.outDir])
+        self.assertEqual(filterTree(srcDir, outDir, options), (3, 0))
+        self.assertFalse(exists(join(self.outDir, 'pkg', 'notes.txt')))
+        for relName in ('top.py', join('pkg', 'iface.py'),
+                        join('pkg', 'sub', 'maze.py')):
+            direct = run([executable, '-m', 'doxypypy3.main', '-a', '-c',
+                          '--ns=pkg', join(self.srcDir, relName)], stdout=PIPE)
+            with open(join(self.outDir, relName), 'rb') as mirrorFile:
+                self.assertEqual(mirrorFile.read(), direct.stdout)
+
+    def test_relativeSourceDir(self):
+        """
+        Test that the namespaces don't depend on how the tree is named.
+        """
+        # A namespace not found in the path leaves the path untrimmed.
+        (options, srcDir, outDir) = batchOptParse(
+            ['--ns=elsewhere', relpath(self.srcDir, getcwd()), self.outDir])
+        self.assertEqual(filterTree(srcDir, outDir, options), (3, 0))
+        direct = run([executable, '-m', 'doxypypy3.main', '--ns=elsewhere',
+                      join(self.srcDir, 'pkg', 'iface.py')], stdout=PIPE)
+        with open(join(self.outDir, 'pkg', 'iface.py'), 'rb') as mirrorFile:
+            self.assertEqual(mirrorFile.read(), direct.stdout)
+
+    def test_estimateCost(self):
+        """
+        Test that docstrings weigh in and unreadable files don't break it.
+        """
+        plainName = join(self.tempDir, 'plain.py')
+        documentedName = join(self.tempDir, 'documented.py')
+        with open(plainName, 'w') as plainFile:
+            plainFile.write('x = 1\n' * 100)
+        with open(documentedName, 'w') as documentedFile:
+            documentedFile.write('"""Doc."""\n' * 60)
+        self.assertGreater(estimateCost(documentedName),
+                           estimateCost(plainName))
+        self.assertEqual(estimateCost(join(self.tempDir, 'missing.py')), 0)
+
+    def test_incrementalRerun(self):
+        """
+        Test that reruns only filter what changed and drop what went away.
+        """
+        (options, srcDir, outDir) = batchOptParse([self.srcDir, self.outDir])
+        self.assertEqual(filterTree(srcDir, outDir, options), (3, 0))
+        with patch('doxypypy3.src.batch.walkFile',
+                   side_effect=AssertionError('filtered an unchanged file')):
+            self.assertEqual(filterTree(srcDir, outDir, options), (0, 0))
+        with open(join(self.srcDir, 'top.py'), 'a') as topFile:
+            topFile.write('\n# One more line.\n')
+        unlink(join(self.srcDir, 'pkg', 'sub', 'maze.py'))
+        self.assertEqual(filterTree(srcDir, outDir, options), (1, 0))
+        self.assertFalse(exists(join(self.outDir, 'pkg', 'sub')))
+        self.assertTrue(exists(join(self.outDir, 'pkg', 'iface.py')))
+        # Different options make for different output.
+        (options, srcDir, outDir) = batchOptParse(
+            ['-a', self.srcDir, self.outDir])
+        self.assertEqual(filterTree(srcDir, outDir, options), (2, 0))
+
+    def git(self, *args):
+        """Runs git within the source tree."""
+        run(['git', '-C', self.srcDir, '-c', 'user.name=Test',
+             '-c', 'user.email=test@example.com'] + list(args),
+            stdout=PIPE, stderr=PIPE, check=True)
+
+    def readTree(self, treeDir):
+        """Returns the contents of every file of a mirror by relative path."""
+        contents = {}
+        for dirPath, _, fileNames in walk(treeDir):
+            for fileName in fileNames:
+                if fileName != ManifestFile:
+                    with open(join(dirPath, fileName), 'rb') as treeFile:
+                        contents[relpath(join(dirPath, fileName),
+                                         treeDir)] = treeFile.read()
+        return contents
+
+    def test_gitChanges(self):
+        """
+        Test that a mirror updated from git matches one filtered afresh.
+        """
+        self.git('init', '-q')
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'Initial')
+        args = ['-a', '--ns=src', self.srcDir, self.outDir]
+        (options, srcDir, outDir) = batchOptParse(args)
+        self.assertEqual(filterTree(srcDir, outDir, options), (3, 0))
+        self.git('mv', join('pkg', 'iface.py'), join('pkg', 'faces.py'))
+        unlink(join(self.srcDir, 'pkg', 'sub', 'maze.py'))
+        with open(join(self.srcDir, 'top.py'), 'a') as topFile:
+            topFile.write('\n# One more line.\n')
+        copy(TestBatch.__samples[1], join(self.srcDir, 'new.py'))
+        (options, srcDir, outDir) = batchOptParse(['--git-since=HEAD'] + args)
+        self.assertEqual(filterChanges(srcDir, outDir, options), (2, 0))
+        freshDir = join(self.tempDir, 'fresh')
+        (options, srcDir, _) = batchOptParse(args)
+        filterTree(srcDir, freshDir, options)
+        self.assertEqual(self.readTree(self.outDir), self.readTree(freshDir))
+        # The manifest is up to date too.
+        self.assertEqual(filterTree(srcDir, outDir, options), (0, 0))
+
+    def test_renamedGenerated(self):
+        """
+        Test that renames making a file generated or not refilter it.
+        """
+        from os import rename
+        from ..src.batch import applyChanges
+        from ..src.gitchanges import Renamed
+        args = ['-a', '--ns=src', self.srcDir, self.outDir]
+        (options, srcDir, outDir) = batchOptParse(args)
+        filterTree(srcDir, outDir, options)
+        freshDir = join(self.tempDir, 'fresh')
+        for oldName, newName in (('iface.py', 'iface_pb2.py'),
+                                 ('iface_pb2.py', 'faces.py')):
+            rename(join(self.srcDir, 'pkg', oldName),
+                   join(self.srcDir, 'pkg', newName))
+            self.assertEqual(applyChanges(srcDir, outDir, options, [
+                (Renamed, join('pkg', newName), join('pkg', oldName))]),
+                (1, 0))
+            filterTree(srcDir, freshDir, options)
+            self.assertEqual(self.readTree(self.outDir),
+                             self.readTree(freshDir))
+
+    def test_parallelWithFailure(self):
+        """
+        Test that a broken file is passed through without stopping the pool.
+        """
+        brokenSource = 'def broken(:\n    """Not even Python."""\n'
+        with open(join(self.srcDir, 'pkg', 'broken.py'), 'w') as brokenFile:
+            brokenFile.write(brokenSource)
+        (options, srcDir, outDir) = batchOptParse(
+            ['-a', '--jobs=2', self.srcDir, self.outDir])
+        self.assertEqual(filterTree(srcDir, outDir, options), (3, 1))
+        with open(join(self.outDir, 'pkg', 'broken.py')) as brokenFile:
+            self.assertEqual(brokenFile.read(), brokenSource)
+        self.assertTrue(exists(join(self.outDir, 'pkg', 'sub', 'maze.py')))
+
+    def test_timedOutFiles(self):
+        """
+        Test that files passed through for running out of time get redone.
+        """
+        from time import sleep
+        from ..src.doxypypy import AstWalker
+        for args in ([], ['--cache-dir=' + join(self.tempDir, 'cache')]):
+            (options, srcDir, outDir) = batchOptParse(
+                args + ['--jobs=1', '--max-seconds-per-file=0.05',
+                        self.srcDir, self.outDir])
+            with patch.object(AstWalker, '_processDocstring',
+                              side_effect=lambda *args, **kwargs: sleep(10)), \
+                    patch('doxypypy3.src.doxypypy.stderr'), \
+                    patch('doxypypy3.src.batch.stderr'):
+                self.assertEqual(filterTree(srcDir, outDir, options), (0, 3))
+            self.assertEqual(filterTree(srcDir, outDir, options), (3, 0))
+            self.assertEqual(filterTree(srcDir, outDir, options), (0, 0))
+            rmtree(self.outDir)
+
+    def test_uncopyableFailure(self):
+        """
+        Test that a failure to copy a broken file through is only reported.
+        """
+        with open(join(self.srcDir, 'broken.py'), 'w') as brokenFile:
+            brokenFile.write('def broken(:\n    """Not even Python."""\n')
+        (options, srcDir, outDir) = batchOptParse(
+            ['--jobs=1', self.srcDir, self.outDir])
+        with patch('doxypypy3.src.batch.copyfile',
+                   side_effect=PermissionError('read-only mirror')), \
+                patch('doxypypy3.src.batch.stderr') as errors:
+            self.assertEqual(filterTree(srcDir, outDir, options), (3, 1))
+        self.assertIn('read-only mirror', errors.write.call_args[0][0])
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests exporting and importing bundles of cached output.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os.path import join
+from shutil import rmtree
+from subprocess import run, PIPE
+from sys import executable
+from tempfile import mkdtemp
+
+from ..src.bundle import BundleError, exportBundle, importBundle
+from ..src.cache import OutputCache, openCache
+
+
+class TestBundle(unittest.TestCase):
+    """
+    Define our cache bundle tests.
+    """
+
+    __sample = 'doxypypy3/test/sample_google.py'
+
+    def setUp(self):
+        """
+        Sets up a cache with a few entries, one of them made by another version.
+        """
+        self.tempDir = mkdtemp()
+        self.bundlePath = join(self.tempDir, 'cache.tar.gz')
+        self.cache = OutputCache(join(self.tempDir, 'warm'))
+        for entryNum in range(3):
+            self.cache.put('{0:064x}'.format(entryNum), b'output %d' % entryNum,
+                           '{0:064x}'.format(entryNum % 2))
+        self.cache.put('{0:064x}'.format(3), b'stale', '0' * 64,
+                       version='0.0.0')
+
+    def tearDown(self):
+        """
+        Removes the caches and the bundle.
+        """
+        rmtree(self.tempDir)
+
+    def test_roundTrip(self):
+        """
+        Test that current entries make it into another cache, stale ones don't.
+        """
+        self.assertEqual(exportBundle(self.cache, self.bundlePath), 3)
+        for cacheFormat in ('files', 'pack'):
+            cold = openCache(join(self.tempDir, cacheFormat), None, cacheFormat)
+            self.assertEqual(importBundle(cold, self.bundlePath), (3, 0))
+            for entryNum in range(3):
+                self.assertEqual(cold.get('{0:064x}'.format(entryNum)),
+                                 b'output %d' % entryNum)
+            self.assertIsNone(cold.get('{0:064x}'.format(3)))
+            # Importing again finds everything already there.
+            self.assertEqual(importBundle(cold, self.bundlePath), (0, 3))
+
+    def test_notABundle(self):
+        """
+        Test that other files are refused.
+        """
+        with open(self.bundlePath, 'wb') as bundleFile:
+            bundleFile.write(b'not a bundle')
+        self.assertRaises(BundleError, importBundle, self.cache,
+                          self.bundlePath)
+
+    def test_warmsFilter(self):
+        """
+        Test that an imported bundle spares the filter the work.
+        """
+        args = [executable, '-m', 'doxypypy3.main', '-a', TestBundle.__sample]
+        warmDir = join(self.tempDir, 'filtered')
+        coldDir = join(self.tempDir, 'cold')
+        direct = run(args + ['--cache-dir', warmDir], stdout=PIPE).stdout
+        for command in (['--cache-dir', warmDir, 'export', self.bundlePath],
+                        ['--cache-dir', coldDir, 'import', self.bundlePath]):
+            self.assertEqual(run([executable, '-m', 'doxypypy3.main', 'cache']
+                                 + command, stdout=PIPE).returncode, 0)
+        stats = OutputCache(coldDir).getStats()
+        self.assertEqual(run(args + ['--cache-dir', coldDir],
+                             stdout=PIPE).stdout, direct)
+        self.assertEqual(OutputCache(coldDir).getStats()['entries'],
+                         stats['entries'])
+        self.assertEqual(OutputCache(coldDir).getStats()['hits'], 1)
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests the cache of filtered output.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from shutil import rmtree
+from subprocess import run, PIPE
+from sys import executable
+from tempfile import mkdtemp
+from os.path import join
+from multiprocessing import get_context
+from os import listdir, utime
+from time import time
+from unittest.mock import patch
+
+from ..src.cache import (OutputCache, filterFileCached, getCacheKey,
+                         getOptionsFingerprint)
+from ..src.cmd_options import filterOptParse, parseSize
+
+
+class TestCache(unittest.TestCase):
+    """
+    Define our output cache tests.
+    """
+
+    __sample = 'doxypypy3/test/sample_google.py'
+
+    def setUp(self):
+        """
+        Sets up an empty cache.
+        """
+        self.cacheDir = mkdtemp()
+        self.cache = OutputCache(self.cacheDir)
+
+    def tearDown(self):
+        """
+        Removes the cache.
+        """
+        rmtree(self.cacheDir)
+
+    @staticmethod
+    def makeOptions(*args, namespace='sample_google'):
+        """
+        Returns filter options for the given arguments and namespace.
+        """
+        options = filterOptParse(list(args))
+        options.fullPathNamespace = namespace
+        return options
+
+    def test_fingerprint(self):
+        """
+        Test that every relevant option changes the key.
+        """
+        baseline = getOptionsFingerprint(self.makeOptions())
+        self.assertEqual(baseline, getOptionsFingerprint(self.makeOptions('-d')))
+        for options in (self.makeOptions('-a'), self.makeOptions('-c'),
+                        self.makeOptions('--ns=sample'),
+                        self.makeOptions('--tablength=8'),
+                        self.makeOptions(namespace='other')):
+            self.assertNotEqual(getOptionsFingerprint(options), baseline)
+        self.assertNotEqual(getCacheKey(b'x', baseline),
+                            getCacheKey(b'x', baseline, version='0'))
+
+    def test_hitSkipsFilter(self):
+        """
+        Test that a hit returns the stored output without filtering.
+        """
+        options = self.makeOptions('-a', '-c')
+        output = filterFileCached(TestCache.__sample, options, self.cache)
+        with patch('doxypypy3.src.segments.filterLinesBySegments',
+                   side_effect=AssertionError('filtered on a hit')):
+            self.assertEqual(
+                filterFileCached(TestCache.__sample, options, self.cache),
+                output)
+
+    def test_filtersWhatWasHashed(self):
+        """
+        Test that a file changing once hashed doesn't get cached as it was.
+        """
+        from ..src.doxypypy import filterFile
+        options = self.makeOptions('-a', '-c', namespace='changing')
+        changingName = join(self.cacheDir, 'changing.py')
+        before = 'def f():\n    """Before."""\n'
+        after = 'def f():\n    """After."""\n'
+        with open(changingName, 'w') as changingFile:
+            changingFile.write(before)
+        expected = (filterFile(changingName, options) + '\n').encode('utf-8')
+        get = self.cache.get
+
+        def changeOnLookup(key):
+            """Changes the file right after it got hashed."""
+            with open(changingName, 'w') as changingFile:
+                changingFile.write(after)
+            return get(key)
+
+        with patch.object(self.cache, 'get', side_effect=changeOnLookup):
+            self.assertEqual(filterFileCached(changingName, options,
+                                              self.cache), expected)
+        self.assertIn(b'After.', filterFileCached(changingName, options,
+                                                  self.cache))
+        with open(changingName, 'w') as changingFile:
+            changingFile.write(before)
+        self.assertEqual(filterFileCached(changingName, options, self.cache),
+                         expected)
+
+    def test_identicalOutput(self):
+        """
+        Test that cached output is byte-for-byte what the filter prints.
+        """
+        args = [executable, '-m', 'doxypypy3.main', '-a', '-c',
+                TestCache.__sample]
+        direct = run(args, stdout=PIPE).stdout
+        for _ in range(2):
+            cached = run(args + ['--cache-dir', self.cacheDir], stdout=PIPE)
+            self.assertEqual(cached.stdout, direct)
+
+    def test_parseSize(self):
+        """
+        Test parsing sizes with units.
+        """
+        self.assertEqual(parseSize('4096'), 4096)
+        self.assertEqual(parseSize('2k'), 2048)
+        self.assertEqual(parseSize('1.5M'), 3 << 19)
+        self.assertEqual(parseSize('1GB'), 1 << 30)
+        self.assertRaises(ValueError, parseSize, 'lots')
+
+    def test_lruEviction(self):
+        """
+        Test that writes beyond the size limit evict the least recently used.
+        """
+        cache = OutputCache(self.cacheDir, maxSize=3500)
+        for entryNum in range(3):
+            cache.put('{0:064x}'.format(entryNum), b'x' * 900, '0' * 64)
+            # Make sure the entries' last uses are well apart.
+            utime(cache.getEntryPath('{0:064x}'.format(entryNum)),
+                  (time() - 100 + entryNum, time() - 100 + entryNum))
+        # Using the oldest entry makes it the most recently used one.
+        self.assertIsNotNone(cache.get('{0:064x}'.format(0)))
+        cache.put('{0:064x}'.format(3), b'x' * 900, '0' * 64)
+        self.assertIsNotNone(cache.get('{0:064x}'.format(0)))
+        self.assertIsNone(cache.get('{0:064x}'.format(1)))
+        self.assertIsNotNone(cache.get('{0:064x}'.format(3)))
+        stats = cache.getStats()
+        self.assertLessEqual(stats['bytes'], 3500)
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual((stats['hits'], stats['misses']), (3, 1))
+        self.assertIsNotNone(stats['lastPrune'])
+
+    def test_prune(self):
+        """
+        Test pruning by age and by size.
+        """
+        for entryNum in range(4):
+            key = '{0:064x}'.format(entryNum)
+            self.cache.put(key, b'x' * 900, '0' * 64)
+            utime(self.cache.getEntryPath(key),
+                  (time() - entryNum * 86400, time() - entryNum * 86400))
+        self.assertIsNone(self.cache.getStats()['lastPrune'])
+        removedCount, _ = self.cache.prune(maxAge=1.5 * 86400)
+        self.assertEqual(removedCount, 2)
+        removedCount, _ = self.cache.prune(maxSize=1000)
+        self.assertEqual(removedCount, 1)
+        self.assertIsNotNone(self.cache.get('{0:064x}'.format(0)))
+        self.assertEqual(self.cache.getStats()['entries'], 1)
+
+    @staticmethod
+    def putInProcess(cacheDir):
+        """Stores and looks up the same few entries over and over."""
+        cache = OutputCache(cacheDir)
+        for entryNum in range(20):
+            key = '{0:064x}'.format(entryNum % 3)
+            cache.put(key, b'x' * (100 + entryNum), '0' * 64)
+            cache.get(key)
+
+    def test_concurrentAccounting(self):
+        """
+        Test that concurrent writers keep the running totals exact.
+        """
+        context = get_context('spawn')
+        writers = [context.Process(target=TestCache.putInProcess,
+                                   args=(self.cacheDir,)) for _ in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        stats = self.cache.getStats()
+        state = self.cache._readState()
+        self.assertEqual((state['entries'], state['bytes']),
+                         (stats['entries'], stats['bytes']))
+        self.assertEqual((stats['hits'], stats['misses']), (80, 0))
+        self.assertEqual(sorted(name for name in listdir(self.cacheDir)
+                                if len(name) > 2),
+                         ['hits.count', 'lock', 'state.json'])
+
+    def test_lookupsUnlocked(self):
+        """
+        Test that lookups are counted without the lock, and folded later.
+        """
+        key = '{0:064x}'.format(0)
+        self.cache.put(key, b'x', '0' * 64)
+        with patch.object(self.cache, '_locked',
+                          side_effect=AssertionError('locked on a lookup')):
+            for _ in range(5):
+                self.cache.get(key)
+            self.cache.get('{0:064x}'.format(1))
+        stats = self.cache.getStats()
+        self.assertEqual((stats['hits'], stats['misses']), (5, 1))
+        self.assertEqual(self.cache._readState()['hits'], 0)
+        with patch('doxypypy3.src.cache.CountFoldSize', 5):
+            self.cache.put(key, b'y', '0' * 64)
+        state = self.cache._readState()
+        self.assertEqual((state['hits'], state['misses']), (5, 0))
+        self.cache.prune()
+        state = self.cache._readState()
+        self.assertEqual((state['hits'], state['misses']), (5, 1))
+        self.assertEqual(self.cache.getStats()['misses'], 1)
+        self.assertEqual(sorted(name for name in listdir(self.cacheDir)
+                                if len(name) > 2), ['lock', 'state.json'])
+
+    @staticmethod
+    def filterInProcess(options, cacheDir, results):
+        """
+        Filters the sample through the cache and reports the result.
+        """
+        results.put(filterFileCached(TestCache.__sample, options,
+                                     OutputCache(cacheDir)))
+
+    def test_singleFlight(self):
+        """
+        Test that a miss waits for whoever is already producing the entry.
+        """
+        options = self.makeOptions('-a')
+        with open(TestCache.__sample, 'rb') as sampleFile:
+            fingerprint = getOptionsFingerprint(options)
+            key = getCacheKey(sampleFile.read(), fingerprint)
+        # A forked waiter would share our lock, so it has to be spawned.
+        context = get_context('spawn')
+        results = context.Queue()
+        waiter = context.Process(target=TestCache.filterInProcess,
+                                 args=(options, self.cacheDir, results))
+        with self.cache.producing(key):
+            waiter.start()
+            waiter.join(1)
+            self.assertTrue(waiter.is_alive())
+            self.cache.put(key, b'produced elsewhere\n', fingerprint)
+        self.assertEqual(results.get(timeout=10), b'produced elsewhere\n')
+        waiter.join()
+        self.assertEqual(listdir(join(self.cacheDir, key[:2])), [key[2:]])
+        self.assertEqual(listdir(join(self.cacheDir, 'locks')), [])
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
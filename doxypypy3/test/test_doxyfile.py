@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests pre-filtering the inputs of a Doxyfile.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os import makedirs, unlink
+from os.path import join, exists
+from shutil import copy, rmtree
+from tempfile import mkdtemp
+
+from ..src.cmd_options import filterOptParse, getFullPathNamespace
+from ..src.doxyfile import (StagingError, StagingMarker, findInputFiles,
+                            getFilterArgs, prefilterDoxyfile, readDoxyfile,
+                            removeStaleFiles, splitValue)
+from ..src.doxypypy import filterFile
+
+
+class TestDoxyfile(unittest.TestCase):
+    """
+    Define our Doxyfile pre-filtering tests.
+    """
+
+    def setUp(self):
+        """
+        Builds a small project with a Doxyfile that filters through doxypypy3.
+        """
+        self.tempDir = mkdtemp()
+        self.srcDir = join(self.tempDir, 'src')
+        makedirs(join(self.srcDir, 'pkg', 'tests'))
+        copy('doxypypy3/test/sample_google.py', join(self.srcDir, 'top.py'))
+        copy('doxypypy3/test/sample_sections.py',
+             join(self.srcDir, 'pkg', 'sections.py'))
+        copy('doxypypy3/test/sample_pep.py',
+             join(self.srcDir, 'pkg', 'tests', 'test_pep.py'))
+        with open(join(self.srcDir, 'pkg', 'api.h'), 'w') as headerFile:
+            headerFile.write('int api(void);\n')
+        self.doxyfilePath = join(self.tempDir, 'Doxyfile')
+        with open(self.doxyfilePath, 'w') as doxyfile:
+            doxyfile.write('\n'.join([
+                '# A comment',
+                'PROJECT_NAME     = "Test Project"',
+                'INPUT            = {0}'.format(self.srcDir),
+                'FILE_PATTERNS    = *.py \\',
+                '                   *.h',
+                'RECURSIVE        = YES',
+                'EXCLUDE_PATTERNS = */tests/*',
+                'FILTER_PATTERNS  = "*.py=doxypypy3 -a -c --ns=pkg"',
+                'FILTER_PATTERNS += *.h=hfilter',
+                ''
+            ]))
+        self.derivedPath = join(self.tempDir, 'out', 'Doxyfile.derived')
+        self.stagingDir = join(self.tempDir, 'staging')
+
+    def tearDown(self):
+        """
+        Removes the project and its staging tree.
+        """
+        rmtree(self.tempDir)
+
+    def test_readDoxyfile(self):
+        """
+        Test parsing continuations, appends, and quoting.
+        """
+        config = readDoxyfile(self.doxyfilePath)
+        self.assertEqual(splitValue(config['FILE_PATTERNS']), ['*.py', '*.h'])
+        self.assertEqual(splitValue(config['FILTER_PATTERNS']),
+                         ['*.py=doxypypy3 -a -c --ns=pkg', '*.h=hfilter'])
+        self.assertEqual(splitValue(config['PROJECT_NAME']), ['Test Project'])
+
+    def test_getFilterArgs(self):
+        """
+        Test recognizing doxypypy3 filter commands.
+        """
+        self.assertEqual(getFilterArgs('doxypypy3 -a -c'), ['-a', '-c'])
+        self.assertEqual(getFilterArgs('/usr/bin/doxypypy3-client --ns=x'),
+                         ['--ns=x'])
+        self.assertEqual(getFilterArgs('python -m doxypypy3.main -a'), ['-a'])
+        self.assertIsNone(getFilterArgs('hfilter'))
+
+    def test_findInputFiles(self):
+        """
+        Test that inputs are found the way Doxygen finds them.
+        """
+        self.assertEqual(findInputFiles(readDoxyfile(self.doxyfilePath)), [
+            join(self.srcDir, 'top.py'),
+            join(self.srcDir, 'pkg', 'api.h'),
+            join(self.srcDir, 'pkg', 'sections.py')
+        ])
+
+    def test_prefilterDoxyfile(self):
+        """
+        Test staging the inputs and writing the derived Doxyfile.
+        """
+        self.assertEqual(prefilterDoxyfile(self.doxyfilePath, self.derivedPath,
+                                           self.stagingDir, jobs=2), (2, 0))
+        for inputFile in (join(self.srcDir, 'top.py'),
+                          join(self.srcDir, 'pkg', 'sections.py')):
+            options = filterOptParse(['-a', '-c', '--ns=pkg'])
+            options.fullPathNamespace = getFullPathNamespace(inputFile, 'pkg')
+            with open(self.stagingDir + inputFile) as stagedFile:
+                self.assertEqual(stagedFile.read(),
+                                 filterFile(inputFile, options) + '\n')
+        with open(join(self.stagingDir + self.srcDir, 'pkg', 'api.h')) as header:
+            self.assertEqual(header.read(), 'int api(void);\n')
+        self.assertFalse(exists(join(self.stagingDir + self.srcDir,
+                                     'pkg', 'tests')))
+
+        derived = readDoxyfile(self.derivedPath)
+        self.assertEqual(splitValue(derived['INPUT']),
+                         [self.stagingDir + self.srcDir])
+        self.assertEqual(splitValue(derived['FILTER_PATTERNS']),
+                         ['*.h=hfilter'])
+        self.assertEqual(derived['INPUT_FILTER'], '')
+        self.assertEqual(splitValue(derived['PROJECT_NAME']), ['Test Project'])
+
+    def test_stalePrefilteredFiles(self):
+        """
+        Test that files no longer among the inputs leave the staging tree.
+        """
+        prefilterDoxyfile(self.doxyfilePath, self.derivedPath, self.stagingDir)
+        stagedDir = join(self.stagingDir + self.srcDir, 'pkg')
+        self.assertTrue(exists(join(stagedDir, 'sections.py')))
+        unlink(join(self.srcDir, 'pkg', 'sections.py'))
+        unlink(join(self.srcDir, 'pkg', 'api.h'))
+        self.assertEqual(prefilterDoxyfile(self.doxyfilePath, self.derivedPath,
+                                           self.stagingDir), (1, 0))
+        self.assertFalse(exists(stagedDir))
+        self.assertTrue(exists(join(self.stagingDir + self.srcDir, 'top.py')))
+        self.assertTrue(exists(join(self.stagingDir, StagingMarker)))
+
+    def test_unmarkedStagingDir(self):
+        """
+        Test that a directory not staged by us is never cleaned out.
+        """
+        makedirs(self.stagingDir)
+        keptPath = join(self.stagingDir, 'keep.txt')
+        with open(keptPath, 'w') as keptFile:
+            keptFile.write('Not ours.\n')
+        self.assertRaises(StagingError, prefilterDoxyfile, self.doxyfilePath,
+                          self.derivedPath, self.stagingDir)
+        self.assertRaises(StagingError, removeStaleFiles, self.stagingDir,
+                          set())
+        self.assertTrue(exists(keptPath))
+        self.assertFalse(exists(self.derivedPath))
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
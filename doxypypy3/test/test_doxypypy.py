@@ -38,7 +38,9 @@ class TestDoxypypy(unittest.TestCase):
 
     __Options = namedtuple(
         'Options',
-        'autobrief autocode debug fullPathNamespace topLevelNamespace tablength'
+        'autobrief autocode debug fullPathNamespace topLevelNamespace tablength '
+        'maxSecondsPerFile',
+        defaults=(None,)
     )
     __dummySrc = [
         "print('testing: one, two, three, & four') " + linesep,
@@ -516,6 +518,23 @@ class TestDoxypypy(unittest.TestCase):
         self.assertEqual(self.dummyWalker.getLines(),
                          TestDoxypypy.__strippedDummySrc)
 
+    def test_writeLines(self):
+        """
+        Test that the streamed output is what gets printed, chunks or not.
+        """
+        from io import BytesIO
+        from unittest.mock import patch
+        for chunkSize in (1, 30, 1 << 16):
+            with patch('doxypypy3.src.doxypypy.OutputChunkSize', chunkSize):
+                outFile = BytesIO()
+                self.dummyWalker.writeLines(outFile)
+                self.assertEqual(outFile.getvalue(), (
+                    TestDoxypypy.__strippedDummySrc + linesep).encode('utf-8'))
+        emptyWalker = AstWalker([], self.options, 'empty.py')
+        outFile = BytesIO()
+        emptyWalker.writeLines(outFile)
+        self.assertEqual(outFile.getvalue(), linesep.encode('utf-8'))
+
     def test_parseLines(self):
         """
         Test the parseLines method.
@@ -669,12 +688,161 @@ class TestDoxypypy(unittest.TestCase):
         sampleName = 'doxypypy3/test/sample_maze.py'
         self.compareAgainstGoldStandard(sampleName)
 
+    def test_readSource(self):
+        """
+        Test that sources get decoded going by their BOM or coding cookie.
+        """
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        from unittest.mock import patch
+        from ..src.doxypypy import (openSourceBytes, readSourceLines,
+                                    splitSourceLines)
+        sources = [
+            (b'\xef\xbb\xbfx = "\xc3\xa9"\r\n', ['x = "\xe9"\n']),
+            (b'# -*- coding: latin-1 -*-\nx = "\xe9"\r',
+             ['# -*- coding: latin-1 -*-\n', 'x = "\xe9"\n']),
+            (b'x = 1\ny = 2', ['x = 1\n', 'y = 2']),
+        ]
+        tempDir = mkdtemp()
+        try:
+            sourceName = join(tempDir, 'source.py')
+            for source, lines in sources:
+                with open(sourceName, 'wb') as sourceFile:
+                    sourceFile.write(source)
+                self.assertEqual(readSourceLines(sourceName), lines)
+                self.assertEqual(splitSourceLines(source), lines)
+                with patch('doxypypy3.src.doxypypy.MmapThreshold', 1):
+                    with openSourceBytes(sourceName) as mapped:
+                        self.assertNotIsInstance(mapped, bytes)
+                        self.assertEqual(mapped[:], source)
+                with openSourceBytes(sourceName) as read:
+                    self.assertEqual(read, source)
+        finally:
+            rmtree(tempDir)
+
+    def test_timeBudget(self):
+        """
+        Test that a file outrunning its time budget gets passed through.
+        """
+        from signal import ITIMER_REAL, getitimer
+        from time import sleep
+        from unittest.mock import patch
+        from ..src.doxypypy import walkLines
+        lines = ['import os' + linesep,
+                 linesep,
+                 'def f():' + linesep,
+                 '    """' + linesep,
+                 '    Does nothing.' + linesep,
+                 '    """' + linesep]
+        unfiltered = linesep.join(line.rstrip() for line in lines)
+        options = self.options._replace(maxSecondsPerFile=0.05)
+        with patch.object(AstWalker, '_endCodeIfNeeded',
+                          side_effect=lambda *args: sleep(10)), \
+                patch('doxypypy3.src.doxypypy.stderr') as warnings:
+            self.assertEqual(
+                walkLines(list(lines), 'slow.py', options).getLines(),
+                unfiltered)
+        warning = ''.join(call[0][0] for call in
+                          warnings.write.call_args_list)
+        self.assertIn('slow.py', warning)
+        self.assertIn('line 4', warning)
+        self.assertEqual(getitimer(ITIMER_REAL), (0.0, 0.0))
+        self.assertNotEqual(
+            walkLines(list(lines), 'fast.py', options).getLines(), unfiltered)
+
+    def test_timerWithinBudget(self):
+        """
+        Test that timers outside a budget and pauses within it are kept to.
+        """
+        from signal import ITIMER_REAL, getitimer, setitimer
+        from time import sleep
+        from ..src.doxypypy import budgetPaused, timeBudget
+        setitimer(ITIMER_REAL, 100)
+        try:
+            with timeBudget(10):
+                sleep(0.1)
+            remaining = getitimer(ITIMER_REAL)[0]
+            self.assertGreater(remaining, 99)
+            self.assertLess(remaining, 100)
+        finally:
+            setitimer(ITIMER_REAL, 0)
+        with timeBudget(0.1):
+            with budgetPaused():
+                sleep(0.2)
+            self.assertGreater(getitimer(ITIMER_REAL)[0], 0)
+        self.assertEqual(getitimer(ITIMER_REAL), (0.0, 0.0))
+        with budgetPaused():
+            self.assertEqual(getitimer(ITIMER_REAL), (0.0, 0.0))
+
+    def test_needsWalk(self):
+        """
+        Test that the pre-scan only rules out sources walking doesn't change.
+        """
+        from ..src.doxypypy import PassThrough, needsWalk, walkLines
+        walked = [
+            '#!/usr/bin/env python\n\n# Comment\n"""Module."""\n',
+            '\ufeff"Module."\n',
+            'x = 1\ndef f(a,\n      b):  # Comment\n\n    r\'Doc.\'\n',
+            'def f() -> int: "Doc."\n',
+            'class A: \'Doc.\'\n',
+            'class A(object):\n    u"Doc."\n',
+            'class IFoo(Interface):\n    pass\n',
+            'x = Attribute("An attribute.")\n',
+            'implements(IFoo)\n',
+            '_x = 1\n',
+            'class A:\n    __y = 2\n',
+            'a = 1; _b = 2\n',
+            'class A: _x = 1\n',
+            'if c: _x = 1\n',
+            'for i in r: _last = i\n',
+        ]
+        for source in walked[-3:]:
+            lines = source.splitlines(True)
+            self.assertNotEqual(
+                walkLines(list(lines), 'source.py', self.options).getLines(),
+                walkLines(list(lines), 'source.py', self.options,
+                          PassThrough).getLines())
+        for source in walked:
+            self.assertTrue(needsWalk(source), source)
+            self.assertTrue(needsWalk(source.encode('utf-8')), source)
+        # Markers straddling the chunks searched for them are still found.
+        from unittest.mock import patch
+        with patch('doxypypy3.src.doxypypy.MarkerChunkSize', 7):
+            for chunkStart in range(7):
+                self.assertTrue(needsWalk(' ' * chunkStart +
+                                          'x = ATTRIBUTE \t("x")\n'))
+        notWalked = [
+            '',
+            'x = 1   \n',
+            '__all__ = [\n    "a",\n    "b",\n]\n',
+            'from .a import b as _b\n',
+            'd = {"a": "b", "c": f("d")}\nif _x == 1:\n    y = (1, "2")\n',
+            'class A(B):\n    x = "y"\n    def f(self, z=\'w\'):\n'
+            '        return z\n',
+            '_\u00e9 == 1\n',
+        ]
+        for source in notWalked:
+            self.assertFalse(needsWalk(source), source)
+            lines = source.splitlines(True)
+            self.assertEqual(
+                walkLines(list(lines), 'source.py', self.options).getLines(),
+                walkLines(list(lines), 'source.py', self.options,
+                          PassThrough).getLines())
+
     def test_utf8_bom(self):
         """
         Test a trivial UTF-8 file with a BOM.
         """
         sampleName = 'doxypypy3/test/sample_utf8bom.py'
         self.compareAgainstGoldStandard(sampleName, encoding="UTF-8-SIG")
+        # The filter itself handles the BOM too.
+        from ..src.cmd_options import filterOptParse
+        from ..src.doxypypy import filterFile
+        options = filterOptParse(['-a', '-c'])
+        options.fullPathNamespace = 'sample_utf8bom'
+        with open('doxypypy3/test/sample_utf8bom.outnn.py') as goldFile:
+            self.assertEqual(filterFile(sampleName, options),
+                             goldFile.read().rstrip())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests recognizing generated modules and passing them through.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from ..src.cache import OutputCache, filterFileCached, \
+    getOptionsFingerprint
+from ..src.cmd_options import filterOptParse, getFilterArgs
+from ..src.doxypypy import PassThrough, Stub, Walk, checkSource, \
+    filterFile, walkFile
+from ..src.generated import HeaderSize, getStubLines, isGenerated
+
+
+class TestGenerated(unittest.TestCase):
+    """
+    Define our generated module tests.
+    """
+
+    __generated = (
+        '# -*- coding: utf-8 -*-\n'
+        '# Generated by the protocol buffer compiler.  DO NOT EDIT!\n'
+        '# source: thing.proto\n'
+        '"""Generated protocol buffer code."""\n'
+        'def build():\n'
+        '    """Builds the descriptors."""\n'
+        '    return 1\n'
+    )
+
+    def setUp(self):
+        """
+        Makes a scratch directory for sources.
+        """
+        self.tempDir = mkdtemp()
+        self.options = filterOptParse(['-a', '-c'])
+        self.options.fullPathNamespace = 'thing'
+
+    def tearDown(self):
+        """
+        Removes the scratch directory.
+        """
+        rmtree(self.tempDir)
+
+    def __write(self, name, source):
+        """
+        Writes a source file into the scratch directory.
+        """
+        path = join(self.tempDir, name)
+        with open(path, 'w') as sourceFile:
+            sourceFile.write(source)
+        return path
+
+    def test_isGenerated(self):
+        """
+        Test that patterns and signatures are matched as documented.
+        """
+        plain = '"""A module."""\n'
+        self.assertTrue(isGenerated(plain, 'pkg/thing_pb2.py', self.options))
+        self.assertTrue(isGenerated(plain, 'thing_pb2_grpc.py', self.options))
+        self.assertFalse(isGenerated(plain, 'pkg_pb2/thing.py', self.options))
+        self.assertTrue(isGenerated(self.__generated, 'thing.py',
+                                    self.options))
+        self.assertTrue(isGenerated(self.__generated.encode('utf-8'),
+                                    'thing.py', self.options))
+        late = ' ' * HeaderSize + self.__generated
+        self.assertFalse(isGenerated(late, 'thing.py', self.options))
+        self.assertFalse(isGenerated(plain, 'thing.py', self.options))
+
+        options = filterOptParse(['--generated-pattern=*_gen.py',
+                                  '--generated-signature=Made By Robots'])
+        self.assertTrue(isGenerated(plain, 'thing_gen.py', options))
+        self.assertTrue(isGenerated('# made by robots\n', 'thing.py',
+                                    options))
+        self.assertTrue(isGenerated(plain, 'thing_pb2.py', options))
+
+        options = filterOptParse(['--generated=filter'])
+        self.assertFalse(isGenerated(self.__generated, 'thing_pb2.py',
+                                     options))
+
+    def test_handWrittenSignature(self):
+        """
+        Test that signatures only count in the comments heading a module.
+        """
+        handWritten = (
+            '#!/usr/bin/env python\n'
+            '"""Checks for generated code."""\n'
+            'MARKER = "# Generated by the protocol buffer compiler."\n'
+            'def check(text):\n'
+            '    """Looks for @generated or DO NOT EDIT in text."""\n'
+            '    return MARKER in text\n'
+        )
+        self.assertFalse(isGenerated(handWritten, 'check.py', self.options))
+        self.assertEqual(checkSource(handWritten, 'check.py', self.options),
+                         Walk)
+        self.assertTrue(isGenerated('\ufeff#!/usr/bin/env python\n\n' +
+                                    self.__generated, 'thing.py',
+                                    self.options))
+
+    def test_checkSource(self):
+        """
+        Test that the treatment follows the --generated option.
+        """
+        self.assertEqual(checkSource(self.__generated, 'thing.py',
+                                     self.options), PassThrough)
+        self.assertEqual(checkSource('x = 1\n', 'thing.py', self.options),
+                         PassThrough)
+        self.assertEqual(checkSource('"""Doc."""\n', 'thing.py',
+                                     self.options), Walk)
+        for generated, treatment in (('stub', Stub), ('filter', Walk)):
+            options = filterOptParse(['--generated=' + generated])
+            self.assertEqual(checkSource(self.__generated, 'thing.py',
+                                         options), treatment)
+
+    def test_passThrough(self):
+        """
+        Test that generated modules come out untouched, or beneath a stub.
+        """
+        path = self.__write('thing.py', self.__generated)
+        self.assertEqual(filterFile(path, self.options),
+                         self.__generated.rstrip('\n'))
+        options = filterOptParse(['-a', '-c', '--generated=stub'])
+        options.fullPathNamespace = 'thing'
+        self.assertEqual(filterFile(path, options),
+                         ''.join(getStubLines()) +
+                         self.__generated.rstrip('\n'))
+        options = filterOptParse(['-a', '-c', '--generated=filter'])
+        options.fullPathNamespace = 'thing'
+        self.assertIn('@brief Builds the descriptors.',
+                      filterFile(path, options))
+
+        # The cache keeps the outputs of the two modes apart.
+        cache = OutputCache(join(self.tempDir, 'cache'))
+        self.assertEqual(filterFileCached(path, self.options, cache),
+                         self.__generated.encode('utf-8'))
+        self.assertIn(b'@brief Builds the descriptors.',
+                      filterFileCached(path, options, cache))
+
+    def test_handWritten(self):
+        """
+        Test that hand-written modules are still filtered.
+        """
+        for sample in ('sample_google.py', 'sample_maze.py',
+                       'sample_sections.py'):
+            path = join('doxypypy3', 'test', sample)
+            with open(path, 'rb') as sampleFile:
+                self.assertEqual(checkSource(sampleFile.read(), path,
+                                             self.options), Walk)
+            self.assertIn('@brief', walkFile(path, self.options).getLines())
+
+    def test_options(self):
+        """
+        Test that the options reach the cache key and the rebuilt arguments.
+        """
+        args = ['--generated=stub', '--generated-pattern=*_gen.py',
+                '--generated-signature=made by robots']
+        options = filterOptParse(args)
+        self.assertEqual(getFilterArgs(options), args)
+        options.fullPathNamespace = 'thing'
+        defaults = filterOptParse([])
+        defaults.fullPathNamespace = 'thing'
+        self.assertNotEqual(getOptionsFingerprint(options),
+                            getOptionsFingerprint(defaults))
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
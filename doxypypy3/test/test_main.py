@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests what starting the filter entry point costs in imports.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from subprocess import run, PIPE
+from sys import executable
+
+
+def getImportTimes(args):
+    """
+    Runs the interpreter with -X importtime and the given arguments.
+
+    Returns the time each module took to import on its own, in
+    microseconds, by module name.
+    """
+    result = run([executable, '-X', 'importtime'] + args,
+                 stdout=PIPE, stderr=PIPE, check=True)
+    times = {}
+    for line in result.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:'):
+            continue
+        selfTime, _, name = line[len('import time:'):].split('|')
+        if selfTime.strip().isdigit():
+            times[name.strip()] = int(selfTime)
+    return times
+
+
+class TestMain(unittest.TestCase):
+    """
+    Define our entry point tests.
+    """
+
+    ## Modules only ever needed for --debug output.
+    __debugModules = ('icecream', 'pygments', 'colorama', 'executing',
+                      'asttokens')
+    ## How long filtering a file may spend importing, in microseconds,
+    # beyond what the interpreter imports to start up at all.
+    __importBudget = 100000
+
+    __sample = 'doxypypy3/test/sample_pep.py'
+
+    def test_importTime(self):
+        """
+        Test that filtering a file imports no more than it needs to.
+        """
+        baseline = getImportTimes(['-c', 'pass'])
+        args = ['-m', 'doxypypy3.main', '-a', '-c', TestMain.__sample]
+        # The first run may have to write bytecode caches.
+        getImportTimes(args)
+        times = getImportTimes(args)
+        imported = set(times) - set(baseline)
+        for name in imported:
+            self.assertNotIn(name.partition('.')[0], TestMain.__debugModules)
+        self.assertIn('doxypypy3.src.doxypypy', imported)
+        self.assertLess(sum(times[name] for name in imported),
+                        TestMain.__importBudget)
+
+    def test_debugOutput(self):
+        """
+        Test that --debug still gets its output, importing icecream for it.
+        """
+        result = run([executable, '-m', 'doxypypy3.main', '--debug',
+                      TestMain.__sample], stdout=PIPE, stderr=PIPE,
+                     check=True)
+        self.assertIn(b'Module', result.stderr)
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests the pack backend of the output cache.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os import listdir
+from os.path import getsize, join
+from shutil import rmtree
+from subprocess import run, PIPE
+from sys import executable
+from tempfile import mkdtemp
+
+from ..src.cache import openCache
+from ..src.pack import IndexFile, MaxUnsorted, PackCache, getPackName
+
+
+class TestPack(unittest.TestCase):
+    """
+    Define our pack cache tests.
+    """
+
+    __sample = 'doxypypy3/test/sample_google.py'
+
+    def setUp(self):
+        """
+        Sets up an empty pack cache.
+        """
+        self.cacheDir = mkdtemp()
+        self.cache = PackCache(self.cacheDir)
+
+    def tearDown(self):
+        """
+        Removes the cache.
+        """
+        self.cache.close()
+        rmtree(self.cacheDir)
+
+    @staticmethod
+    def getKey(entryNum):
+        """Returns a made up key."""
+        return '{0:064x}'.format(entryNum * 7919)
+
+    def test_putAndGet(self):
+        """
+        Test lookups in both the sorted and the unsorted part of the index.
+        """
+        entryCount = MaxUnsorted + 10
+        for entryNum in range(entryCount):
+            self.cache.put(self.getKey(entryNum), b'output %d' % entryNum,
+                           '0' * 64)
+        # Another process sees everything written, whichever part it's in.
+        reader = PackCache(self.cacheDir)
+        for entryNum in range(entryCount):
+            self.assertEqual(reader.get(self.getKey(entryNum)),
+                             b'output %d' % entryNum)
+        self.assertIsNone(reader.get(self.getKey(entryCount)))
+        reader.close()
+        self.assertEqual(self.cache.getStats()['entries'], entryCount)
+
+    def test_compact(self):
+        """
+        Test that compaction drops replaced entries but keeps live ones.
+        """
+        for roundNum in range(3):
+            for entryNum in range(5):
+                self.cache.put(self.getKey(entryNum),
+                               b'round %d' % roundNum * 100, '0' * 64)
+        packPath = join(self.cacheDir, getPackName(0))
+        oldSize = getsize(packPath)
+        removedCount, removedSize = self.cache.compact()
+        self.assertEqual(removedCount, 10)
+        self.assertEqual(getsize(join(self.cacheDir, getPackName(1))),
+                         oldSize - removedSize)
+        self.assertNotIn(getPackName(0), listdir(self.cacheDir))
+        for entryNum in range(5):
+            self.assertEqual(self.cache.get(self.getKey(entryNum)),
+                             b'round 2' * 100)
+
+    def test_maxSize(self):
+        """
+        Test that the least recently written entries go once over the limit.
+        """
+        cache = PackCache(self.cacheDir, maxSize=4096)
+        for entryNum in range(20):
+            # Incompressible output of a few hundred bytes.
+            cache.put(self.getKey(entryNum), bytes(range(256)) * 2, '0' * 64)
+        self.assertLessEqual(cache.getStats()['bytes'], 4096)
+        self.assertIsNone(cache.get(self.getKey(0)))
+        self.assertIsNotNone(cache.get(self.getKey(19)))
+        cache.close()
+
+    def test_identicalOutput(self):
+        """
+        Test that output from a pack cache is what the filter prints.
+        """
+        args = [executable, '-m', 'doxypypy3.main', '-a', '-c',
+                TestPack.__sample]
+        direct = run(args, stdout=PIPE).stdout
+        for cacheFormat in ('pack', 'files'):
+            # Once there's a pack, the cache sticks with it.
+            cached = run(args + ['--cache-dir', self.cacheDir,
+                                 '--cache-format', cacheFormat], stdout=PIPE)
+            self.assertEqual(cached.stdout, direct)
+        self.assertIn(IndexFile, listdir(self.cacheDir))
+        self.assertEqual([name for name in listdir(self.cacheDir)
+                          if len(name) == 2], [])
+        self.assertIsInstance(openCache(self.cacheDir), PackCache)
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests writing build rules for the filter step.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os import environ, getcwd, makedirs, utime
+from os.path import abspath, exists, join
+from shutil import copy, copytree, rmtree, which
+from subprocess import run, PIPE
+from sys import executable
+from tempfile import mkdtemp
+from time import time
+
+from ..src.batch import filterTree
+from ..src.cmd_options import batchOptParse, rulesOptParse
+from ..src.rules import formatNinja, getEdges
+
+
+class TestRules(unittest.TestCase):
+    """
+    Define our build rule tests.
+    """
+
+    def setUp(self):
+        """
+        Builds a small source tree.
+        """
+        self.tempDir = mkdtemp()
+        self.srcDir = join(self.tempDir, 'src')
+        self.outDir = join(self.tempDir, 'out')
+        makedirs(join(self.srcDir, 'pkg'))
+        copy('doxypypy3/test/sample_google.py', join(self.srcDir, 'top.py'))
+        copy('doxypypy3/test/sample_interfaces.py',
+             join(self.srcDir, 'pkg', 'iface.py'))
+
+    def tearDown(self):
+        """
+        Removes the source tree and its mirror.
+        """
+        rmtree(self.tempDir)
+
+    def test_ninja(self):
+        """
+        Test that every source gets an edge with the options baked in.
+        """
+        (options, srcDir, outDir) = rulesOptParse(
+            ['-a', '--ns=pkg', self.srcDir, 'out dir'])
+        self.assertEqual(options.rulesFormat, 'ninja')
+        ninja = formatNinja(getEdges(srcDir, outDir, options), options)
+        self.assertIn(' -m doxypypy3.main --autobrief --ns=pkg\n', ninja)
+        self.assertIn('build out$ dir/pkg/iface.py: doxypypy3 {0}\n'.format(
+            join(self.srcDir, 'pkg', 'iface.py')), ninja)
+        self.assertIn('# pkg.iface\n', ninja)
+        self.assertIn('build doxypypy3-filtered: phony out$ dir/top.py '
+                      'out$ dir/pkg/iface.py\n', ninja)
+
+    @unittest.skipUnless(which('make'), "needs make")
+    def test_make(self):
+        """
+        Test that make filters just like the batch subcommand, incrementally.
+        """
+        makefilePath = join(self.tempDir, 'filter.mk')
+        args = ['-a', '-c', '--ns=pkg', self.srcDir, self.outDir]
+        run([executable, '-m', 'doxypypy3.main', 'rules',
+             '-o', makefilePath] + args, check=True)
+        env = dict(environ, PYTHONPATH=abspath(getcwd()))
+        make = ['make', '-f', makefilePath, 'doxypypy3-filtered']
+        self.assertEqual(run(make, env=env, stdout=PIPE).returncode, 0)
+        batchDir = join(self.tempDir, 'batch')
+        (options, srcDir, _) = batchOptParse(args)
+        filterTree(srcDir, batchDir, options)
+        for relName in ('top.py', join('pkg', 'iface.py')):
+            with open(join(self.outDir, relName), 'rb') as madeFile, \
+                    open(join(batchDir, relName), 'rb') as batchFile:
+                self.assertEqual(madeFile.read(), batchFile.read())
+        # Up to date until a source changes.
+        self.assertEqual(run(make + ['-q'], env=env).returncode, 0)
+        utime(join(self.srcDir, 'top.py'), (time() + 10, time() + 10))
+        self.assertEqual(run(make + ['-q'], env=env).returncode, 1)
+
+    @unittest.skipUnless(which('make'), "needs make")
+    def test_makeSpaces(self):
+        """
+        Test that make copes with spaces and dollars in paths.
+        """
+        makefilePath = join(self.tempDir, 'filter.mk')
+        srcDir = join(self.tempDir, 'my src')
+        outDir = join(self.tempDir, 'out $dir')
+        copytree(self.srcDir, srcDir)
+        run([executable, '-m', 'doxypypy3.main', 'rules', '--format=make',
+             '-o', makefilePath, srcDir, outDir], check=True)
+        env = dict(environ, PYTHONPATH=abspath(getcwd()))
+        make = ['make', '-f', makefilePath, 'doxypypy3-filtered']
+        self.assertEqual(run(make, env=env, stdout=PIPE).returncode, 0)
+        for relName in ('top.py', join('pkg', 'iface.py')):
+            self.assertTrue(exists(join(outDir, relName)))
+            self.assertTrue(exists(join(outDir, relName + '.d')))
+        self.assertEqual(run(make + ['-q'], env=env).returncode, 0)
+        utime(join(srcDir, 'top.py'), (time() + 10, time() + 10))
+        self.assertEqual(run(make + ['-q'], env=env).returncode, 1)
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests re-filtering only the top-level definitions that changed.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from glob import glob
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep
+from unittest.mock import patch
+
+from ..src.cache import OutputCache
+from ..src.cmd_options import filterOptParse
+from ..src.doxypypy import filterFile, readSourceLines
+from ..src.segments import SegmentWalker, filterFileBySegments
+
+
+class TestSegments(unittest.TestCase):
+    """
+    Define our segment cache tests.
+    """
+
+    __optionSets = [['-a', '-c', '--ns=sample'], ['-a'], ['-c'], []]
+
+    def setUp(self):
+        """
+        Sets up an empty cache.
+        """
+        self.tempDir = mkdtemp()
+        self.cache = OutputCache(join(self.tempDir, 'cache'))
+
+    def tearDown(self):
+        """
+        Removes the cache.
+        """
+        rmtree(self.tempDir)
+
+    def filterBySegments(self, inFilename, options):
+        """Filters a file through the segment cache, returning the walker."""
+        segmentWalker = SegmentWalker(readSourceLines(inFilename), options,
+                                      inFilename, self.cache)
+        segmentWalker.parseLines()
+        return segmentWalker
+
+    def test_matchesFullRun(self):
+        """
+        Test that cold and warm runs both produce exactly the full output.
+        """
+        for sampleName in sorted(glob('doxypypy3/test/sample_*.py')):
+            if '.out' in sampleName:
+                continue
+            for args in TestSegments.__optionSets:
+                options = filterOptParse(args)
+                options.fullPathNamespace = 'sample'
+                try:
+                    expected = filterFile(sampleName, options)
+                except SyntaxError:
+                    # Whatever the full run can't parse, neither can we.
+                    self.assertRaises(SyntaxError, self.filterBySegments,
+                                      sampleName, options)
+                    continue
+                for _ in range(2):
+                    segmentWalker = self.filterBySegments(sampleName, options)
+                    self.assertEqual(segmentWalker.getLines(), expected,
+                                     '{0} {1}'.format(sampleName, args))
+                self.assertEqual(segmentWalker.segmentMisses, 0)
+
+    def test_onlyChangedSegment(self):
+        """
+        Test that editing one method re-walks only its own class.
+        """
+        options = filterOptParse(['-a', '-c'])
+        options.fullPathNamespace = 'sample'
+        editedName = join(self.tempDir, 'edited.py')
+        with open('doxypypy3/test/sample_google.py') as sampleFile:
+            source = sampleFile.read()
+        with open(editedName, 'w') as editedFile:
+            editedFile.write(source)
+        firstRun = self.filterBySegments(editedName, options)
+        self.assertEqual(firstRun.segmentHits, 0)
+        with open(editedName, 'w') as editedFile:
+            editedFile.write(source.replace('def public_method(self):',
+                                            'def public_method(self, x=1):'))
+        secondRun = self.filterBySegments(editedName, options)
+        self.assertEqual(secondRun.segmentMisses, 1)
+        self.assertEqual(secondRun.segmentHits, firstRun.segmentMisses - 1)
+        self.assertEqual(secondRun.getLines(), filterFile(editedName, options))
+
+    def test_leakingSegment(self):
+        """
+        Test that a definition walked beyond its own lines isn't cached.
+        """
+        options = filterOptParse(['-a', '-c'])
+        options.fullPathNamespace = 'leak'
+        leakName = join(self.tempDir, 'leak.py')
+        source = (
+            'def f():\n'
+            '    \'Single-quoted docstring.\'\n'
+            '    return 1\n'
+            '\n'
+            '\n'
+            'def g(x):\n'
+            '    """Returns the value.\n'
+            '\n'
+            '    Args:\n'
+            '        x: a value\n'
+            '    """\n'
+            '    return x\n'
+        )
+        for edited in (source, source.replace('def g(x):', 'def g(x, y=1):')
+                       .replace('a value', 'the value')):
+            with open(leakName, 'w') as leakFile:
+                leakFile.write(edited)
+            self.assertTrue(self.filterBySegments(leakName, options).leaked)
+            self.assertEqual(filterFileBySegments(leakName, options,
+                                                  self.cache),
+                             (filterFile(leakName, options), True))
+            self.assertEqual(
+                self.filterBySegments(leakName, options).segmentHits, 0)
+
+    def test_cacheOutsideBudget(self):
+        """
+        Test that slow cache writes don't count against the time budget.
+        """
+        options = filterOptParse(['-a', '-c', '--max-seconds-per-file=0.1'])
+        options.fullPathNamespace = 'sample'
+        sampleName = 'doxypypy3/test/sample_google.py'
+        put = self.cache.put
+
+        def slowPut(*args):
+            """Stores an entry, taking its time about it."""
+            sleep(0.05)
+            put(*args)
+
+        with patch.object(self.cache, 'put', side_effect=slowPut):
+            self.assertEqual(filterFileBySegments(sampleName, options,
+                                                  self.cache),
+                             (filterFile(sampleName, options), True))
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
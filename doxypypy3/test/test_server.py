@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests the persistent filter server and its thin client.
+
+These tests run the real entry points as subprocesses, the same way
+Doxygen would, and so need to be run from the top-level directory.
+"""
+import unittest
+from os import environ, listdir, stat
+from os.path import exists, join
+from stat import S_IMODE
+from shutil import rmtree
+from subprocess import run, PIPE
+from sys import executable
+from tempfile import mkdtemp
+from time import sleep
+
+
+class TestServer(unittest.TestCase):
+    """
+    Define our filter server tests.
+    """
+
+    __samples = [
+        'doxypypy3/test/sample_google.py',
+        'doxypypy3/test/sample_interfaces.py',
+        'doxypypy3/test/sample_sections.py'
+    ]
+
+    def setUp(self):
+        """
+        Points the client at a private socket with a short idle timeout.
+        """
+        self.tempDir = mkdtemp()
+        self.socketPath = join(self.tempDir, 'filter.sock')
+        self.env = dict(environ,
+                        DOXYPYPY3_SOCKET=self.socketPath,
+                        DOXYPYPY3_IDLE_TIMEOUT='1')
+
+    def tearDown(self):
+        """
+        Waits for the server to go idle and cleans up after it.
+        """
+        for _ in range(50):
+            if not exists(self.socketPath):
+                break
+            sleep(0.1)
+        rmtree(self.tempDir)
+
+    def runModule(self, module, *args):
+        """
+        Runs one of our entry points and returns its completed process.
+        """
+        return run([executable, '-m', module] + list(args),
+                   stdout=PIPE, stderr=PIPE, env=self.env)
+
+    def test_identicalOutput(self):
+        """
+        Test that the client produces exactly what main() produces.
+        """
+        for sampleName in TestServer.__samples:
+            for args in (['-a', '-c', '--ns=sample'], []):
+                direct = self.runModule('doxypypy3.main', *(args + [sampleName]))
+                viaServer = self.runModule('doxypypy3.src.client',
+                                           *(args + [sampleName]))
+                self.assertEqual(viaServer.returncode, direct.returncode)
+                self.assertEqual(viaServer.stdout, direct.stdout)
+        self.assertTrue(exists(self.socketPath))
+
+    def test_errorStatus(self):
+        """
+        Test that errors are reported just like main() reports them.
+        """
+        direct = self.runModule('doxypypy3.main')
+        viaServer = self.runModule('doxypypy3.src.client')
+        self.assertEqual(viaServer.returncode, direct.returncode)
+        self.assertEqual(viaServer.stderr, direct.stderr)
+
+    def test_clientEnvironment(self):
+        """
+        Test that the filter sees the client's environment, not the server's.
+        """
+        cacheDir = join(self.tempDir, 'cache')
+        self.runModule('doxypypy3.src.client', TestServer.__samples[0])
+        self.env['DOXYPYPY3_CACHE_DIR'] = cacheDir
+        self.runModule('doxypypy3.src.client', TestServer.__samples[0])
+        self.assertTrue(exists(cacheDir))
+
+    def test_privateSocketDir(self):
+        """
+        Test that the default socket lives in a directory only we can access.
+        """
+        del self.env['DOXYPYPY3_SOCKET']
+        self.env['XDG_RUNTIME_DIR'] = self.tempDir
+        direct = self.runModule('doxypypy3.main', TestServer.__samples[0])
+        viaServer = self.runModule('doxypypy3.src.client',
+                                   TestServer.__samples[0])
+        self.assertEqual(viaServer.stdout, direct.stdout)
+        privateDirs = [name for name in listdir(self.tempDir)
+                       if name.startswith('doxypypy3-')]
+        self.assertEqual(len(privateDirs), 1)
+        privateDir = join(self.tempDir, privateDirs[0])
+        self.assertEqual(S_IMODE(stat(privateDir).st_mode), 0o700)
+        self.socketPath = join(privateDir, listdir(privateDir)[0])
+
+    def test_idleShutdown(self):
+        """
+        Test that the server removes its socket once it goes idle.
+        """
+        self.runModule('doxypypy3.src.client', TestServer.__samples[0])
+        self.assertTrue(exists(self.socketPath))
+        sleep(3)
+        self.assertFalse(exists(self.socketPath))
+
+    def test_warmParent(self):
+        """
+        Test that the server is warm before it accepts any connection.
+        """
+        # Reports, in place of serving, whatever is still left to load.
+        script = (
+            'import sys\n'
+            'from doxypypy3.src import server\n'
+            'from doxypypy3.src.compile import RE, _Lazy\n'
+            'from doxypypy3.src.doxypypy import DeferredImports\n'
+            'def report(self):\n'
+            '    print(sorted(\n'
+            '        [name for name, value in vars(RE).items()\n'
+            '         if isinstance(value, _Lazy)] +\n'
+            '        [name for name in DeferredImports\n'
+            '         if name.replace(".", "doxypypy3.src.", 1)\n'
+            '         not in sys.modules]))\n'
+            'server.FilterServer.serveUntilIdle = report\n'
+            'server.serve(sys.argv[1], 1)\n'
+        )
+        result = run([executable, '-c', script, self.socketPath],
+                     stdout=PIPE, stderr=PIPE, env=self.env, check=True)
+        self.assertEqual(result.stdout, b'[]\n')
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests splitting the filter workload into shards and merging them again.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os import makedirs, walk
+from os.path import join, relpath
+from shutil import copy, rmtree
+from tempfile import mkdtemp
+
+from ..src.batch import ManifestFile, filterTree, readManifest
+from ..src.cmd_options import batchOptParse, parseShard
+from ..src.shard import MergeError, ShardSlack, assignShards, mergeMirrors
+
+
+class TestShard(unittest.TestCase):
+    """
+    Define our sharding tests.
+    """
+
+    __samples = [
+        'doxypypy3/test/sample_google.py',
+        'doxypypy3/test/sample_interfaces.py',
+        'doxypypy3/test/sample_maze.py',
+        'doxypypy3/test/sample_pep.py',
+        'doxypypy3/test/sample_sections.py'
+    ]
+
+    def setUp(self):
+        """
+        Builds a source tree with a few packages.
+        """
+        self.tempDir = mkdtemp()
+        self.srcDir = join(self.tempDir, 'src')
+        for packageNum in range(3):
+            packageDir = join(self.srcDir, 'pkg{0}'.format(packageNum))
+            makedirs(packageDir)
+            for sample in TestShard.__samples:
+                copy(sample, packageDir)
+
+    def tearDown(self):
+        """
+        Removes the source tree and its mirrors.
+        """
+        rmtree(self.tempDir)
+
+    def readTree(self, treeDir):
+        """Returns the contents of every file of a mirror by relative path."""
+        contents = {}
+        for dirPath, _, fileNames in walk(treeDir):
+            for fileName in fileNames:
+                with open(join(dirPath, fileName), 'rb') as treeFile:
+                    contents[relpath(join(dirPath, fileName),
+                                     treeDir)] = treeFile.read()
+        return contents
+
+    def test_parseShard(self):
+        """
+        Test that shards count from one and nonsense is refused.
+        """
+        self.assertEqual(parseShard('1/4'), (0, 4))
+        self.assertEqual(parseShard('4/4'), (3, 4))
+        for text in ('0/4', '5/4', '1/0', '1', 'a/b', '1/2/3'):
+            self.assertRaises(ValueError, parseShard, text)
+
+    def test_assignShards(self):
+        """
+        Test that shards are balanced and few files move as others come.
+        """
+        costs = dict(('mod{0}.py'.format(fileNum), 1000 + fileNum * 37 % 5000)
+                     for fileNum in range(400))
+        shards = assignShards(costs, 4)
+        self.assertEqual(shards, assignShards(dict(costs), 4))
+        loads = [0] * 4
+        for relName, shardNum in shards.items():
+            loads[shardNum] += costs[relName]
+        for load in loads:
+            self.assertLessEqual(load, (1 + ShardSlack) * sum(costs.values()) / 4)
+        moreCosts = dict(costs)
+        moreCosts.update(('new{0}.py'.format(fileNum), 3000)
+                         for fileNum in range(4))
+        moreShards = assignShards(moreCosts, 4)
+        movedCount = sum(shards[relName] != moreShards[relName]
+                         for relName in costs)
+        self.assertLess(movedCount, len(costs) // 20)
+
+    def test_mergedShards(self):
+        """
+        Test that merged shard mirrors match a mirror filtered in one go.
+        """
+        wholeDir = join(self.tempDir, 'whole')
+        (options, srcDir, outDir) = batchOptParse(['-a', self.srcDir,
+                                                   wholeDir])
+        self.assertEqual(filterTree(srcDir, outDir, options), (15, 0))
+        shardDirs = []
+        filteredCount = 0
+        for shardNum in range(1, 4):
+            shardDir = join(self.tempDir, 'shard{0}'.format(shardNum))
+            (options, srcDir, outDir) = batchOptParse(
+                ['-a', '--shard={0}/3'.format(shardNum), self.srcDir, shardDir])
+            filtered, failed = filterTree(srcDir, outDir, options, options.shard)
+            self.assertTrue(filtered)
+            filteredCount += filtered
+            shardDirs.append(shardDir)
+        self.assertEqual(filteredCount, 15)
+        mergedDir = join(self.tempDir, 'merged')
+        self.assertEqual(mergeMirrors(mergedDir, shardDirs), 15)
+        merged = self.readTree(mergedDir)
+        whole = self.readTree(wholeDir)
+        del merged[ManifestFile], whole[ManifestFile]
+        self.assertEqual(merged, whole)
+        self.assertEqual(readManifest(mergedDir), readManifest(wholeDir))
+        self.assertRaises(MergeError, mergeMirrors, mergedDir,
+                          shardDirs + [wholeDir])
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
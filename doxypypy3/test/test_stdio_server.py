@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests filtering files sent as frames over stdin.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from io import BytesIO
+from json import dumps
+from os.path import abspath
+from subprocess import run, PIPE
+from sys import executable
+
+from ..src.stdio_server import (ErrorKind, OutputKind, ResponseHeader,
+                                writeFrame)
+
+
+class TestStdioServer(unittest.TestCase):
+    """
+    Define our framed stdin/stdout tests.
+    """
+
+    __samples = [
+        'doxypypy3/test/sample_google.py',
+        'doxypypy3/test/sample_interfaces.py'
+    ]
+
+    @staticmethod
+    def makeRequest(path, args, source):
+        """Returns the frames of a single request."""
+        stream = BytesIO()
+        writeFrame(stream, path.encode('utf-8'))
+        writeFrame(stream, args.encode('utf-8'))
+        writeFrame(stream, source)
+        return stream.getvalue()
+
+    @staticmethod
+    def readResponses(data):
+        """Splits the responses up into (kind, payload) pairs."""
+        responses = []
+        while data:
+            kind, size = ResponseHeader.unpack_from(data)
+            start = ResponseHeader.size
+            responses.append((kind, data[start:start + size]))
+            data = data[start + size:]
+        return responses
+
+    def test_serveStdio(self):
+        """
+        Test that outputs match the filter and errors don't end the stream.
+        """
+        requests = []
+        expected = []
+        for sample, args in zip(TestStdioServer.__samples,
+                                [['-a', '--ns=test'], []]):
+            path = abspath(sample)
+            with open(path, 'rb') as sampleFile:
+                requests.append(TestStdioServer.makeRequest(
+                    path, dumps(args) if args else '',
+                    sampleFile.read()))
+            expected.append((OutputKind, run(
+                [executable, '-m', 'doxypypy3.main', '-c'] + args + [path],
+                stdout=PIPE, check=True).stdout))
+        requests.insert(1, TestStdioServer.makeRequest(
+            'broken.py', '', b'def broken(:\n    """Doc."""\n'))
+        requests.insert(2, TestStdioServer.makeRequest(
+            'options.py', '["--tablength=many"]', b'x = 1\n'))
+        served = run([executable, '-m', 'doxypypy3.main', '-c',
+                      '--serve-stdio'], input=b''.join(requests),
+                     stdout=PIPE, stderr=PIPE)
+        self.assertEqual(served.returncode, 0)
+        responses = TestStdioServer.readResponses(served.stdout)
+        self.assertEqual(len(responses), 4)
+        self.assertEqual([responses[0], responses[3]], expected)
+        self.assertEqual(responses[1][0], ErrorKind)
+        self.assertIn(b'SyntaxError', responses[1][1])
+        self.assertEqual(responses[2][0], ErrorKind)
+
+    def test_optionsPerRequest(self):
+        """
+        Test that the options of one request don't stay for the next.
+        """
+        source = b'# Made by robots.\ndef f():\n    """Does nothing."""\n'
+        request = TestStdioServer.makeRequest(
+            'robots.py', '["--generated-signature=made by robots"]', source)
+        served = run([executable, '-m', 'doxypypy3.main', '-a',
+                      '--serve-stdio', '--generated-signature=made by hand'],
+                     input=request + TestStdioServer.makeRequest(
+                         'robots.py', '', source),
+                     stdout=PIPE, stderr=PIPE, check=True)
+        responses = TestStdioServer.readResponses(served.stdout)
+        self.assertEqual(responses[0], (OutputKind, source))
+        self.assertEqual(responses[1][0], OutputKind)
+        self.assertIn(b'## @brief Does nothing.', responses[1][1])
+
+    def test_truncatedRequest(self):
+        """
+        Test that a stream ending within a request is reported.
+        """
+        request = TestStdioServer.makeRequest('mod.py', '', b'x = 1\n')
+        served = run([executable, '-m', 'doxypypy3.main', '--serve-stdio'],
+                     input=request + request[:-3], stdout=PIPE, stderr=PIPE)
+        self.assertEqual(served.returncode, 1)
+        self.assertEqual(TestStdioServer.readResponses(served.stdout),
+                         [(OutputKind, b'x = 1\n')])
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests keeping a filtered mirror up to date as the sources change.
+
+These tests need to be run from the top-level directory.
+"""
+import unittest
+from os import makedirs, unlink
+from os.path import join, exists
+from shutil import copy, rmtree
+from subprocess import Popen, run, PIPE, DEVNULL
+from sys import executable
+from tempfile import mkdtemp
+from time import sleep, time
+
+from ..src.watch import InotifyWatcher, PollingWatcher
+
+
+class TestWatch(unittest.TestCase):
+    """
+    Define our watch tests.
+    """
+
+    __samples = [
+        'doxypypy3/test/sample_google.py',
+        'doxypypy3/test/sample_interfaces.py'
+    ]
+
+    def setUp(self):
+        """
+        Builds a small source tree with a package.
+        """
+        self.tempDir = mkdtemp()
+        self.srcDir = join(self.tempDir, 'src')
+        self.outDir = join(self.tempDir, 'out')
+        makedirs(join(self.srcDir, 'pkg'))
+        copy(TestWatch.__samples[0], join(self.srcDir, 'top.py'))
+        copy(TestWatch.__samples[1], join(self.srcDir, 'pkg', 'iface.py'))
+
+    def tearDown(self):
+        """
+        Removes the source tree and its mirror.
+        """
+        rmtree(self.tempDir)
+
+    def waitFor(self, condition, timeout=20):
+        """Waits for the condition to come true, failing if it doesn't."""
+        deadline = time() + timeout
+        while not condition():
+            if time() > deadline:
+                self.fail("gave up waiting after {0} seconds".format(timeout))
+            sleep(0.05)
+
+    def test_inotifyWatcher(self):
+        """
+        Test that saved files, new directories and deletions are reported.
+        """
+        try:
+            watcher = InotifyWatcher(self.srcDir)
+        except (OSError, AttributeError):
+            self.skipTest("inotify isn't available here")
+        try:
+            self.assertEqual(watcher.poll(0), [])
+            with open(join(self.srcDir, 'top.py'), 'a') as topFile:
+                topFile.write('\n# One more line.\n')
+            self.assertEqual(watcher.poll(5), ['top.py'])
+            makedirs(join(self.srcDir, 'new'))
+            with open(join(self.srcDir, 'new', 'mod.py'), 'w') as modFile:
+                modFile.write('x = 1\n')
+            changedPaths = set()
+            while join('new', 'mod.py') not in changedPaths:
+                changedPaths.update(watcher.poll(5) or self.fail('no change'))
+            rmtree(join(self.srcDir, 'pkg'))
+            self.assertIsNone(watcher.poll(5))
+        finally:
+            watcher.close()
+
+    def test_pollingWatcher(self):
+        """
+        Test that polling spots changed, new and deleted files.
+        """
+        watcher = PollingWatcher(self.srcDir, patterns=['*.py'], interval=0.05)
+        self.assertEqual(watcher.poll(0), [])
+        with open(join(self.srcDir, 'top.py'), 'a') as topFile:
+            topFile.write('\n# One more line.\n')
+        copy(TestWatch.__samples[0], join(self.srcDir, 'pkg', 'new.py'))
+        unlink(join(self.srcDir, 'pkg', 'iface.py'))
+        self.assertEqual(sorted(watcher.poll(1)),
+                         [join('pkg', 'iface.py'), join('pkg', 'new.py'),
+                          'top.py'])
+        self.assertEqual(watcher.poll(0.1), [])
+
+    def test_watchSubcommand(self):
+        """
+        Test that the mirror follows edits and deletions of the sources.
+        """
+        topName = join(self.srcDir, 'top.py')
+        mirrorName = join(self.outDir, 'top.py')
+        watcher = Popen([executable, '-m', 'doxypypy3.main', 'watch', '-a',
+                         '--poll', '--interval=0.05', '--debounce=0.1',
+                         self.srcDir, self.outDir],
+                        stdout=DEVNULL, stderr=DEVNULL)
+        try:
+            self.waitFor(lambda: exists(join(self.outDir, 'pkg', 'iface.py')))
+            with open(topName, 'a') as topFile:
+                topFile.write('\ndef added():\n    """Added later."""\n')
+            direct = run([executable, '-m', 'doxypypy3.main', '-a', topName],
+                         stdout=PIPE).stdout
+
+            def mirrorUpdated():
+                with open(mirrorName, 'rb') as mirrorFile:
+                    return mirrorFile.read() == direct
+            self.waitFor(mirrorUpdated)
+            unlink(join(self.srcDir, 'pkg', 'iface.py'))
+            self.waitFor(lambda: not exists(join(self.outDir, 'pkg')))
+        finally:
+            watcher.terminate()
+            watcher.wait()
+
+
+if __name__ == '__main__':
+    # When executed from the command line, run all the tests via unittest.
+    from unittest import main
+
+    main()
@@ -16,10 +16,11 @@ setup(
     author='Eric W. Brown',
     url='https://github.com/625781186/doxypypy3',
     packages=find_packages(),
-    test_suite='doxypypy3.test.test_doxypypy',
+    test_suite='doxypypy3.test',
     entry_points={
         'console_scripts': [
-            'doxypypy3 = doxypypy3.main:main'
+            'doxypypy3 = doxypypy3.main:main',
+            'doxypypy3-client = doxypypy3.src.client:main'
         ]
     },
     classifiers=[
@@ -38,6 +39,5 @@ setup(
     ],
     install_requires=[
         'icecream',
-        'goto-statement',
     ],
 )